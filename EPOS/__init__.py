@@ -1,8 +1,30 @@
 __all__ = ['epos','fitparameters','kepler','rv','run','population','plot','occurrence',
 	'fitfunctions','pfmodel','massradius','regression','multi','analytics','save',
-	'scripts']
+	'scripts','surrogate','samplers','timing','benchmark','equivalence','cache',
+	'catalog','batch','joint','stars','completeness','tags']
 #from matplotlib import use; use('Agg') # For hatching (crap anyways)
-import kepler, rv, run, plot, occurrence, population
-import fitfunctions, pfmodel, regression, massradius, multi, analytics, save
-import scripts
-from classes import epos, fitparameters
\ No newline at end of file
+import sys, os, types, importlib
+from classes import epos, fitparameters
+
+'''
+Submodules are imported on first use, f.e. EPOS.plot imports matplotlib only
+when plotting. Set the environment variable EPOS_HEADLESS=1 to plot without
+a display (compute nodes, batch jobs)
+'''
+headless= os.environ.get('EPOS_HEADLESS', '0') not in ['', '0']
+
+class _lazymodule(types.ModuleType):
+	def __getattr__(self, name):
+		if name in __all__:
+			module= importlib.import_module('{}.{}'.format(__name__, name))
+			setattr(self, name, module)
+			return module
+		raise AttributeError("'module' object has no attribute '{}'".format(name))
+
+	def __dir__(self):
+		return sorted(set(self.__dict__) | set(__all__))
+
+_module= _lazymodule(__name__)
+_module.__dict__.update(sys.modules[__name__].__dict__)
+_module._original= sys.modules[__name__] # keep a reference, globals are cleared otherwise
+sys.modules[__name__]= _module
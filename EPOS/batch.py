@@ -0,0 +1,165 @@
+'''
+This module contains a batch driver that fits the same model to several
+subsamples, f.e. the spectral types in :func:`EPOS.kepler.dr25`, as
+parallel processes
+
+Example:
+	>>> jobs= [(sub, model, {'nMC':1000, 'nburn':200}) for sub in ['M','K','G','F']]
+	>>> EPOS.batch.run(jobs, cores=16, threads=4)
+
+where model(epos) defines the parametric function, fit parameters and ranges
+'''
+import numpy as np
+import os, sys, time, json, traceback
+import multiprocessing
+
+import EPOS
+
+def run(jobs, cores=None, threads=1, name='batch', loader=None, Resume=True,
+		poll=1., Verbose=True):
+	'''
+	Run a list of jobs as separate processes
+
+	Description:
+		Each job loads its survey with loader(subsample, \*\*settings['dr25']),
+		calls model(epos), :func:`EPOS.run.once` and :func:`EPOS.run.mcmc`
+		with the remaining settings, and saves the occurrence rates if
+		model(epos) defined bins. Surveys are loaded once, before the jobs are
+		started, and shared with the job processes.
+		Each job uses threads cores for the walkers, so cores/threads jobs
+		run at the same time. Output of a job goes to log/{job}/batch.log.
+		The status of all jobs is kept in batch/{name}.json. A failed job
+		does not stop the other jobs, and jobs that are done are skipped
+		when the batch is run again.
+
+	Args:
+		jobs(list): (subsample, model, settings) tuples, settings(dict) may
+			include name, dr25 (arguments for the loader), and arguments
+			for :func:`EPOS.run.mcmc`
+		cores(int): number of cores to use, default all
+		threads(int): number of cores per job
+		name(str): name of the batch
+		loader(function): returns obs, survey, default :func:`EPOS.kepler.dr25`
+		Resume(bool): skip jobs that are done in a previous run
+
+	Returns:
+		dict: status of each job
+	'''
+	if loader is None: loader= EPOS.kepler.dr25
+	if cores is None: cores= multiprocessing.cpu_count()
+	nparallel= max(1, cores//threads)
+
+	jobs= [_job(*job) for job in jobs]
+	names= [job['name'] for job in jobs]
+	if len(set(names)) < len(names):
+		raise ValueError('Job names are not unique: {}'.format(names))
+
+	''' status of previous runs '''
+	if not os.path.isdir('batch'): os.makedirs('batch')
+	fstatus= 'batch/{}.json'.format(name)
+	status= {}
+	if Resume and os.path.isfile(fstatus):
+		with open(fstatus) as f:
+			status= json.load(f)
+	for job in jobs:
+		if status.get(job['name'], {}).get('status') != 'done':
+			status[job['name']]= {'status':'pending', 'subsample':job['subsample']}
+	_save(fstatus, status)
+
+	queue= [job for job in jobs if status[job['name']]['status'] == 'pending']
+	if Verbose:
+		print '\nBatch {}: {} jobs, {} done, {} at a time with {} threads'.format(name,
+			len(jobs), len(jobs)-len(queue), nparallel, threads)
+
+	''' load the surveys once, shared with the (forked) job processes '''
+	assets= {}
+	for job in queue:
+		key= (job['subsample'], tuple(sorted(job['dr25'].items())))
+		if not key in assets:
+			assets[key]= loader(job['subsample'], **job['dr25'])
+		job['assets']= assets[key]
+
+	'''
+	Schedule the jobs. Processes, not a multiprocessing.Pool: the pool workers
+	are daemons and can not start their own pool for the walkers
+	'''
+	running= {}
+	try:
+		while len(queue) > 0 or len(running) > 0:
+			while len(queue) > 0 and len(running) < nparallel:
+				job= queue.pop(0)
+				p= multiprocessing.Process(target=_run, args=(job, threads))
+				p.start()
+				running[job['name']]= p
+				status[job['name']].update(status='running', start=time.time())
+				_save(fstatus, status)
+				if Verbose: print '  started {}'.format(job['name'])
+
+			time.sleep(poll)
+			for jobname, p in running.items():
+				if not p.is_alive():
+					p.join()
+					del running[jobname]
+					st= status[jobname]
+					st.update(status='done' if p.exitcode == 0 else 'failed',
+						exitcode=p.exitcode, runtime=time.time()-st['start'])
+					_save(fstatus, status)
+					if Verbose:
+						print '  {} {} after {:.0f} sec'.format(jobname, st['status'],
+							st['runtime'])
+	except KeyboardInterrupt:
+		for jobname, p in running.items():
+			p.terminate()
+			status[jobname]['status']= 'pending'
+		_save(fstatus, status)
+		raise
+
+	if Verbose:
+		for key in ['done', 'failed']:
+			jobnames= [job for job in names if status[job]['status'] == key]
+			print '{} jobs {}: {}'.format(len(jobnames), key, ', '.join(jobnames))
+
+	return status
+
+def _job(subsample, model, settings={}):
+	''' job dictionary from a (subsample, model, settings) tuple '''
+	settings= dict(settings)
+	job= {'subsample':subsample, 'model':model}
+	job['name']= settings.pop('name', '{}_{}'.format(model.__name__, subsample))
+	job['dr25']= settings.pop('dr25', {})
+	job['mcmc']= settings
+	return job
+
+def _run(job, threads):
+	''' Run one job, in a separate process '''
+	fdir= 'log/{}'.format(job['name'])
+	if not os.path.isdir(fdir): os.makedirs(fdir)
+	flog= open('{}/batch.log'.format(fdir), 'w')
+	os.dup2(flog.fileno(), sys.stdout.fileno())
+	os.dup2(flog.fileno(), sys.stderr.fileno())
+
+	try:
+		obs, survey= job['assets']
+		epos= EPOS.epos(name=job['name'])
+		epos.set_observation(**obs)
+		epos.set_survey(**survey)
+		job['model'](epos)
+
+		EPOS.run.once(epos)
+		EPOS.run.mcmc(epos, threads=threads, **job['mcmc'])
+
+		if hasattr(epos, 'occurrence'):
+			EPOS.occurrence.all(epos)
+			EPOS.save.occurrence(epos)
+	except Exception:
+		traceback.print_exc()
+		sys.stdout.flush()
+		os._exit(1)
+
+	sys.stdout.flush()
+
+def _save(fname, status):
+	# write and rename, the file is never half-written
+	with open(fname+'.tmp', 'w') as f:
+		json.dump(status, f, indent=1)
+	os.rename(fname+'.tmp', fname)
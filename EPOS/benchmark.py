@@ -0,0 +1,302 @@
+'''
+This module contains a synthetic survey generator and a benchmark suite that
+runs without the Kepler catalogues, for tracking the performance of EPOS
+between versions.
+
+Example:
+	>>> EPOS.benchmark.suite(nstars=[1e4,1e5], threads=[1,4], fname='bench.json')
+'''
+import numpy as np
+import os, sys, time, json, platform
+import multiprocessing
+from functools import partial
+from contextlib import contextmanager
+from scipy import stats
+
+import EPOS
+import cgs
+
+modes= ['single', 'noMC', 'multi', 'randompairing', 'pfm']
+
+def synthetic(nstars=1.6862e5, nplanets=3000, nx=100, ny=50, fmulti=0.4, nmax=6,
+		seed=None):
+	'''
+	Generate a synthetic planet catalogue and survey detection efficiency
+
+	Description:
+		The detection efficiency is a gamma cdf of the signal-to-noise ratio,
+		which scales as R^2 P^(-1/3). Planets are drawn from a broken power-law
+		in period and a power-law in radius, and are detected with the
+		transit probability times the detection efficiency.
+
+	Args:
+		nstars(int): number of stars in the survey
+		nplanets(int): number of detected planets
+		nx(int): number of period grid points
+		ny(int): number of radius grid points
+		fmulti(float): fraction of stars with detected planets that are multis
+		nmax(int): maximum number of detected planets per star
+		seed(int): random seed
+
+	Returns:
+		obs(dict): input for :meth:`EPOS.classes.epos.set_observation`
+		survey(dict): input for :meth:`EPOS.classes.epos.set_survey`
+	'''
+	rs= np.random.RandomState(seed)
+
+	''' Detection efficiency '''
+	P= np.logspace(np.log10(0.5), np.log10(730), nx)
+	Rp= np.logspace(np.log10(0.3), np.log10(20), ny)
+	X, Y= np.meshgrid(P, Rp, indexing='ij')
+	snr= 7.1* Y**2.* (X/365.25)**(-1./3.)
+	fsnr= stats.gamma.cdf(snr, 4.65, scale=0.98, loc=0.)
+
+	survey= {'xvar':P, 'yvar':Rp, 'eff_2D':fsnr, 'Mstar':1.0, 'Rstar':1.0}
+
+	''' Detected planets, rejection sampling '''
+	fgeo_prefac= cgs.Rsun* (4.*np.pi**2./(cgs.G*cgs.Msun))**(1./3.)/ cgs.day**(2./3.)
+	xvar, yvar= [], []
+	ndet= 0
+	while ndet < nplanets:
+		logP= rs.uniform(np.log10(P[0]), np.log10(P[-1]), 10*nplanets)
+		logR= rs.uniform(np.log10(Rp[0]), np.log10(Rp[-1]), 10*nplanets)
+		Pdraw, Rdraw= 10.**logP, 10.**logR
+		pdf= np.where(Pdraw<10., (Pdraw/10.)**1.5, 1.) * Rdraw**-0.5
+		pdet= fgeo_prefac* Pdraw**(-2./3.)* \
+			stats.gamma.cdf(7.1* Rdraw**2.* (Pdraw/365.25)**(-1./3.), 4.65, scale=0.98)
+		keep= rs.uniform(size=pdf.size) < pdf*pdet/ np.max(pdf*pdet)
+		xvar.append(Pdraw[keep])
+		yvar.append(Rdraw[keep])
+		ndet+= keep.sum()
+	xvar= np.concatenate(xvar)[:nplanets]
+	yvar= np.concatenate(yvar)[:nplanets]
+
+	''' Assign planets to stars '''
+	npl= []
+	while np.sum(npl) < nplanets:
+		npl.append(1 if rs.uniform() > fmulti else rs.randint(2, nmax+1))
+	npl[-1]-= np.sum(npl)-nplanets
+	starID= np.repeat(np.arange(len(npl)), npl)
+
+	obs= {'xvar':xvar, 'yvar':yvar, 'starID':starID, 'nstars':nstars}
+
+	return obs, survey
+
+def population(nsys=1000, npl=5, seed=None):
+	'''
+	Generate a synthetic planet formation model with npl planets per system
+
+	Returns:
+		pfm(dict): input for :meth:`EPOS.classes.epos.set_population`
+	'''
+	rs= np.random.RandomState(seed)
+	sma0= 10.**rs.uniform(-1.5, -0.5, nsys)
+	spacing= 10.**rs.normal(0.2, 0.05, (nsys, npl))
+	sma= sma0[:,None]* np.cumprod(spacing, axis=1)
+	mass= 10.**rs.uniform(-0.5, 1.5, (nsys, npl))
+	radius= mass**0.5
+	inc= rs.rayleigh(2., (nsys, npl))
+	starID= np.repeat(np.arange(nsys), npl)
+
+	return {'name':'synthetic', 'sma':sma.flatten(), 'mass':mass.flatten(),
+		'radius':radius.flatten(), 'inc':inc.flatten(), 'starID':starID}
+
+def setup(mode='single', nstars=1.6862e5, seed=42, **kwargs):
+	'''
+	An epos instance on a synthetic survey
+
+	Args:
+		mode(str): single, noMC, multi, randompairing, or pfm
+		nstars(int): number of stars in the survey
+		seed(int): random seed of the epos instance
+		**kwargs: passed to :func:`synthetic`
+	'''
+	if not mode in modes:
+		raise ValueError('mode {} not in {}'.format(mode, modes))
+
+	with _quiet():
+		obs, survey= synthetic(nstars=nstars, seed=seed, **kwargs)
+		epos= EPOS.epos(name='benchmark_{}'.format(mode), seed=seed,
+			MC=(mode != 'noMC'))
+		epos.set_observation(**obs)
+		epos.set_survey(**survey)
+
+		if mode in ['single', 'noMC']:
+			epos.set_parametric(EPOS.fitfunctions.powerlaw2D)
+			epos.fitpars.add('pps', 2.0, min=0)
+			epos.fitpars.add('P1',0.3, is2D=True)
+			epos.fitpars.add('P2',-0.2, dx=0.1, is2D=True)
+		elif mode in ['multi', 'randompairing']:
+			epos.set_parametric(EPOS.fitfunctions.brokenpowerlaw2D)
+			epos.fitpars.add('pps', 0.4, min=0)
+			epos.fitpars.add('P break', 10., min=2, max=50, is2D=True)
+			epos.fitpars.add('a_P', 1.5, min=0, is2D=True)
+			epos.fitpars.add('b_P', -1, max=1, dx=0.1, is2D=True)
+			epos.fitpars.add('R break', 3.3, fixed=True, is2D=True)
+			epos.fitpars.add('a_R', -0.5, fixed=True, is2D=True)
+			epos.fitpars.add('b_R', -6., fixed=True, is2D=True)
+			if mode == 'multi':
+				epos.set_multi(spacing='dimensionless')
+				epos.fitpars.add('npl', 10, fixed=True)
+				epos.fitpars.add('log D', -0.3)
+				epos.fitpars.add('sigma', 0.2, min=0)
+				epos.fitpars.add('dR', 0.01, fixed=True)
+			else:
+				epos.set_multi()
+				epos.fitpars.add('npl', 3, fixed=True)
+			epos.fitpars.add('inc', 2.0)
+			epos.fitpars.add('f_iso', 0.4)
+			epos.fitpars.add('f_cor', 0.5, fixed=True)
+		elif mode == 'pfm':
+			pfm= population(seed=seed)
+			epos.set_population(pfm.pop('name'), **pfm)
+			epos.fitpars.add('eta', 0.5, min=0, isnorm=True)
+			epos.fitpars.add('f_iso', 0.4)
+			epos.fitpars.add('f_inc', 1.0, fixed=True)
+
+		epos.set_ranges(xtrim=[1,730], ytrim=[0.5,12.], xzoom=[2,400], yzoom=[0.7,6],
+			Occ=(mode in ['single', 'noMC']))
+		if mode in ['single', 'noMC']:
+			epos.set_bins(xbins=[[20,300],[0.9*365,2.2*365]], ybins=[[0.7,3],[0.7,1.5]])
+
+	return epos
+
+def suite(modes=modes, nstars=[1.6862e5], threads=[1], nrep=10, nsamples=100,
+		npos=10, fname='benchmark.json', **kwargs):
+	'''
+	Time the main steps of EPOS on synthetic surveys
+
+	Description:
+		For each mode and survey size, times :func:`EPOS.run.once`, repeated
+		calls to :func:`EPOS.run.MC` (or :func:`EPOS.run.noMC`), 
+		:func:`EPOS.occurrence.all` and :func:`EPOS.run.posterior` on mock samples.
+		The Monte Carlo throughput is measured for each number of cores.
+		The population cache of :func:`EPOS.run.MC` is switched off, so 
+		that every call draws a new population.
+		The results are written to a json file for comparison between versions.
+
+	Args:
+		modes(list): modes to benchmark, see :func:`setup`
+		nstars(list): survey sizes
+		threads(list): number of cores
+		nrep(int): number of repeated simulations per core
+		nsamples(int): number of mock posterior samples
+		npos(int): number of posterior populations to simulate
+		fname(str): output file, None to skip
+		**kwargs: passed to :func:`synthetic`
+
+	Returns:
+		dict: the benchmark results
+	'''
+	results= {'version': _version(), 'python': platform.python_version(),
+		'numpy': np.__version__, 'platform': platform.platform(),
+		'cpus': multiprocessing.cpu_count(), 'date': time.strftime('%Y-%m-%d %H:%M:%S'),
+		'nrep': nrep, 'benchmarks':[]}
+
+	with _nocache():
+		for mode in modes:
+			for ns in nstars:
+				print '\nBenchmark {} with {:.0f} stars'.format(mode, ns)
+				epos= setup(mode, nstars=ns, **kwargs)
+				bench= {'mode':mode, 'nstars':ns, 'times':{}, 'throughput':{}}
+				times= bench['times']
+
+				with _quiet():
+					tstart= time.time()
+					EPOS.run.once(epos)
+					times['once']= [time.time()-tstart]
+
+				fpara= epos.fitpars.getfit(Init=True)
+				runonce= EPOS.run.MC if epos.MonteCarlo else EPOS.run.noMC
+				runtype= 'MC' if epos.MonteCarlo else 'noMC'
+				times[runtype]= _repeat(partial(runonce, epos, fpara, Verbose=False), nrep,
+					epos.timings)
+
+				''' parallel Monte Carlo throughput, simulations per second '''
+				for nthreads in threads:
+					samples= [fpara]* (nrep*nthreads)
+					if nthreads > 1:
+						pool= multiprocessing.Pool(nthreads)
+						tstart= time.time()
+						pool.map(partial(runonce, epos, Verbose=False), samples)
+						bench['throughput'][nthreads]= len(samples)/(time.time()-tstart)
+						pool.close()
+					else:
+						tstart= time.time()
+						map(partial(runonce, epos, Verbose=False), samples)
+						bench['throughput'][nthreads]= len(samples)/(time.time()-tstart)
+
+				''' post-processing on mock samples '''
+				rs= np.random.RandomState(epos.seed)
+				dx= np.array(epos.fitpars.getfit(attr='dx'))
+				epos.samples= np.array(fpara)+ 0.1*dx*rs.normal(size=(nsamples, len(fpara)))
+				if len(fpara) > 0:
+					with _quiet():
+						tstart= time.time()
+						EPOS.run.posterior(epos, npos=npos)
+						times['posterior']= [time.time()-tstart]
+
+				if mode in ['single', 'noMC']:
+					with _quiet():
+						tstart= time.time()
+						EPOS.occurrence.all(epos)
+						times['occurrence']= [time.time()-tstart]
+
+				bench['median']= {key:np.median(t) for key, t in times.items()}
+				bench['timings']= {key: st['total']/st['count']
+					for key, st in epos.timings.stages.items()}
+				bench['sizes']= {key: 1.*sz['total']/sz['count']
+					for key, sz in epos.timings.sizes.items()}
+				results['benchmarks'].append(bench)
+
+				for key in sorted(bench['median']):
+					print '  {:12s} {:9.3f} ms'.format(key, 1e3*bench['median'][key])
+				for nthreads in threads:
+					print '  {:2d} cores     {:9.1f} MC/sec'.format(nthreads,
+						bench['throughput'][nthreads])
+
+	if fname is not None:
+		with open(fname, 'w') as f:
+			json.dump(results, f, indent=1, default=EPOS.save.serialize_numpy_array)
+		print '\nSaved benchmark in {}'.format(fname)
+
+	return results
+
+def _repeat(func, nrep, timings=None):
+	times= []
+	for _ in range(nrep):
+		EPOS.timing.last= None
+		tstart= time.time()
+		func()
+		times.append(time.time()-tstart)
+		if timings is not None: timings.add(EPOS.timing.record())
+	return times
+
+def _version():
+	try:
+		import pkg_resources
+		return pkg_resources.get_distribution('epospy').version
+	except Exception:
+		return 'unknown'
+
+@contextmanager
+def _nocache():
+	''' Switch off the population cache of EPOS.run.MC '''
+	cachesize= EPOS.run.cachesize
+	EPOS.run.cachesize= 0
+	EPOS.run.clearcache()
+	try:
+		yield
+	finally:
+		EPOS.run.cachesize= cachesize
+
+@contextmanager
+def _quiet():
+	''' Suppress the print statements of the timed functions '''
+	stdout= sys.stdout
+	with open(os.devnull, 'w') as devnull:
+		sys.stdout= devnull
+		try:
+			yield
+		finally:
+			sys.stdout= stdout
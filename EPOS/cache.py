@@ -0,0 +1,98 @@
+'''
+This module contains a persistent cache for survey data, shared between
+working directories. Entries are keyed by a hash of the arguments and the
+modification times of the source files, and the arrays are stored as .npy
+files that are loaded as read-only memory maps.
+
+The cache directory is $EPOS_CACHE, or ~/.cache/epos by default
+'''
+import numpy as np
+import os, json, hashlib, shutil, tempfile
+
+version= 1 # increase to invalidate all entries
+
+def cachedir():
+	return os.environ.get('EPOS_CACHE',
+		os.path.join(os.path.expanduser('~'), '.cache', 'epos'))
+
+def key(name, args, files=[]):
+	'''
+	Cache key from a name, a dictionary of arguments, and a list of source files
+
+	Description:
+		Files are identified by their absolute path, modification time,
+		and size. Missing files are part of the key as well.
+	'''
+	sources= []
+	for fname in files:
+		fname= os.path.abspath(fname)
+		if os.path.isfile(fname):
+			stat= os.stat(fname)
+			sources.append((fname, stat.st_mtime, stat.st_size))
+		else:
+			sources.append((fname, None, None))
+
+	text= repr((version, sorted(args.items()), sources))
+	return '{}-{}'.format(name, hashlib.sha1(text).hexdigest()[:16])
+
+def save(key, entry):
+	'''
+	Store a dictionary of dictionaries of arrays and scalars
+
+	Returns:
+		str: directory of the cache entry
+	'''
+	fdir= os.path.join(cachedir(), key)
+	if os.path.isdir(fdir): return fdir
+	if not os.path.isdir(cachedir()): os.makedirs(cachedir())
+
+	# write to a temporary directory first, other processes may be reading
+	ftemp= tempfile.mkdtemp(dir=cachedir(), prefix='.{}.'.format(key))
+	index= {}
+	for group, values in entry.items():
+		index[group]= {'arrays':[], 'scalars':{}}
+		for name, value in values.items():
+			value= np.asarray(value)
+			if value.ndim == 0:
+				index[group]['scalars'][name]= value.item()
+			else:
+				fname= '{}.{}.npy'.format(group, len(index[group]['arrays']))
+				np.save(os.path.join(ftemp, fname), value)
+				index[group]['arrays'].append([name, fname])
+	with open(os.path.join(ftemp, 'index.json'), 'w') as f:
+		json.dump(index, f)
+
+	try:
+		os.rename(ftemp, fdir)
+	except OSError:
+		# stored by another process in the meantime
+		shutil.rmtree(ftemp, ignore_errors=True)
+	return fdir
+
+def load(key):
+	'''
+	Load a cache entry, arrays are read-only memory maps
+
+	Returns:
+		dict or None if not in the cache
+	'''
+	fdir= os.path.join(cachedir(), key)
+	findex= os.path.join(fdir, 'index.json')
+	if not os.path.isfile(findex): return None
+
+	with open(findex) as f:
+		index= json.load(f)
+	entry= {}
+	for group, values in index.items():
+		group= str(group)
+		entry[group]= {str(name):value for name, value in values['scalars'].items()}
+		for name, fname in values['arrays']:
+			entry[group][str(name)]= np.load(os.path.join(fdir, fname), mmap_mode='r')
+	return entry
+
+def clear(name=None):
+	''' Remove all cache entries, or only those starting with name '''
+	if not os.path.isdir(cachedir()): return
+	for key in os.listdir(cachedir()):
+		if name is None or key.startswith(name):
+			shutil.rmtree(os.path.join(cachedir(), key), ignore_errors=True)
@@ -0,0 +1,120 @@
+'''
+This module contains fast readers for catalogue files, f.e. the IPAC tables
+from the NASA exoplanet archive. Files are read line by line and only the
+requested columns are kept, which are converted to numpy arrays at the end.
+'''
+import numpy as np
+
+def ipac(fname, columns=None, null='null'):
+	'''
+	Read columns from a fixed-width IPAC table
+
+	Args:
+		fname(str): file name
+		columns(list): column names to read, default all
+		null(str): value for missing data if not defined in the header
+
+	Returns:
+		dict: a numpy array for each column. Missing values are nan in float
+		columns, int columns with missing values are converted to float
+	'''
+	header= []
+	data= None
+	with open(fname) as f:
+		for line in f:
+			line= line.rstrip('\r\n')
+			if data is None:
+				if line.startswith('\\'):
+					continue
+				elif line.startswith('|'):
+					header.append(line)
+					continue
+
+				''' column boundaries from the first header line '''
+				bars= [i for i, c in enumerate(header[0]) if c == '|']
+				names= [name.strip() for name in header[0].split('|')[1:-1]]
+				types= [t.strip() for t in header[1].split('|')[1:-1]] \
+					if len(header) > 1 else ['char']*len(names)
+				nulls= [n.strip() for n in header[3].split('|')[1:-1]] \
+					if len(header) > 3 else [null]*len(names)
+
+				if columns is None: columns= names
+				for name in columns:
+					if not name in names:
+						raise ValueError('Column {} not in {}'.format(name, fname))
+				icol= [names.index(name) for name in columns]
+				slices= [slice(bars[i]+1, bars[i+1]) for i in icol]
+				data= [[] for _ in columns]
+
+			if line.strip() == '': continue
+			for col, sl in zip(data, slices):
+				col.append(line[sl])
+
+	if data is None:
+		raise ValueError('No data in {}'.format(fname))
+
+	table= {}
+	for name, i, col in zip(columns, icol, data):
+		table[name]= _convert(col, types[i], nulls[i])
+	return table
+
+def delimited(fname, columns, delimiter=',', skiprows=0, comments='#'):
+	'''
+	Read columns from a delimited text file
+
+	Args:
+		fname(str): file name
+		columns(dict): column name and index
+		delimiter(str): column separator
+		skiprows(int): number of header lines
+		comments(str): the rest of the line is ignored after this character
+
+	Returns:
+		dict: a float array for each column
+	'''
+	names= columns.keys()
+	icol= [columns[name] for name in names]
+	data= [[] for _ in names]
+	with open(fname) as f:
+		for i, line in enumerate(f):
+			if i < skiprows: continue
+			line= line.split(comments, 1)[0]
+			if line.strip() == '': continue
+			values= line.split(delimiter)
+			for col, j in zip(data, icol):
+				col.append(values[j])
+
+	return {name:_convert(col, 'double', 'nan') for name, col in zip(names, data)}
+
+def join(left, right):
+	'''
+	Match each key in left to the (unique) keys in right
+
+	Description:
+		The keys in right are sorted once, and each key in left is located
+		with a binary search, instead of intersect1d/in1d.
+
+	Returns:
+		np.array: for each key in left, the index in right, or -1 if missing
+	'''
+	left, right= np.asarray(left), np.asarray(right)
+	if right.size == 0: return np.full(left.size, -1, dtype=int)
+	order= np.argsort(right, kind='mergesort')
+	pos= np.searchsorted(right[order], left)
+	pos[pos == right.size]= 0
+	match= right[order][pos] == left
+	return np.where(match, order[pos], -1)
+
+def _convert(col, dtype, null):
+	''' Convert a list of strings to a numpy array '''
+	values= np.char.strip(np.array(col, dtype=str))
+	missing= (values == '') | (values == null)
+
+	if dtype in ['char', 'c', 'date']:
+		return values
+
+	values= np.where(missing, 'nan', values)
+	if dtype in ['int', 'i', 'long', 'l'] and not np.any(missing):
+		return values.astype(np.int64)
+	else:
+		return values.astype(float)
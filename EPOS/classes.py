@@ -10,7 +10,8 @@ import numpy as np
 
 import cgs
 import EPOS.multi
-from EPOS.plot.helpers import set_pyplot_defaults
+import EPOS.timing
+import EPOS.stars
 
 class fitparameters:
 	''' Holds the fit parameters. Usually initialized in epos.fitpars '''
@@ -140,6 +141,11 @@ class epos:
 		Debug(bool): Log more output for debugging
 		seed(int): Same random number for each simulation? True, None, or int
 		Norm(bool): normalize pdf (deprecated?)
+		MC(bool): Monte Carlo simulation, or a numerical integration
+		Weighted(bool): Weigh the simulated planets by their transit and 
+			detection probability instead of drawing them, see :func:`EPOS.run.observe`
+		Stratified(bool): Stratified random numbers for the viewing geometry,
+			noise, and detections in :func:`EPOS.run.MC`
 	
 	Attributes:
 		name(str): name
@@ -152,7 +158,8 @@ class epos:
 		Debug(bool): Verbose logging
 		seed(): Random seed, can be any of int, True, or None
 	"""
-	def __init__(self, name, RV=False, Debug=False, seed=True, Norm=False, MC=True):
+	def __init__(self, name, RV=False, Debug=False, seed=True, Norm=False, MC=True,
+			Weighted=False, Stratified=False):
 		"""
 		Initialize the class
 		"""
@@ -169,6 +176,9 @@ class epos:
 		self.RandomPairing= False
 		self.Isotropic= False # phase out?
 		self.MonteCarlo= MC
+		self.Weighted= Weighted
+		self.Stratified= Stratified
+		if Weighted and not MC: raise ValueError('Weighted mode needs MC=True')
 		
 		# Seed for the random number generator
 		if seed is None: self.seed= None
@@ -179,7 +189,7 @@ class epos:
 		
 		self.Debug= False
 		self.Parallel= True # speed up a few calculations 
-		set_pyplot_defaults() # nicer plots
+		self.timings= EPOS.timing.timings() # time spent in the MC simulations
 
 		# switches to be set later (undocumented)	
 		self.Observation=False
@@ -188,6 +198,8 @@ class epos:
 		self.Occurrence= False # inverse detection efficiency (?)
 		self.Prep= False # ready to run? EPOS.run.once()
 		self.MassRadius= False
+		self.StarByStar= False
+		self.fidelity= 1.0 # fraction of the stars simulated, see EPOS.run.calibrate
 		self.Radius= False # is this used?
 		self.PDF=False
 		
@@ -291,6 +303,40 @@ class epos:
 
 		self.DetectionEfficiency=True
 	
+	def set_stars(self, stars, tcdpp=6., recovery=(30.87, 0.271, 0.940), mintransit=3):
+		'''Stellar table for the star-by-star simulation mode
+		
+		Description:
+			Each planet in :func:`EPOS.run.MC` is assigned to a star in the
+			table, and the transit and detection probability are calculated 
+			from the radius, mass, and noise of that star instead of from
+			Rstar, Mstar, and eff_2D. The detection efficiency from 
+			:func:`set_survey` is still used for the grid and the non-MC mode.
+		
+		Args:
+			stars(dict): stellar table, see :mod:`EPOS.stars`
+			tcdpp(float): timescale of the cdpp [hours]
+			recovery(tuple): shape, scale, and maximum of the gamma cdf that 
+				gives the fraction of planets recovered as function of MES
+			mintransit(int): minimum number of transits
+		'''
+		if self.RV: raise ValueError('Star-by-star mode is for transit surveys')
+		if not self.MonteCarlo: raise ValueError('Star-by-star mode needs MC=True')
+		for key in EPOS.stars.columns:
+			if not key in stars: raise ValueError('No column {} in stellar table'.format(key))
+		
+		self.stars= stars
+		self.tcdpp= tcdpp
+		self.recovery= recovery
+		self.mintransit= mintransit
+		self.StarByStar= True
+		
+		nstars= stars['R'].size
+		print '\nStellar table: {} stars'.format(nstars)
+		if self.Observation and nstars != self.nstars:
+			print '  number of stars changed from {}'.format(int(self.nstars))
+		self.nstars= nstars
+	
 	def set_ranges(self, xtrim=None, ytrim=None, xzoom=None, yzoom=None, 
 		LogArea=False, Occ=False):
 		
@@ -344,7 +390,7 @@ class epos:
 		self.MC_yvar= self.eff_yvar[iymin:iymax]
 		self.MC_eff= self.eff_2D[ixmin:ixmax,iymin:iymax]
 		if hasattr(self,'vetting'):
-			self.MC_eff*= self.vetting[ixmin:ixmax,iymin:iymax]
+			self.MC_eff= self.MC_eff* self.vetting[ixmin:ixmax,iymin:iymax]
 		
 		# scale factor to multiply pdf such that occurrence in units of dlnR dlnP
 		if LogArea:
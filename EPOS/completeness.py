@@ -0,0 +1,110 @@
+'''
+This module calculates the detection efficiency of a transit survey on any
+period-radius grid, from the noise properties of the stars in a stellar
+table (see :mod:`EPOS.stars`), instead of reading a precomputed grid.
+
+Example:
+	>>> stars= EPOS.stars.read('keplerstellar.tbl', {'R':'radius', 'M':'mass',
+	>>> 	'cdpp':'rrmscdpp06p0', 'dutycycle':'dutycycle', 'tobs':'dataspan'})
+	>>> survey, nstars= EPOS.completeness.survey(stars, threads=4)
+	>>> epos.set_survey(**survey)
+'''
+import numpy as np
+import time
+import multiprocessing
+
+import stars as _stars
+
+_table= None # stellar table, inherited by the pool workers
+logmes= np.linspace(-4, 4, 8001) # bins of log MES for a 1 Earth radius planet
+
+def survey(stars, xvar=None, yvar=None, tcdpp=6., recovery=(30.87, 0.271, 0.940),
+		mintransit=3, nb=5, threads=1, Verbose=True):
+	'''
+	Detection efficiency of a stellar sample
+
+	Description:
+		The multiple event statistic (MES) scales with the planet radius
+		squared. The MES of a 1 Earth radius planet is calculated for each
+		star, period, and impact parameter (Gauss-Legendre quadrature), and
+		binned in log MES weighted by the transit probability of the star.
+		The detection efficiency at each radius is the recovery fraction
+		summed over these bins. Stars are processed in chunks, in parallel 
+		if threads > 1.
+		Rstar and Mstar are chosen such that the geometric transit probability
+		in :meth:`EPOS.classes.epos.set_survey` is the average of the stars,
+		so the survey completeness is the average completeness of the stars.
+
+	Args:
+		stars(dict): stellar table, see :mod:`EPOS.stars`
+		xvar(np.array): period grid [days], default 0.2-730 days
+		yvar(np.array): planet radius grid [Earth radii], default 0.2-20
+		tcdpp(float): timescale of the cdpp [hours]
+		recovery(tuple): shape, scale, and maximum of the gamma cdf that
+			gives the fraction of planets recovered as function of MES
+		mintransit(int): minimum number of transits
+		nb(int): number of impact parameters
+		threads(int): number of processes
+
+	Returns:
+		survey(dict): input for :meth:`EPOS.classes.epos.set_survey`
+		nstars(float): the number of stars
+	'''
+	global _table
+	if xvar is None: xvar= np.geomspace(0.2, 730., 19)
+	if yvar is None: yvar= np.geomspace(0.2, 20., 20)
+	xvar, yvar= np.asarray(xvar, dtype=float), np.asarray(yvar, dtype=float)
+	nstars= stars['R'].size
+	tstart= time.time()
+
+	''' stars per chunk, about 4 million grid points '''
+	nchunk= max(1, 2**22 // (xvar.size* nb))
+	chunks= [(i, min(i+nchunk, nstars)) for i in range(0, nstars, nchunk)]
+	args= (xvar, tcdpp, mintransit, nb)
+
+	_table= stars
+	if threads > 1:
+		pool= multiprocessing.Pool(threads)
+		sums= pool.map(_sum, [chunk+args for chunk in chunks])
+		pool.close()
+	else:
+		sums= map(_sum, [chunk+args for chunk in chunks])
+	_table= None
+
+	hist= np.sum([s[0] for s in sums], axis=0)
+	weights= np.sum([s[1] for s in sums])
+	Mstar= np.mean(stars['M'])
+
+	''' recovery fraction at each bin (center) and radius '''
+	mes= 10.**(0.5*(logmes[1:]+logmes[:-1]))
+	weighted= np.dot(hist, _stars.recovery(mes[:,None]* yvar[None,:]**2., *recovery))
+
+	survey= {'xvar':xvar, 'yvar':yvar, 'eff_2D':weighted/weights, 'Mstar':Mstar,
+		'Rstar':weights/nstars* Mstar**(1./3.)}
+	if Verbose:
+		print '\nDetection efficiency of {} stars on a {}x{} grid in {:.1f} sec'.format(
+			nstars, xvar.size, yvar.size, time.time()-tstart)
+		print '  Rstar= {:.3f}, Mstar= {:.3f}'.format(survey['Rstar'], survey['Mstar'])
+	return survey, nstars
+
+def _sum(args):
+	''' Histogram of log MES over a chunk of stars, for each period '''
+	start, stop, xvar, tcdpp, mintransit, nb= args
+	host= np.arange(start, stop)[:,None,None]
+	P= xvar[None,:,None]
+
+	x, wb= np.polynomial.legendre.leggauss(nb)
+	b= (0.5*(x+1.))[None,None,:]
+
+	mes= _stars._mes(_table, host, P, 1., b, tcdpp, mintransit)
+
+	# transit probability R/a is proportional to R M^-1/3
+	w= _table['R'][start:stop]* _table['M'][start:stop]**(-1./3.)
+	weights= w[:,None,None]* 0.5*wb[None,None,:]* np.ones_like(mes)
+
+	ibin= np.clip(np.searchsorted(logmes, np.log10(np.maximum(mes, 1e-30)))-1,
+		0, logmes.size-2)
+	index= np.arange(xvar.size)[None,:,None]* (logmes.size-1) + ibin
+	hist= np.bincount(index[mes > 0], weights=weights[mes > 0],
+		minlength=xvar.size*(logmes.size-1))
+	return hist.reshape(xvar.size, logmes.size-1), np.sum(w)
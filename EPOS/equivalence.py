@@ -0,0 +1,174 @@
+'''
+This module contains a harness to validate a fast simulation engine against
+the reference Monte Carlo simulation :func:`EPOS.run.MC`.
+Optimized engines do not reproduce the reference bit for bit, so the
+synthetic surveys of both are compared statistically over many random seeds.
+
+Example:
+	>>> EPOS.equivalence.compare(epos, fastMC, nseeds=100)
+'''
+import numpy as np
+import time, warnings
+import multiprocessing
+from functools import partial
+from scipy import stats
+
+import run
+
+def compare(epos, engine, reference=None, fpara=None, npara=1, nseeds=50,
+		alpha=0.01, threads=1, Verbose=True):
+	'''
+	Compare the synthetic surveys of an engine with the reference simulation
+
+	Description:
+		Both engines simulate the same parameter vectors with the same seeds.
+		Per parameter vector, the number of detected planets and the
+		log-likelihood are compared across seeds (Welch t-test, Levene test
+		for the variance, two-sample KS test). The period and radius
+		distributions, and in multi-planet mode the period ratios and inner
+		periods, are pooled over the seeds and compared with a two-sample KS
+		test, the multiplicity with a chi-square test.
+		An engine passes if no p-value is below alpha, Bonferroni corrected
+		for the number of tests.
+
+	Args:
+		engine(function): called as engine(epos, fpara, Store=True, Sample=True,
+			Verbose=False), returns the synthetic survey like :func:`EPOS.run.MC`
+		reference(function): the reference engine, default :func:`EPOS.run.MC`
+		fpara(list): parameter vector(s), default the initial values
+		npara(int): number of parameter vectors if fpara is None, drawn
+			within dx of the initial values
+		nseeds(int): number of random seeds per parameter vector
+		alpha(float): significance level
+		threads(int): number of parallel simulations. Note that parallel
+			simulations make the timing less precise
+
+	Returns:
+		dict: p-values per test and parameter vector, timings, speed-up, and
+			whether the engine passed
+	'''
+	assert epos.Prep, 'Run EPOS.run.once first'
+	if reference is None: reference= run.MC
+
+	''' parameter vectors to test '''
+	if fpara is None:
+		fpara0= np.array(epos.fitpars.getfit(Init=True))
+		dx= np.array(epos.fitpars.getfit(attr='dx'))
+		rs= np.random.RandomState(epos.seed)
+		fparas= [fpara0]+ [fpara0+dx*rs.uniform(-1,1,fpara0.size)
+			for _ in range(npara-1)]
+	else:
+		fparas= np.atleast_2d(fpara)
+
+	seed0= 0 if epos.seed is None else epos.seed
+	seeds= range(seed0, seed0+nseeds)
+
+	pool= multiprocessing.Pool(threads) if threads > 1 else None
+	M= map if pool is None else pool.map
+
+	result= {'tests':{}, 'time':{'reference':[], 'engine':[]}, 'nseeds':nseeds,
+		'fpara':fparas}
+	for i, fpara in enumerate(fparas):
+		if Verbose:
+			print '\nParameters {}/{}: {}'.format(i+1, len(fparas),
+				', '.join(['{:.3g}'.format(p) for p in fpara]))
+		sims={}
+		for name, func in zip(['reference', 'engine'], [reference, engine]):
+			sims[name]= M(partial(_simulate, epos, func, fpara), seeds)
+			result['time'][name]+= [sim['time'] for sim in sims[name]]
+
+		for test, pvalue in _tests(epos, sims['reference'], sims['engine']).items():
+			result['tests'].setdefault(test, []).append(pvalue)
+
+		if Verbose:
+			for test in sorted(result['tests']):
+				print '  p({})= {:.3g}'.format(test, result['tests'][test][-1])
+
+	if pool is not None: pool.close()
+
+	''' speed-up and verdict '''
+	tref= np.median(result['time']['reference'])
+	teng= np.median(result['time']['engine'])
+	result['speedup']= tref/teng
+
+	pvalues= np.concatenate([p for p in result['tests'].values()])
+	pvalues= pvalues[np.isfinite(pvalues)]
+	result['alpha']= alpha/max(pvalues.size, 1)
+	result['passed']= bool(np.all(pvalues >= result['alpha']))
+
+	if Verbose:
+		print '\nReference {:.3f} sec, engine {:.3f} sec, speed-up {:.2f}'.format(
+			tref, teng, result['speedup'])
+		print '{} tests, lowest p-value {:.3g}, threshold {:.3g}'.format(pvalues.size,
+			np.min(pvalues) if pvalues.size>0 else np.nan, result['alpha'])
+		print 'Engine is {}equivalent'.format('' if result['passed'] else 'NOT ')
+
+	return result
+
+def _simulate(epos, func, fpara, seed):
+	''' One synthetic survey with a given seed '''
+	seed_epos, epos.seed= epos.seed, seed
+	tstart= time.time()
+	try:
+		ss= func(epos, fpara, Store=True, Sample=True, Verbose=False)
+		lnprob= epos.lnprob
+	except ValueError:
+		ss, lnprob= None, -np.inf
+	tsim= time.time()-tstart
+	epos.seed= seed_epos
+
+	sim= {'time':tsim, 'lnprob':lnprob}
+	if ss is not None:
+		sim['N']= ss['nobs']
+		sim['P']= ss['P zoom']
+		sim['Y']= ss['Y zoom']
+		if 'multi' in ss:
+			sim['Nk']= np.bincount(ss['multi']['bin'], weights=ss['multi']['count'])
+			sim['dP']= ss['multi']['Pratio']
+			sim['Pin']= ss['multi']['Pinner']
+	return sim
+
+def _tests(epos, ref, eng):
+	''' p-values of the tests between two lists of simulations '''
+	pvalues= {}
+
+	''' per seed: number of detections and log-likelihood '''
+	for key in ['N', 'lnprob']:
+		x= np.array([sim.get(key, 0) for sim in ref], dtype=float)
+		y= np.array([sim.get(key, 0) for sim in eng], dtype=float)
+		if key == 'lnprob':
+			x, y= x[np.isfinite(x)], y[np.isfinite(y)]
+			if x.size < 2 or y.size < 2: continue
+		with warnings.catch_warnings(), np.errstate(invalid='ignore', divide='ignore'):
+			warnings.simplefilter('ignore')
+			pvalues['{} mean'.format(key)]= stats.ttest_ind(x, y, equal_var=False)[1]
+			pvalues['{} variance'.format(key)]= stats.levene(x, y)[1]
+		pvalues['{} KS'.format(key)]= stats.ks_2samp(x, y)[1]
+
+	''' pooled over seeds: distributions '''
+	for key in ['P', 'Y', 'dP', 'Pin']:
+		x= _pool(ref, key)
+		y= _pool(eng, key)
+		if x is None or y is None: continue
+		if x.size > 0 and y.size > 0:
+			pvalues['{} KS'.format(key)]= stats.ks_2samp(x, y)[1]
+
+	''' multiplicity '''
+	if epos.Multi:
+		Nk= [[sim['Nk'] for sim in sims if 'Nk' in sim] for sims in [ref, eng]]
+		if len(Nk[0]) > 0 and len(Nk[1]) > 0:
+			kmax= max([x.size for x in Nk[0]+Nk[1]])
+			table= np.array([np.sum([_pad(x, kmax) for x in nk], axis=0) for nk in Nk])
+			table= table[:, table.sum(axis=0) > 0]
+			if table.shape[1] > 1:
+				pvalues['Nk chi2']= stats.chi2_contingency(table)[1]
+
+	return pvalues
+
+def _pool(sims, key):
+	arrays= [sim[key] for sim in sims if key in sim]
+	if len(arrays) == 0: return None
+	return np.concatenate(arrays)
+
+def _pad(x, n):
+	return np.pad(x, (0, max(n-x.size, 0)), 'constant')[:n]
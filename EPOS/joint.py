@@ -0,0 +1,201 @@
+'''
+This module contains a joint fit of one planet population to several surveys,
+f.e. the Kepler subsamples of different spectral types, or Kepler and an RV
+survey. The planet population is drawn once for each set of parameters, and
+each survey is simulated separately (optionally in parallel) with
+:func:`EPOS.run.observe`. The log-likelihoods of the surveys are added.
+
+Example:
+	>>> for epos in surveys:
+	>>> 	model(epos)
+	>>> 	EPOS.run.once(epos)
+	>>> fit= EPOS.joint.joint(surveys, name='joint')
+	>>> EPOS.run.once(fit)
+	>>> EPOS.run.mcmc(fit, nMC=1000, nwalkers=100, nburn=200, threads=20)
+
+where model(epos) defines the same parametric function, fit parameters and
+ranges for each survey
+'''
+import numpy as np
+import multiprocessing
+
+import run
+import timing
+
+_surveys= None # surveys of the joint fit, inherited by the pool workers
+
+class joint:
+	'''
+	Joint fit of a planet population to several surveys
+
+	Description:
+		The first survey defines the planet population and the fit parameters.
+		The population is drawn for the total number of stars in all surveys,
+		and split into blocks of systems proportional to the number of stars
+		in each survey. Planets outside the period range of a survey, if that
+		range is narrower than the one of the first survey, are not observed.
+		Each survey uses its own goodness-of-fit statistics.
+		Other attributes are those of the first survey, so a joint fit can be
+		used with :func:`EPOS.run.mcmc`, :func:`EPOS.run.optimize`, and
+		:mod:`EPOS.samplers`
+
+	Args:
+		surveys(list): epos instances, prepared with :func:`EPOS.run.once`
+		name(str): name of the joint fit, for the chain and log directories
+		threads(int): number of surveys to simulate in parallel. Inside the
+			worker processes of a sampler with threads > 1 (f.e. 
+			:func:`EPOS.run.mcmc`) the surveys are simulated one by one
+
+	Note:
+		With a random seed, the first survey uses the same random numbers as
+		:func:`EPOS.run.MC`, the other surveys are seeded with (seed, index).
+		The systems are assigned to the surveys in a random order, that only
+		depends on the seed
+	'''
+	def __init__(self, surveys, name='joint', threads=1):
+		if len(surveys) < 1: raise ValueError('No surveys')
+		first= surveys[0]
+		Mass= first.RV or first.MassRadius
+		for epos in surveys:
+			if not epos.Prep:
+				raise ValueError('Run EPOS.run.once on survey {}'.format(epos.name))
+			if not epos.MonteCarlo:
+				raise ValueError('Survey {} is not a Monte Carlo simulation'.format(epos.name))
+			for key in ['Parametric', 'Multi', 'RandomPairing']:
+				if getattr(epos, key) != getattr(first, key):
+					raise ValueError('Survey {} has a different model ({})'.format(
+						epos.name, key))
+			if Mass and not (epos.RV or epos.MassRadius):
+				raise ValueError('Survey {} needs a mass-radius relation'.format(epos.name))
+			if (epos.RV or epos.MassRadius) and not Mass:
+				raise ValueError('Survey {} needs planet masses, {} has radii'.format(
+					epos.name, first.name))
+
+		self.surveys= surveys
+		self.name= name
+		self.plotdir='png/{}/'.format(name)
+		self.jsondir='json/{}/'.format(name)
+		self.threads= threads
+		self.seed= first.seed
+		self.fitpars= first.fitpars
+		self.nstars= np.sum([epos.nstars for epos in surveys])
+		self.fidelity= first.fidelity
+
+		self.Prep= True
+		self.engine= MC
+		self.timings= timing.timings()
+		self._pool= None
+
+		print '\nJoint fit of {} surveys'.format(len(surveys))
+		for epos in surveys:
+			print '  {}: {} stars, {} planets'.format(epos.name, int(epos.nstars),
+				epos.obs_xvar.size)
+
+	def __getattr__(self, name):
+		# attributes of the first survey, not during (un)pickling
+		if name.startswith('__') or name in ['surveys', '_pool']:
+			raise AttributeError(name)
+		return getattr(self.surveys[0], name)
+
+	def __getstate__(self):
+		state= self.__dict__.copy()
+		state['_pool']= None
+		return state
+
+	def close(self):
+		''' Stop the worker processes '''
+		if self._pool is not None:
+			self._pool.terminate()
+			self._pool= None
+
+def MC(fit, fpara, Store=False, Sample=False, StorePopulation=False, Extra=None,
+		Verbose=True):
+	'''
+	Simulate all surveys of a joint fit, like :func:`EPOS.run.MC`
+
+	Returns:
+		float: total log-likelihood, or a list with the synthetic survey of
+			each survey if Store and Sample
+	'''
+	tm= timing.call()
+
+	''' Seed the random number generator '''
+	if fit.seed is not None: np.random.seed(fit.seed)
+
+	pop= run.population(fit.surveys[0], fpara, tm=tm, Store=Store, Verbose=Verbose,
+		nstars=fit.fidelity*fit.nstars)
+	if pop is None: return -np.inf
+	pop['fidelity']= fit.fidelity
+
+	pops= _split(fit, pop)
+	state= None if fit.seed is None else np.random.get_state()
+	tm.stage('split')
+
+	''' Observe, in parallel if not storing the synthetic surveys '''
+	# daemonic (sampler) workers can not start a pool of their own
+	if fit.threads > 1 and not Store and not multiprocessing.current_process().daemon:
+		if fit._pool is None: fit._pool= _startpool(fit)
+		lnp= fit._pool.map(_observe, [(i, pops[i], state, fit.seed)
+			for i in range(len(pops))])
+		tm.stage('surveys')
+	else:
+		lnp= []
+		for i, epos in enumerate(fit.surveys):
+			_seed(i, state, fit.seed)
+			if Verbose: print '\nSurvey {}'.format(epos.name)
+			lnp.append(run.observe(epos, pops[i], tm=tm, Store=Store, Sample=Sample,
+				Extra=Extra, Verbose=Verbose))
+
+	if Store:
+		fit.prob= {epos.name:epos.prob for epos in fit.surveys}
+		fit.lnprob= np.sum([epos.lnprob for epos in fit.surveys])
+		if Verbose: print '\nJoint logp= {:.1f}'.format(fit.lnprob)
+		if Sample: return lnp
+	else:
+		return np.sum(lnp)
+
+def _split(fit, pop):
+	''' Divide the population into blocks of systems, one for each survey '''
+	if len(fit.surveys) == 1: return [pop]
+
+	if pop['ID'] is None:
+		sysID, nsys= np.arange(pop['P'].size), pop['P'].size
+	else:
+		sysID, nsys= pop['ID'], pop['nsys']
+	nstars= np.array([epos.nstars for epos in fit.surveys], dtype=float)
+	edges= nsys* np.cumsum(nstars)/np.sum(nstars)
+	# systems in a random order, without using the global random numbers
+	order= np.random.RandomState(fit.seed).permutation(nsys)
+	block= np.minimum(np.searchsorted(edges, order[sysID], side='right'), 
+		nstars.size-1)
+
+	xmin, xmax= fit.surveys[0].MC_xvar[0], fit.surveys[0].MC_xvar[-1]
+	pops= []
+	for i, epos in enumerate(fit.surveys):
+		select= block == i
+		if epos.MC_xvar[0] > xmin: select&= pop['P'] >= epos.MC_xvar[0]
+		if epos.MC_xvar[-1] < xmax: select&= pop['P'] <= epos.MC_xvar[-1]
+
+		subset= dict(pop)
+		for key in ['P', 'Y', 'M', 'R', 'I', 'N', 'ID']:
+			if pop[key] is not None: subset[key]= pop[key][select]
+		pops.append(subset)
+	return pops
+
+def _seed(i, state, seed):
+	''' The first survey continues with the random numbers of the population '''
+	if seed is None: return
+	if i == 0:	np.random.set_state(state)
+	else:		np.random.seed([seed, i])
+
+def _startpool(fit):
+	global _surveys
+	_surveys= fit.surveys
+	return multiprocessing.Pool(min(fit.threads, len(fit.surveys)))
+
+def _observe(args):
+	''' Simulate one survey, in a worker process '''
+	i, pop, state, seed= args
+	if seed is None: np.random.seed() # forked workers share the random state
+	else: _seed(i, state, seed)
+	return run.observe(_surveys[i], pop, Verbose=False)
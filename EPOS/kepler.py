@@ -2,26 +2,24 @@
 This module contains helper functions to load kepler survey data into EPOS
 '''
 import numpy as np
-import os
+import os, glob
 import EPOS
-
-try:
-	from astropy.table import Table
-except ImportError:
-	print '\nWarning: Could not import astropy.table'
+import cache, catalog
 
 fpath= os.path.dirname(EPOS.__file__)
 
-def dr25(subsample='all', score=0.9, Gaia=False, Huber=True, Vetting=False):
+def dr25(subsample='all', score=0.9, Gaia=False, Huber=True, Vetting=False, Cache=True):
 	'''
 	Generates Kepler DR25 planet population and detection efficiency
 	
 	Args:
-		subsample(str):	Subsample, choose from 'all', 'M', 'K', 'G', or 'F'
+		subsample(str):	Subsample, choose from 'all', 'M', 'K', 'G', or 'F', 
+			a 500 K Teff bin ('T5750'), or any Teff range ('T5000-6000')
 		score(float): Disposition score, 0-1, default 0.9
 		Gaia(bool): Use Gaia data (Stellar radii from Berger+ 2018)
 		Huber(bool): Use logg cut from Huber+ 2016
 		Vetting(bool): include vetting completeness
+		Cache(bool): use the persistent cache, see :mod:`EPOS.cache`
 		
 	Returns:
 		tuple: two dictionaries
@@ -34,31 +32,51 @@ def dr25(subsample='all', score=0.9, Gaia=False, Huber=True, Vetting=False):
 		survey(dict):
 			the grid is in xvar,yvar, the detection efficiency in eff_2D 
 	'''
-	if not os.path.isdir('temp/'): os.makedirs('temp/')
-
 	if Gaia:
 		#fkoi= 'temp/q1_q17_dr25-gaia-r1_koi.npz'
 		fkoi= 'temp/q1_q17_dr25-gaia-r2_koi.npz'
+		suffix='gaia-r1' # completeness needs update to r2
+	elif Huber:
+		fkoi= 'temp/q1_q17_dr25_koi.npz'
+		suffix='Huber'
 	else:
 		fkoi= 'temp/q1_q17_dr25_koi.npz'
-		
+		suffix='logg42'
+	
+	fipac= '{}/files/q1_q17_dr25_koi.tbl'.format(fpath)
+	fgaia= '{}/files/DR2PapTable1.txt'.format(fpath)
+	sfile= 'dwarfs' if subsample=='all' else subsample
+	feff= '{}/files/completeness.dr25.{}.{}.npz'.format(fpath,sfile, suffix)
+	
+	''' Load the selection from the user-wide cache '''
+	if Cache:
+		sources= [fipac, feff, os.path.splitext(__file__)[0]+'.py']
+		if Gaia: sources.append(fgaia)
+		if not os.path.isfile(fipac): sources.append(fkoi)
+		if subsample[0] == 'T': sources+= _cubefiles()
+		ckey= cache.key('dr25', dict(subsample=subsample, score=score, Gaia=Gaia, 
+			Huber=Huber, Vetting=Vetting), sources)
+		entry= cache.load(ckey)
+		if entry is not None:
+			print '\nLoading {} planets from cache {}'.format(subsample, ckey)
+			return entry['obs'], entry['survey']
+	
+	if not os.path.isdir('temp/'): os.makedirs('temp/')
+	
 	if os.path.isfile(fkoi):
 		print '\nLoading planets from {}'.format(fkoi)
 		koi= np.load(fkoi)
 	else:
 		print '\nReading planet candidates from IPAC file' 
-		try:
-			ipac=Table.read(fpath+'/files/q1_q17_dr25_koi.tbl',format='ipac')
-		except NameError:
-			raise ImportError('You need to install astropy for this step')
+		ipac= catalog.ipac(fipac, columns=['kepid','koi_prad','koi_period',
+				'koi_steff', 'koi_slogg', 'koi_srad', 'koi_depth',
+				'koi_pdisposition','koi_score'])
 		#print ipac.keys()
-		nonzero= (ipac['koi_srad']>0)
+		with np.errstate(invalid='ignore'):
+			nonzero= (ipac['koi_srad']>0)
 		nremove= ipac['koi_srad'].size- ipac['koi_srad'][nonzero].size
 		print '  removed {} planets with no stellar radii'.format(nremove)
-		koi= {key: np.array(ipac[key][nonzero]) for key in 
-				['kepid','koi_prad','koi_period',
-				'koi_steff', 'koi_slogg', 'koi_srad', 'koi_depth',
-				'koi_pdisposition','koi_score'] }
+		koi= {key: ipac[key][nonzero] for key in ipac}
 		# isnan= ~(koi['koi_srad']>0)
 		# print isnan.size
 		# print koi['kepid'][isnan]
@@ -69,39 +87,23 @@ def dr25(subsample='all', score=0.9, Gaia=False, Huber=True, Vetting=False):
 		if Gaia:
 			# Stellar radius table from Berger+ in prep., revision 2
 			#fgaia= 'files/DR2PapTable1_v1.txt'
-			fgaia= '{}/files/DR2PapTable1.txt'.format(fpath)
-			a=np.loadtxt(fgaia, delimiter='&', unpack=True, skiprows=1, comments='\\')
-			
-			# sort stars by ID for easy matching
-			order= a[0].argsort()
-			a= a[:,order]
-			assert np.all(np.sort(a[0])==a[0]), 'Whoops II'
+			gaia= catalog.delimited(fgaia, delimiter='&', skiprows=1, comments='\\',
+				columns={'starID':0, 'Teff':2, 'distance':4, 'Rst':7, 'giantflag':11})
 			
-			common= np.intersect1d(koi['kepid'], a[0], assume_unique=False)
-			print '  {} common out {} kois and {} stars in gaia'.format(common.size, 
-							koi['kepid'].size, a[0].size)
+			# gaia star of each koi
+			st_to_pl= catalog.join(koi['kepid'], gaia['starID'])
+			koi_in_gaia= st_to_pl >= 0
+			print '  {} common out {} kois and {} stars in gaia'.format(
+				np.unique(koi['kepid'][koi_in_gaia]).size, 
+				koi['kepid'].size, gaia['starID'].size)
 			
 			# remove kois w/ no gaia data
-			koi_in_gaia= np.in1d(koi['kepid'], a[0])
 			for key in koi:
 				koi[key]= koi[key][koi_in_gaia]
+			st_to_pl= st_to_pl[koi_in_gaia]
 			print '  {} stars, {} kois in gaia'.format(koi['kepid'].size, 
 				np.unique(koi['kepid']).size)
 			
-			# remove gaia data w/ no koi
-			gaia_in_koi= np.in1d(a[0], koi['kepid'])
-			gaia=dict(starID= a[0][gaia_in_koi],
-					  Teff=a[2][gaia_in_koi],
-					  distance=a[4][gaia_in_koi],
-					  Rst= a[7][gaia_in_koi],
-					  giantflag= a[11][gaia_in_koi])
-			print '  {} gaia stars that are kois'.format(gaia['starID'].size)
-			assert gaia['starID'].size == np.unique(koi['kepid']).size
-			
-			# stars w/ multiple planet candidates		
-			_, st_to_pl= np.unique(koi['kepid'], return_inverse=True)
-			assert np.all(gaia['starID'][st_to_pl]==koi['kepid'])
-			
 			# update radii
 			with np.errstate(divide='ignore'):
 				increase= np.nanmedian(gaia['Rst'][st_to_pl]/ koi['koi_srad'])-1.
@@ -120,21 +122,19 @@ def dr25(subsample='all', score=0.9, Gaia=False, Huber=True, Vetting=False):
 	''' Remove giant stars'''
 	if Gaia:
 		isdwarf= koi['giantflag'] == 0
-		suffix='gaia-r1' # completeness needs update to r2
 	elif Huber:
 		isdwarf= koi['koi_slogg'] > 1./4.671 * \
 					np.arctan((koi['koi_steff']-6300.)/-67.172)+ 3.876
 		isgiant= koi['koi_slogg'] < np.where(koi['koi_steff']>5000, 
 									13.463-0.00191*koi['koi_steff'],3.9)
 		issubgiant= ~isdwarf & ~isgiant
-		suffix='huber'
 	else:
 		isdwarf= koi['koi_slogg']>4.2
-		suffix='logg42'
 	
 	''' Select reliable candidates '''
 	iscandidate= koi['koi_pdisposition']=='CANDIDATE'
-	isreliable= koi['koi_score']>=score # removes rolling band, ~ 500 planets
+	with np.errstate(invalid='ignore'): # missing scores are nan
+		isreliable= koi['koi_score']>=score # removes rolling band, ~ 500 planets
 	print '  {}/{} dwarfs'.format(isdwarf.sum(), isdwarf.size)
 	print '  {} candidates, {} false positives'.format((isdwarf&iscandidate).sum(), 
 				(isdwarf&~iscandidate).sum() )
@@ -154,8 +154,11 @@ def dr25(subsample='all', score=0.9, Gaia=False, Huber=True, Vetting=False):
 		slice= isall & (Teff[subsample][0]<koi['koi_steff']) \
 						& (koi['koi_steff']<=Teff[subsample][1])
 	elif subsample[0] == 'T':
-		Tmin=int(subsample[1:])-250
-		Tmax=int(subsample[1:])+250
+		if '-' in subsample:
+			Tmin, Tmax= [float(T) for T in subsample[1:].split('-')]
+		else:
+			Tmin=int(subsample[1:])-250
+			Tmax=int(subsample[1:])+250
 		slice= isall & (Tmin<koi['koi_steff']) & (koi['koi_steff']<=Tmax)
 	else:
 		raise ValueError('Subsample {} not recognized'.format(subsample))
@@ -167,12 +170,16 @@ def dr25(subsample='all', score=0.9, Gaia=False, Huber=True, Vetting=False):
 	
 	''' Load pre-calculated detection efficiencies '''
 	# from dr25_epos.py
-	sfile= 'dwarfs' if subsample=='all' else subsample
-	eff= np.load('{}/files/completeness.dr25.{}.{}.npz'.format(fpath,sfile, suffix))
-	#eff= np.load('files/det_eff.dr25.{}.npz'.format(subsample))
-	survey= {'xvar':eff['P'], 'yvar':eff['Rp'], 'eff_2D':eff['fsnr'], 
-			'Mstar': eff['Mst'], 'Rstar':eff['Rst']}
-	obs['nstars']= eff['n']
+	if subsample[0] == 'T' and Huber and not Gaia:
+		# interpolate in Teff, see completeness()
+		survey, obs['nstars']= completeness(Trange=[Tmin, Tmax], Cache=Cache)
+		eff= {'P':survey['xvar'], 'Rp':survey['yvar'], 'fsnr':survey['eff_2D']}
+	else:
+		eff= np.load(feff)
+		#eff= np.load('files/det_eff.dr25.{}.npz'.format(subsample))
+		survey= {'xvar':eff['P'], 'yvar':eff['Rp'], 'eff_2D':eff['fsnr'], 
+				'Mstar': eff['Mst'], 'Rstar':eff['Rst']}
+		obs['nstars']= eff['n']
   	
 	''' Add vetting completeness '''
 	if Vetting:
@@ -190,8 +197,95 @@ def dr25(subsample='all', score=0.9, Gaia=False, Huber=True, Vetting=False):
 		else:
 			print 'no vetting completeness for {} with score={}'.format(subsample, score)
 	
+	if Cache: cache.save(ckey, {'obs':obs, 'survey':survey})
+	
 	return obs, survey
 	
+def cube(Cache=True):
+	'''
+	Kepler DR25 detection efficiency of dwarf stars as a function of Teff
+	
+	Description:
+		Combines the 500 K Teff bins (3000-7000 K, Huber+ 2016 dwarfs) 
+		into a single array, stored in the cache (:mod:`EPOS.cache`)
+		
+	Returns:
+		dict:
+			Teff(np.array): bin centers
+			P(np.array), Rp(np.array): the period-radius grid
+			fsnr(np.array): detection efficiency, shape (Teff, P, Rp)
+			n, Mst, Rst (np.array): number of stars, mean mass and radius per bin
+	'''
+	files= _cubefiles()
+	if Cache:
+		ckey= cache.key('cube', {}, files+[os.path.splitext(__file__)[0]+'.py'])
+		entry= cache.load(ckey)
+		if entry is not None: return entry['cube']
+	
+	effs= [np.load(fname) for fname in files]
+	Teff= np.array([float(fname.split('.T')[-1].split('.')[0]) for fname in files])
+	order= np.argsort(Teff)
+	
+	cb= {'Teff': Teff[order], 'P': effs[0]['P'], 'Rp': effs[0]['Rp']}
+	for eff in effs:
+		assert np.all(eff['P']==cb['P']) and np.all(eff['Rp']==cb['Rp']), 'Different grids'
+	for key in ['fsnr', 'n', 'Mst', 'Rst']:
+		cb[key]= np.array([effs[i][key] for i in order])
+	
+	if Cache: cache.save(ckey, {'cube':cb})
+	return cb
+
+def completeness(Teff=None, weights=None, Trange=None, Cache=True):
+	'''
+	Detection efficiency for any Teff or mixture of stars, from :func:`cube`
+	
+	Description:
+		For a Teff range, the bins are weighted by their number of stars 
+		times the fraction of the bin inside the range.
+		For a list of stellar temperatures, the detection efficiency is 
+		linearly interpolated between the bin centers and averaged.
+		
+	Args:
+		Teff(float or np.array): effective temperature(s) of the stars
+		weights(np.array): weight of each star, default equal
+		Trange(list): minimum and maximum Teff, instead of Teff
+		
+	Returns:
+		survey(dict): input for :meth:`EPOS.classes.epos.set_survey`
+		nstars(float): the number of stars
+	'''
+	cb= cube(Cache=Cache)
+	Tc= cb['Teff']
+	
+	if Trange is not None:
+		dT= np.diff(Tc).mean()
+		overlap= np.minimum(Tc+dT/2., Trange[1])- np.maximum(Tc-dT/2., Trange[0])
+		wbin= cb['n']* np.clip(overlap/dT, 0, 1)
+		nstars= wbin.sum()
+	elif Teff is not None:
+		Teff= np.atleast_1d(Teff).astype(float)
+		weights= np.ones_like(Teff) if weights is None else np.asarray(weights, dtype=float)
+		x= np.interp(Teff, Tc, np.arange(Tc.size)) # fractional bin index
+		i= np.minimum(x.astype(int), Tc.size-2)
+		f= x- i
+		wbin= np.bincount(i, weights=weights*(1.-f), minlength=Tc.size)+ \
+			np.bincount(i+1, weights=weights*f, minlength=Tc.size)
+		nstars= weights.sum()
+	else:
+		raise ValueError('Provide Teff or Trange')
+	
+	if not wbin.sum() > 0:
+		raise ValueError('No stars in the Teff range of the completeness cube')
+	w= wbin/ wbin.sum()
+	
+	survey= {'xvar':cb['P'], 'yvar':cb['Rp'], 
+		'eff_2D': np.tensordot(w, cb['fsnr'], axes=1),
+		'Mstar': np.dot(w, cb['Mst']), 'Rstar': np.dot(w, cb['Rst'])}
+	return survey, nstars
+
+def _cubefiles():
+	return sorted(glob.glob('{}/files/completeness.dr25.T*.Huber.npz'.format(fpath)))
+
 def fbpl2d((x,y), a, b, c, d, e, f, g):
 	bpl= a* (x/b)**np.where(x<b, c, d) * (y/e)**np.where(y<e, f,g)
 	return np.maximum(0.2, np.minimum(bpl, 1.))
@@ -157,3 +157,164 @@ def _first_planet_in_system(counts):
 	di= np.roll(counts,1)
 	di[0]=0
 	return np.cumsum(di) # index to first planet
+
+def expected_frequency(ID, p_det, p_trans=None, f_cor=0.):
+	'''
+	returns the expected frequency of single/double/triple/etc systems
+	
+	Args:
+		ID(np.array): array of planet host star identifiers. Planets in the
+			same system are adjacent.
+		p_det(np.array): detection probability of each planet
+		p_trans(np.array): transit probability of each planet, default 1
+		f_cor(float): fraction of systems where the detection of planets is 
+			correlated (the same random number)
+
+	Description:
+		The number of detected planets in a system follows a Poisson binomial
+		distribution, that is built up planet by planet for all systems at 
+		once. If detections are correlated, a planet is only detected if the 
+		planets with a higher detection probability are, and the distribution
+		is a sum over the planets in order of detection probability.
+	'''
+	if p_trans is None: p_trans= np.ones_like(p_det)
+	if ID.size == 0: return np.arange(1,1), np.zeros(0)
+	
+	first= np.flatnonzero(np.r_[True, ID[1:]!=ID[:-1]])
+	counts= np.diff(np.r_[first, ID.size])
+	isys= np.repeat(np.arange(first.size), counts)
+	j= np.arange(ID.size)- first[isys] # index of planet in system
+	
+	pk= (1.-f_cor)* _poissonbinomial(isys, j, p_trans*p_det, counts.max())
+	
+	if f_cor > 0:
+		order= np.lexsort((-p_det, isys))
+		p_sorted= p_det[order]
+		# probability that exactly the first j planets are detectable
+		p_next= np.r_[p_sorted[1:], 0.]
+		p_next[first[1:]-1]= 0.
+		pk_cor= _poissonbinomial(isys, j, p_trans[order], counts.max(), 
+			dp= p_sorted-p_next)
+		pk_cor[:,0]+= 1.- p_sorted[first]
+		pk+= f_cor* pk_cor
+	
+	return np.arange(1,counts.max()+1), np.sum(pk, axis=0)[1:]
+
+def _poissonbinomial(isys, j, p, kmax, dp=None):
+	''' probability of k=0..kmax planets in each system, or the sum of 
+	the probabilities after each planet weighted by dp '''
+	pk= np.zeros((isys[-1]+1, kmax+1))
+	pk[:,0]= 1.
+	if dp is not None: pk_sum= np.zeros_like(pk)
+	for jj in range(kmax):
+		i= (j==jj)
+		s, q= isys[i], p[i,None]
+		new= pk[s]* (1.-q)
+		new[:,1:]+= pk[s,:-1]* q
+		pk[s]= new
+		if dp is not None: pk_sum[s]+= dp[i,None]* new
+	return pk if dp is None else pk_sum
+
+def expected_chain(pin, kernel, s, w, npl, dmax=None):
+	'''
+	returns the expected multiplicity, periods, period ratios and inner 
+	periods of detected planets in systems on a grid in log period
+	
+	Args:
+		pin(np.array): probability of the first planet in each period cell
+		kernel(np.array): probability that the next planet is m=0,1,.. cells
+			further out. Planets outside the grid are lost
+		s(np.array): probability to detect planet j in each cell, with shape
+			(nodes, planets, cells). Detections are independent for each node
+		w(np.array): weight of each node, f.e. a viewing angle
+		npl(float): planets per system, int(npl)+1 in a fraction of systems
+		dmax(int): largest period ratio, in cells, of adjacent detected planets
+	
+	Returns:
+		dict: per system, the probability of k=0,1,.. detected planets (Nk), 
+			the expected detected planets in each cell (P), adjacent pairs of
+			detected planets m=0,1,..,dmax cells apart (dP), and innermost 
+			planets of systems with k>1 in each cell (Pin)
+	
+	Description:
+		The planets are added one by one, keeping track of the cell of the
+		last planet, the number of detected planets, and the cell of the last
+		detected planet (for dP). For the 
+		innermost planet, the probability that none of the planets further
+		out is detected is calculated backwards. If npl is not an integer, 
+		the statistics are averaged over systems with int(npl) and int(npl)+1 
+		planets.
+	'''
+	nb, nj, nx= s.shape
+	n0, frac= int(npl), npl-int(npl)
+	nmax= n0+1 if frac > 0 else n0
+	if nj < nmax: raise ValueError('detection probability of {} planets'.format(nmax))
+	
+	# planets at cell x move to x+m, or leave the grid
+	Kmat= np.zeros((nx, nx))
+	for m in np.flatnonzero(kernel[:nx]):
+		Kmat+= kernel[m]* np.eye(nx, k=m)
+	out= 1.- Kmat.sum(axis=1)
+	
+	# fraction of systems with the jth planet, and with exactly j planets
+	exist= np.ones(nmax)
+	final= np.zeros(nmax)
+	if frac > 0:
+		exist[-1]= frac
+		final[-2:]= 1.-frac, frac
+	else:
+		final[-1]= 1.
+	
+	''' add the planets one by one '''
+	K= nmax+1
+	G= np.zeros((nb, K, nx)) # cell of planet j, detections before j
+	G[:,0,:]= pin
+	lost= np.zeros((nb, K))
+	Nk= np.zeros(K)
+	P= np.zeros(nx)
+	first= [] # first detection is planet j
+	if dmax is not None:
+		# cell of planet j, for each cell of the last detection (x0)
+		x0= np.flatnonzero(np.any(s > 0, axis=(0,1)))
+		d= np.arange(nx)[None,:]- x0[:,None]
+		band= (0 <= d) & (d <= dmax)
+		H= np.zeros((nb, x0.size, nx))
+		dP= np.zeros(dmax+1)
+	
+	for j in range(nmax):
+		sj= s[:,j,:]
+		if j > 0:
+			flat= F.reshape(nb*K, nx)
+			lost+= np.dot(flat, out).reshape(nb, K)
+			G= np.dot(flat, Kmat).reshape(nb, K, nx)
+			if dmax is not None:
+				H= np.dot(H.reshape(nb*x0.size, nx), Kmat).reshape(H.shape)* band
+		
+		detected= G.sum(axis=1)* sj
+		P+= exist[j]* np.dot(w, detected)
+		first.append(G[:,0,:]* sj)
+		
+		if dmax is not None:
+			pair= np.tensordot(w, H* sj[:,None,:], axes=1)
+			dP+= exist[j]* np.bincount(d[band], weights=pair[band], minlength=dmax+1)
+			H*= (1.-sj)[:,None,:]
+			H[:,np.arange(x0.size),x0]+= detected[:,x0]
+		
+		F= G* (1.-sj)[:,None,:]
+		F[:,1:,:]+= G[:,:-1,:]* sj[:,None,:]
+		if final[j] > 0:
+			Nk+= final[j]* np.dot(w, F.sum(axis=2)+ lost)
+	
+	''' innermost of at least two detected planets '''
+	Pin= np.zeros(nx)
+	for n in range(n0, nmax+1):
+		if not final[n-1] > 0: continue
+		none= np.ones((nb, nx)) # no detections further out than planet j
+		for j in range(n-1, -1, -1):
+			if j < n-1:
+				none= out+ np.dot((1.-s[:,j+1,:])* none, Kmat.T)
+			Pin+= final[n-1]* np.dot(w, first[j]* (1.-none))
+	
+	chain= {'Nk':Nk, 'P':P, 'Pin':Pin}
+	if dmax is not None: chain['dP']= dP
+	return chain
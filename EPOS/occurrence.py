@@ -4,6 +4,7 @@ import multiprocessing
 from functools import partial
 
 from EPOS.population import periodradius
+from EPOS.run import percentile
 
 def all(epos):
 	if hasattr(epos,'occurrence'):
@@ -251,7 +252,8 @@ def _posterior_per_bin(epos, xbins, ybins, Verbose=True):
 					posterior.append(np.average(pdf))
 
 			#pos= np.percentile(posterior, [16, 50, 84])
-			perc= np.percentile(posterior, [2.3, 15.9, 50., 84.1, 97.7])
+			weights= epos.weights if hasattr(epos, 'weights') else None
+			perc= percentile(posterior, [2.3, 15.9, 50., 84.1, 97.7], weights=weights)
 			pos.append(perc[2])
 			sigp.append(perc[3]-perc[2])
 			sign.append(perc[2]-perc[1])
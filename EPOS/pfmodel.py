@@ -1,4 +1,3 @@
-import h5py
 import glob
 import numpy as np
 import sys, os
@@ -32,6 +31,7 @@ def symba(name, fname, plts_mass=0, cut=-np.inf, istep=None, Verbose=False, Save
 				raise ValueError('Key {} not present\n{}'.format(key,npz.keys()))
 	else:
 		print '\nProcessing Symba HDF5 file for {}'.format(name)
+		import h5py
 		#fname= '{}/{}_set??.h5'.format(dir,name)
 		flist= glob.glob(fname)
 		if len(flist)==0: 
@@ -1,3 +1,8 @@
 __all__ = ['survey', 'input','output','model','mcmc','occurrence'] 
-import survey, input, output, model, mcmc, occurrence
+import EPOS
+if EPOS.headless:
+	from matplotlib import use; use('Agg')
+import survey, input, output, model, mcmc, occurrence, helpers
 #import architecture
+
+helpers.set_pyplot_defaults() # nicer plots
@@ -14,9 +14,10 @@ except:
 	print '??'
 
 def all(epos):
-	if hasattr(epos, 'chain'):
-		print '\nPlotting chain...'
-		chain(epos)
+	if hasattr(epos, 'samples'):
+		if hasattr(epos, 'chain'):
+			print '\nPlotting chain...'
+			chain(epos)
 		try:
 			corners(epos)
 		except NameError:
@@ -38,7 +39,7 @@ def all(epos):
 				multi.periodinner(epos, MCMC=True)
 			
 	else:
-		print '\nNo chain to plot, did you run EPOS.run.mcmc()? \n'
+		print '\nNo chain to plot, did you run EPOS.run.mcmc() or EPOS.samplers? \n'
 	
 def chain(epos):
 	nwalker, nstep, npara= epos.chain.shape
@@ -83,7 +84,8 @@ def corners(epos):
 	else:
 		labels=epos.fitpars.keysfit
 		
-	fig = corner.corner(epos.samples, labels=labels,
+	weights= epos.weights if hasattr(epos, 'weights') else None
+	fig = corner.corner(epos.samples, labels=labels, weights=weights,
                       truths=epos.fitpars.getfit(Init=True), 
                       quantiles=[0.16, 0.5, 0.84], show_titles=True)
 	fig.savefig('{}mcmc/triangle.png'.format(epos.plotdir))
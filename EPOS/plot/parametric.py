@@ -38,7 +38,8 @@ def oneD_x(epos, PlotZoom=False, MCMC=False, Occ=False, Log=True):
 		pps, _, pdf_X, _= periodradius(epos, ybin=ybin)
 	
 	''' construct the posterior parameters '''
-	if MCMC: plotsample= epos.samples[np.random.randint(len(epos.samples), size=100)]
+	if MCMC: plotsample= epos.samples[np.random.choice(len(epos.samples), size=100,
+				p=epos.weights if hasattr(epos, 'weights') else None)]
 		
 	''' Orbital Period '''
 	f, ax = plt.subplots()
@@ -126,7 +127,8 @@ def oneD_y(epos, PlotZoom=False, MCMC=False, PlotQ=False, Occ=False):
 		pps, _, _, pdf_Y= periodradius(epos, xbin=xbin)
 	
 	''' construct the posterior parameters '''
-	if MCMC: plotsample= epos.samples[np.random.randint(len(epos.samples), size=100)]
+	if MCMC: plotsample= epos.samples[np.random.choice(len(epos.samples), size=100,
+				p=epos.weights if hasattr(epos, 'weights') else None)]
 	
 	''' Planet Radius, Mass, or q '''
 	# TODO: zip into previous block
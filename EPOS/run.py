@@ -1,19 +1,21 @@
 import numpy as np
 from scipy import interpolate
-from scipy.stats import ks_2samp, anderson_ksamp, norm, chi2_contingency, kstest
-import os, sys, logging, time
+from scipy.stats import ks_2samp, anderson_ksamp, norm, chi2_contingency, kstest, \
+	chisquare
+from scipy.stats.distributions import kstwobign
+from scipy.optimize import minimize, differential_evolution
+import os, sys, time
+import multiprocessing
 from functools import partial
 
 import cgs
 import multi
+import surrogate
+import timing
+import stars
 from EPOS.fitfunctions import brokenpowerlaw1D
 from EPOS.population import periodradius
 
-try:
-	import emcee
-except ImportError:
-	print '#WARNING# emcee could not be imported'
-
 def once(epos, fac=1.0, Extra=None, goftype='KS'):
 	'''
 	Run EPOS once
@@ -23,8 +25,11 @@ def once(epos, fac=1.0, Extra=None, goftype='KS'):
 		
 	Args:
 		Extra: store the planet population as an extra for plotting, default None
+		goftype(str): goodness-of-fit, 'KS' or 'AD' two-sample tests, or 'Poisson'
+			for a binned likelihood
 	'''
 	epos.goftype=goftype
+	clearcache()
 	
 	if not epos.Prep:
 		
@@ -85,18 +90,49 @@ def once(epos, fac=1.0, Extra=None, goftype='KS'):
 	else:
 		print '\nStarting extra {} run {}'.format(runtype, Extra)
 	tstart=time.time()
-	runonce= MC if epos.MonteCarlo else noMC
+	runonce= _engine(epos)
+	timing.last= None
 	runonce(epos, fpara, Store=True, Extra=Extra)
 	tMC= time.time()
 	print 'Finished one {} in {:.3f} sec'.format(runtype, tMC-tstart)
 	epos.tMC= tMC-tstart
+	epos.timings.add(timing.record())
+	
+def mcmc(epos, nMC=500, nwalkers=100, dx=0.1, nburn=50, threads=1, npos=30, Saved=True,
+		Optimize=False, Surrogate=False, fidelity=None):
+	'''
+	Run an MCMC chain with emcee
+	
+	Args:
+		Optimize(bool or str): Start the walkers around the maximum a posteriori 
+			instead of the initial guess, see :func:`optimize` (Nelder-Mead).
+			Set to 'differential_evolution' for a global search. A stored 
+			epos.map is reused only if the fit parameters have not changed
+		Surrogate(bool): Skip simulations of proposals that a surrogate 
+			log-likelihood confidently places far below the ensemble, 
+			see :mod:`EPOS.surrogate`. Skipped proposals are rejected, so the
+			posterior is approximate. Previous evaluations with the same 
+			settings are reused
+		fidelity(float): Simulate this fraction of the stars during the burn-in
+			(the first nburn steps), see :func:`calibrate`. The walkers continue
+			at epos.fidelity, the chain contains both parts
 	
-def mcmc(epos, nMC=500, nwalkers=100, dx=0.1, nburn=50, threads=1, npos=30, Saved=True):
-	if not 'emcee' in sys.modules:
+	Note:
+		The time spent in each stage of the simulations is collected in 
+		epos.timings and saved to timings.json next to the chain.
+		The log-likelihood of each step is stored in epos.lnprobability, 
+		see :func:`EPOS.samplers.reweight`
+	'''
+	try:
+		import emcee
+	except ImportError:
 		raise ImportError('You need to install emcee')
 	assert epos.Prep
+	if fidelity is not None:
+		if Surrogate: raise ValueError('Surrogate needs a single fidelity')
+		if not nburn < nMC: raise ValueError('No steps after the burn-in')
 	
-	runonce= MC if epos.MonteCarlo else noMC
+	runonce= _engine(epos)
 	
 	''' set starting parameters '''
 	fpara= epos.fitpars.getfit(Init=True)
@@ -118,6 +154,7 @@ def mcmc(epos, nMC=500, nwalkers=100, dx=0.1, nburn=50, threads=1, npos=30, Save
 		
 		epos.chain=npz['chain']
 		assert epos.chain.shape == (nwalkers, nMC, ndim)
+		epos.lnprobability= npz['lnprob'] if 'lnprob' in npz else None
 		
 		if epos.seed!=npz['seed']: 
 			print '\nNOTE: Random seed changed: {} to {}'.format(npz['seed'],epos.seed)
@@ -146,40 +183,73 @@ def mcmc(epos, nMC=500, nwalkers=100, dx=0.1, nburn=50, threads=1, npos=30, Save
 				print '  {:.3f} hours at 100% scaling'.format(runtime/threads)
 			else:
 				print '  {:.1f} minutes at 100% scaling'.format(runtime/threads*60.)
-	
-		''' Set up a log file '''
-		# Note: if logging.debug is called before this, the log file is never created
-		fdir= 'log/{}'.format(epos.name)
-		if not os.path.exists(fdir): os.makedirs(fdir)
-		flog='{}/{}.log'.format(fdir,time.strftime('%Y-%m-%d_%H.%M.%S'))
-		logging.basicConfig(filename=flog,level=logging.DEBUG,filemode='w')
-		logging.info('MCMC with random seed {}'.format(epos.seed))
 		
-		''' Wrap function '''
-		lnmc= partial(runonce, epos, Verbose=False)
+		''' Wrap function, return the timings (and reasons for rejection) as blobs '''
+		lnmc= timing.timed(partial(runonce, epos, Verbose=False))
 	
 		''' Set up the MCMC walkers '''
 		#p0 = [np.array(fpara)*np.random.uniform(1.-dx,1+dx,len(fpara)) 
 		#		for i in range(nwalkers)]
 		dx=np.array(epos.fitpars.getfit(attr='dx'))
+		if Optimize:
+			# any stored MAP, unless a method is requested
+			method= Optimize if type(Optimize) is str else None
+			if not hasattr(epos, 'map') or epos.map.get('fitpars') != _mapstate(epos) \
+					or method not in [None, epos.map.get('method')]:
+				optimize(epos, method=method or 'Nelder-Mead', threads=threads)
+			fpara, dx= epos.map['fpara'], epos.map['sigma']
 		p0 = [np.array(fpara)+dx*np.random.uniform(-1,1,len(fpara)) 
 				for i in range(nwalkers)]
-		sampler = emcee.EnsembleSampler(nwalkers, len(fpara), lnmc, threads=threads)
+		if Optimize:
+			# keep walkers inside the bounds
+			pmin= np.array(epos.fitpars.getfit(attr='min'))
+			pmax= np.array(epos.fitpars.getfit(attr='max'))
+			p0= [np.clip(p, pmin, pmax) for p in p0]
+		if Surrogate:
+			# previous evaluations with the same settings, next to the chain
+			fsur= '{}/{}'.format(dir, surrogate.key(epos))
+			emulator= surrogate.surrogate(epos.fitpars.getfit(attr='dx'))
+			if os.path.isfile(fsur): emulator.load(fsur)
+			pool= surrogate.screeningpool(emulator, threads=threads)
+			sampler = emcee.EnsembleSampler(nwalkers, len(fpara), lnmc, pool=pool)
+		else:
+			sampler = emcee.EnsembleSampler(nwalkers, len(fpara), lnmc, threads=threads)
 	
-		''' run the chain '''
+		''' run the chain, the burn-in at a lower fidelity '''
+		if fidelity is None:
+			schedule= [(nMC, epos.fidelity)]
+		else:
+			schedule= [(nburn, fidelity), (nMC-nburn, epos.fidelity)]
+			print '  burn-in at fidelity {:.2g}'.format(fidelity)
 		if True:
 			# chop to pieces for progress bar?
-			for i, result in enumerate(sampler.sample(p0, iterations=nMC)):
-				amtDone= float(i)/nMC
-				print '\r  [{:50s}] {:5.1f}%'.format('#' * int(amtDone * 50), amtDone * 100),
-				os.sys.stdout.flush() 
+			i, pos, final= 0, p0, epos.fidelity
+			for niter, f in schedule:
+				# lnprob of the walkers is recalculated at the new fidelity
+				epos.fidelity= f
+				for result in sampler.sample(pos, iterations=niter):
+					if Surrogate: pool.update(result[1])
+					if len(result) > 3:
+						for rec in result[3]: epos.timings.add(rec)
+					amtDone= float(i)/nMC
+					print '\r  [{:50s}] {:5.1f}%'.format('#' * int(amtDone * 50), amtDone * 100),
+					os.sys.stdout.flush() 
+					i+= 1
+				pos= result[0]
+			epos.fidelity= final
 		else:
 			sampler.run_mcmc(p0, nMC)
 		
 		print '\nDone running\n'
-		logging.info('Made it to the end')
 		print 'Mean acceptance fraction: {0:.3f}'.format(
 					np.mean(sampler.acceptance_fraction))
+		if Surrogate:
+			pool.close()
+			nsims= pool.nsim
+			print '  {} simulations, {} skipped by the surrogate'.format(pool.nsim, pool.nskip)
+			emulator.save(fsur)
+		epos.timings.summary()
+		epos.timings.save('{}/timings.json'.format(dir))
 
 		''' Print run time'''	
 		tMC= time.time()
@@ -192,22 +262,122 @@ def mcmc(epos, nMC=500, nwalkers=100, dx=0.1, nburn=50, threads=1, npos=30, Save
 					runtime/60., (tMC-tstart)/nsims)
 	
 		epos.chain= sampler.chain
+		epos.lnprobability= sampler.lnprobability
 		print 'Saving status in {}'.format(fname)
 		#np.save(fname, epos.chain)
 		# compression slow on loading?
-		np.savez_compressed(fname, chain=epos.chain, seed=epos.seed, keys=epos.fitpars.keysfit)
+		np.savez_compressed(fname, chain=epos.chain, lnprob=epos.lnprobability, 
+			seed=epos.seed, keys=epos.fitpars.keysfit)
 		
 	''' the posterior samples after burn-in '''
 	epos.samples= epos.chain[:, nburn:, :].reshape((-1, ndim))
 	epos.burnin= nburn
+	if hasattr(epos, 'weights'): del epos.weights
+	
+	posterior(epos, npos=npos)
+	
+def calibrate(epos, fidelity=[0.1, 0.2, 0.5, 1.], nrep=20, fpara=None, threads=1, 
+		tolerance=1., Verbose=True):
+	'''
+	Noise of the log-likelihood as function of the fraction of stars simulated
+	
+	Description:
+		Evaluates the log-likelihood at fixed parameters with nrep different
+		random seeds, for each fidelity. The standard deviation is the Monte 
+		Carlo noise of the likelihood, to be compared with the differences in 
+		log-likelihood a sampler needs to resolve. Rejected evaluations 
+		(-inf) are not included in the mean and standard deviation, but 
+		counted separately. The recommended fidelity is the lowest one 
+		with a noise below tolerance, that rejects no larger fraction than 
+		the highest fidelity. Use it for the burn-in of :func:`mcmc`, or set 
+		epos.fidelity for exploratory runs.
+		Results are stored in epos.calibration
+	
+	Args:
+		fidelity(list): fractions of the stars to simulate
+		nrep(int): number of evaluations at each fidelity
+		fpara(list): fit parameters, default the initial guess
+		threads(int): number of parallel evaluations
+		tolerance(float): acceptable standard deviation of the log-likelihood
+	
+	Returns:
+		dict: fidelity, mean and standard deviation of the log-likelihood, 
+			fraction of rejected evaluations, run time per evaluation, and 
+			the recommended fidelity (None if no fidelity qualifies)
+	'''
+	assert epos.Prep
+	if fpara is None: fpara= epos.fitpars.getfit(Init=True)
+	seed, final= epos.seed, epos.fidelity
+	
+	pool= multiprocessing.Pool(threads) if threads > 1 else None
+	M= map if pool is None else pool.map
+	
+	cal= {key:np.zeros(len(fidelity)) for key in ['mean', 'std', 'rejected', 'time']}
+	cal['fidelity']= np.asarray(fidelity, dtype=float)
+	if Verbose: 
+		print '\nLog-likelihood noise from {} evaluations'.format(nrep)
+		print '  fidelity   mean logp   std   rejected   sec/call'
+	try:
+		for i, f in enumerate(cal['fidelity']):
+			epos.fidelity= f
+			tstart= time.time()
+			lnp= np.array(M(partial(_seeded, epos, fpara), range(1, nrep+1)))
+			cal['rejected'][i]= np.mean(~np.isfinite(lnp))
+			lnp= lnp[np.isfinite(lnp)]
+			cal['time'][i]= (time.time()-tstart)/nrep* threads
+			cal['mean'][i]= np.mean(lnp) if lnp.size > 0 else -np.inf
+			cal['std'][i]= np.std(lnp) if lnp.size > 1 else np.nan
+			if Verbose:
+				print '  {:8.3g} {:11.1f} {:7.2f} {:8.0%} {:10.3f}'.format(
+					cal['fidelity'][i], cal['mean'][i], cal['std'][i], 
+					cal['rejected'][i], cal['time'][i])
+	finally:
+		# also if a simulation raises or the user interrupts
+		epos.seed, epos.fidelity= seed, final
+		if pool is not None: pool.close()
+	
+	''' lowest fidelity with a low noise and no additional rejections '''
+	reference= cal['rejected'][np.argmax(cal['fidelity'])]
+	with np.errstate(invalid='ignore'):
+		ok= (cal['std'] <= tolerance) & (cal['rejected'] <= reference)
+	cal['recommended']= np.min(cal['fidelity'][ok]) if np.any(ok) else None
+	if Verbose:
+		if cal['recommended'] is None:
+			print '  No fidelity with a noise below {:.2g}'.format(tolerance)
+		else:
+			print '  Recommended fidelity: {:.3g}'.format(cal['recommended'])
+	
+	epos.calibration= cal
+	return cal
+
+def _seeded(epos, fpara, seed):
+	''' log-likelihood with a random seed '''
+	epos.seed= seed
+	return _engine(epos)(epos, fpara, Verbose=False)
+
+def posterior(epos, npos=30):
+	'''
+	Best-fit parameters and posterior populations from epos.samples
+	
+	Description:
+		Called at the end of :func:`mcmc` and the other samplers. 
+		Samples are weighted with epos.weights, if present. 
+	
+	Args:
+		npos(int): number of posterior samples to simulate for plotting
+	'''
+	runonce= _engine(epos)
+	weights= epos.weights if hasattr(epos, 'weights') else None
+	
 	fitpars = map(lambda v: (v[1], v[2]-v[1], v[1]-v[0]),
-                             zip(*np.percentile(epos.samples, [16, 50, 84],
-                                                axis=0)))
+                             zip(*percentile(epos.samples, [16, 50, 84],
+                                                weights=weights)))
 	epos.fitpars.setfit([p[0] for p in fitpars])
 	
 	''' Generate posterior populations '''
 	if npos is not None:
-		epos.plotsample= epos.samples[np.random.randint(len(epos.samples), size=npos)]
+		epos.plotsample= epos.samples[np.random.choice(len(epos.samples), size=npos,
+			p=weights)]
 		# run & store
 		print '\nMC-ing the {} samples to plot'.format(npos)
 		epos.ss_sample=[]
@@ -228,10 +398,10 @@ def mcmc(epos, nMC=500, nwalkers=100, dx=0.1, nburn=50, threads=1, npos=30, Save
 		
 		print
 		for name, posterior in zip(['Mercury','Venus'],[fMercury, fVenus]):
-			eta= np.percentile(posterior, [16, 50, 84]) 
+			eta= percentile(posterior, [16, 50, 84], weights=weights) 
 			print '{} analogues < {:.1%} +{:.1%} -{:.1%}'.format(name, eta[1], 
 					eta[2]-eta[1], eta[1]-eta[0])
-			UL= np.percentile(posterior, [68.2, 95.4, 99.7])
+			UL= percentile(posterior, [68.2, 95.4, 99.7], weights=weights)
 			for i in range(3): print '  {} sigma UL {:.1%}'.format(i+1,UL[i])
 
 
@@ -242,6 +412,127 @@ def mcmc(epos, nMC=500, nwalkers=100, dx=0.1, nburn=50, threads=1, npos=30, Save
 
 	print '\nStarting the best-fit MC run'	
 	runonce(epos, np.array([p[0] for p in fitpars]), Store=True)
+
+def percentile(samples, q, weights=None):
+	'''
+	Percentiles along the first axis, optionally weighted
+	
+	Args:
+		samples(np.array): samples, f.e. epos.samples
+		q(list): percentiles, between 0 and 100
+		weights(np.array): weight of each sample, f.e. epos.weights
+	
+	Returns:
+		np.array: percentiles of each column, like np.percentile(axis=0)
+	'''
+	if weights is None:
+		return np.percentile(samples, q, axis=0)
+	
+	samples= np.asarray(samples)
+	order= np.argsort(samples, axis=0)
+	cdf= np.cumsum(weights[order], axis=0)
+	cdf= (cdf-0.5*weights[order])/cdf[-1]
+	if samples.ndim == 1:
+		return np.interp(np.asarray(q)/100., cdf, samples[order])
+	else:
+		return np.array([np.interp(np.asarray(q)/100., cdf[:,i], samples[order[:,i],i]) 
+			for i in range(samples.shape[1])]).T
+	
+def optimize(epos, method='Nelder-Mead', threads=1, maxiter=None, box=10., 
+		Verbose=True):
+	'''
+	Find the maximum a posteriori (MAP) fit parameters
+	
+	Description:
+		Runs a derivative-free optimizer on the log-likelihood of :func:`MC`
+		(or :func:`noMC`), starting from the initial guess. 
+		With a fixed random seed every simulation uses the same random numbers,
+		which makes the likelihood a smooth function of the fit parameters.
+		The curvature around the maximum is estimated with finite differences
+		(step size dx) and is used by :func:`mcmc` to place the walkers.
+		Nelder-Mead is a local search that can stall in a local maximum of 
+		the Monte Carlo likelihood, use it to polish a good initial guess. 
+		Differential evolution searches the whole box, in parallel, at the 
+		cost of many more simulations.
+		Results are stored in epos.map
+	
+	Args:
+		method(str): 'Nelder-Mead' (local) or 'differential_evolution' (global)
+		threads(int): number of parallel likelihood evaluations, differential
+			evolution and the curvature estimate only
+		maxiter(int): maximum number of iterations/generations
+		box(float): search range for differential evolution, in units of dx, 
+			for parameters without bounds
+	'''
+	assert epos.Prep
+	if epos.seed is None:
+		print '\nWARNING: no random seed, the likelihood surface will be noisy'
+
+	runonce= _engine(epos)
+	lnmc= partial(runonce, epos, Verbose=False)
+	
+	fpara= np.array(epos.fitpars.getfit(Init=True))
+	dx= np.array(epos.fitpars.getfit(attr='dx'))
+	pmin= np.array(epos.fitpars.getfit(attr='min'))
+	pmax= np.array(epos.fitpars.getfit(attr='max'))
+	if not len(fpara)>0: raise ValueError('no fit paramaters defined')
+	if method == 'Nelder-Mead' and threads > 1:
+		print '\nWARNING: Nelder-Mead evaluates one simulation at a time'
+	
+	print '\nSearching for the maximum a posteriori with {}'.format(method)
+	tstart=time.time()
+	
+	pool= multiprocessing.Pool(threads) if threads > 1 else None
+	M= map if pool is None else pool.map
+	
+	if method == 'Nelder-Mead':
+		options= {'initial_simplex': [fpara]+[fpara+dx*e for e in np.identity(fpara.size)],
+			'xatol':1e-3*np.min(dx), 'fatol':1e-2}
+		if maxiter is not None: options['maxiter']= maxiter
+		result= minimize(_negative, fpara, args=(lnmc,), method='Nelder-Mead', 
+			options=options)
+	elif method == 'differential_evolution':
+		bounds= zip(np.maximum(pmin, fpara-box*dx), np.minimum(pmax, fpara+box*dx))
+		result= differential_evolution(_negative, bounds, args=(lnmc,), 
+			maxiter=1000 if maxiter is None else maxiter, seed=epos.seed, 
+			polish=False, updating='deferred', workers=M)
+	else:
+		raise ValueError('{} not an optimization method'.format(method))
+	
+	''' Curvature along each axis, from central differences '''
+	pbest= result.x
+	steps= [pbest+h for h in np.diag(dx)]+[pbest-h for h in np.diag(dx)]
+	lnp= np.array(M(lnmc, steps))
+	if pool is not None: pool.close()
+	
+	d2lnp= (lnp[:fpara.size]+lnp[fpara.size:]-2.*(-result.fun))/dx**2.
+	with np.errstate(divide='ignore', invalid='ignore'):
+		sigma= np.where(np.isfinite(d2lnp) & (d2lnp<0), (-1./d2lnp)**0.5, dx)
+	sigma= np.minimum(sigma, dx) # ball no wider than initial dispersion
+	
+	epos.map= {'fpara':pbest, 'lnprob':-result.fun, 'sigma':sigma, 
+		'nfev':result.nfev+len(steps), 'method':method, 'fitpars':_mapstate(epos)}
+	
+	if Verbose:
+		print '  {} likelihood evaluations in {:.1f} sec'.format(epos.map['nfev'], 
+			time.time()-tstart)
+		print '  logp= {:.1f}'.format(epos.map['lnprob'])
+		for pname, p, sig in zip(epos.fitpars.keysfit, pbest, sigma): 
+			print '  {}= {:.3g} +- {:.2g}'.format(pname, p, sig)
+
+def _negative(fpara, lnmc):
+	return -lnmc(fpara)
+
+def _mapstate(epos):
+	''' fit parameters, fixed values, and bounds that the MAP depends on '''
+	fp= epos.fitpars.fitpars
+	return [(key, fp[key]['value_init'], fp[key]['fixed'], fp[key].get('min'), 
+		fp[key].get('max')) for key in epos.fitpars.keysall]
+
+def _engine(epos):
+	''' simulation function of an epos instance, or of a joint fit (:mod:`EPOS.joint`) '''
+	if hasattr(epos, 'engine'): return epos.engine
+	return MC if epos.MonteCarlo else noMC
 	
 def prep_obs(epos):
 	# occurrence pdf on sma from plot_input_diag?
@@ -271,21 +562,150 @@ def prep_obs(epos):
 		multi.periodratio(epos.obs_starID[ix&iy], epos.obs_xvar[ix&iy])
 	z['multi']['cdf']= multi.cdf(epos.obs_starID[ix&iy])
 
+	# fixed bins and observed histograms for goftype='Poisson'
+	nb= int(np.clip(np.sqrt(x.size), 5, 20))
+	bins= z['bins']= {'xvar':_logbins(epos.xzoom, nb), 'yvar':_logbins(epos.yzoom, nb)}
+	bins['Nk']= z['multi']['bin'][-1]+1 # last bin is higher multiplicities
+	Pratio= z['multi']['Pratio']
+	if len(Pratio) > 0:
+		nb= int(np.clip(np.sqrt(len(Pratio)), 5, 20))
+		bins['dP']= _logbins([1., max(2., np.max(Pratio))], nb)
+		bins['Pin']= _logbins(epos.xzoom, nb)
+
+	counts= z['counts']= {'N':x.size}
+	counts['xvar']= _bincount(x, bins['xvar'])
+	counts['yvar']= _bincount(y, bins['yvar'])
+	counts['Nk']= _multiplicity(epos.obs_starID[ix&iy], bins['Nk'])
+	if len(Pratio) > 0:
+		counts['dP']= _bincount(Pratio, bins['dP'])
+		counts['Pin']= _bincount(z['multi']['Pinner'], bins['Pin'])
+
+cachesize= 0 # number of populations kept by MC, 0 to switch off the cache
+_cache= [] # (key, population, random state), most recent first
+
 def MC(epos, fpara, Store=False, Sample=False, StorePopulation=False, Extra=None, 
 		Verbose=True):
-	''' 
+	'''
 	Do the Monte Carlo Simulations
 	Note:
 	variable x/X is P
 	variable y/Y is R/M
-	TODO: split into multiple functions
-	'''	
-	if Verbose: tstart=time.time()
+
+	Description:
+		Draws the planet population with :func:`population` and simulates the
+		survey with :func:`observe`, in that order and with the same random
+		numbers as a single function. With epos.fidelity < 1, only that 
+		fraction of the stars is simulated.
+		With a random seed and cachesize > 0, the last populations are cached
+		with the state of the random number generator, and reused if only 
+		the parameters of the observation (f_iso, f_cor, f_inc, f_dP) change.
+		The result is the same as without the cache. The cache is off by 
+		default, :func:`EPOS.samplers.gibbs` switches it on
+	'''
+	tm= timing.call()
 	#if not Store: logging.debug(' '.join(['{:.3g}'.format(fpar) for fpar in fpara]))
-	
-	''' Seed the random number generator '''
-	if epos.seed is not None: np.random.seed(epos.seed)
-	
+
+	key= None if Store else _cachekey(epos, fpara)
+	entry= _fromcache(key)
+	if entry is None:
+		''' Seed the random number generator '''
+		if epos.seed is not None: np.random.seed(epos.seed)
+
+		pop= population(epos, fpara, tm=tm, Store=Store, Verbose=Verbose,
+			nstars=epos.fidelity*epos.nstars)
+		if pop is None: return -np.inf
+		pop['fidelity']= epos.fidelity
+		_tocache(key, pop)
+	else:
+		pop= _reuse(epos, fpara, entry[1], tm)
+		if pop is None: return -np.inf
+		np.random.set_state(entry[2])
+		tm.size('ndraw', pop['P'].size)
+		tm.stage('cache')
+
+	return observe(epos, pop, tm=tm, Store=Store, Sample=Sample, Extra=Extra,
+		Verbose=Verbose)
+
+def observationkeys(epos):
+	''' fit parameters that are used by :func:`observe` but not by :func:`population` '''
+	if not epos.Multi: keys= []
+	elif epos.Parametric: keys= ['f_iso', 'f_cor']
+	else: keys= ['f_iso', 'f_cor', 'f_inc', 'f_dP']
+	return [key for key in keys if key in epos.fitpars.keysfit]
+
+def clearcache():
+	''' Remove the populations cached by :func:`MC` '''
+	del _cache[:]
+
+def _cachekey(epos, fpara):
+	''' instance, settings, and parameters that determine the population, 
+	None if not cached '''
+	if cachesize < 1 or epos.seed is None: return None
+	obs= observationkeys(epos)
+	block= tuple(float(p) for key, p in zip(epos.fitpars.keysfit, fpara) 
+		if not key in obs)
+	fp= epos.fitpars.fitpars
+	fixed= tuple((key, repr(fp[key]['value_init'])) for key in epos.fitpars.keysall 
+		if fp[key]['fixed'])
+	ranges= tuple(tuple(getattr(epos, key, ())) for key in 
+		['xtrim', 'ytrim', 'xzoom', 'yzoom'])
+	draw= None
+	if not epos.Parametric and 'draw prob' in epos.pfm:
+		draw= hash(np.asarray(epos.pfm['draw prob']).tostring())
+	return (id(epos), epos.seed, epos.fidelity, epos.nstars, epos.Stratified, 
+		ranges, fixed, draw, block)
+
+def _fromcache(key):
+	if key is None: return None
+	for i, entry in enumerate(_cache):
+		if entry[0] == key:
+			_cache.insert(0, _cache.pop(i))
+			return entry
+	return None
+
+def _tocache(key, pop):
+	if key is None: return
+	_cache.insert(0, (key, pop, np.random.get_state()))
+	del _cache[cachesize:]
+
+def _reuse(epos, fpara, pop, tm):
+	''' cached population with the observation parameters of fpara '''
+	try:
+		epos.fitpars.checkbounds(fpara)
+	except ValueError:
+		tm.reject('out of bounds')
+		return None
+	pop= dict(pop)
+	for key in observationkeys(epos):
+		pop[key]= epos.fitpars.getmc(key, fpara)
+	# same checks as population
+	checks= ['f_iso'] if epos.Parametric else ['f_iso', 'f_cor']
+	for key in checks:
+		if pop[key] is not None and not (0 <= pop[key] <= 1):
+			tm.reject('out of bounds')
+			return None
+	return pop
+
+def population(epos, fpara, tm=None, Store=False, Verbose=True, nstars=None):
+	'''
+	Draw the planet population, the first part of :func:`MC`
+
+	Args:
+		tm(timing.call): timing record, a new one if None
+		Store(bool): raise a ValueError if the parameters are rejected
+		nstars(float): number of stars, default epos.nstars
+
+	Returns:
+		dict: planet properties (P, Y, and M, R, I, N, ID where defined), the
+			number of systems (nsys), and the parameters used by
+			:func:`observe`. None if the parameters are rejected
+	'''
+	if tm is None: tm= timing.call()
+	if nstars is None: nstars= epos.nstars
+	allM= allR= allI= allN= allID= None
+	dInc= f_iso= f_cor= None
+	f_inc= f_dP= 1.0
+
 	''' construct 1D arrays allP, allR or allM
 	dimension equal to sample size * planets_per_star
 	also keeping track of:
@@ -301,21 +721,23 @@ def MC(epos, fpara, Store=False, Sample=False, StorePopulation=False, Extra=None
 			epos.pdfpars.checkbounds(fpara)
 		except ValueError as message:
 			if Store: raise
-			else:
-				logging.debug(message)
-				return -np.inf
+			tm.reject('out of bounds')
+			return None
 				
 		''' Draw (inner) planet from distribution '''
 		pps= epos.fitpars.getpps_fromlist(fpara)
 		fpar2d= epos.fitpars.get2d_fromlist(fpara)
 		npl= epos.fitpars.getmc('npl', fpara) if epos.RandomPairing else 1
 		
-		try: sysX, sysY= draw_from_2D_distribution(epos, pps, fpar2d, npl=npl)
-		except ValueError:
+		try: sysX, sysY= draw_from_2D_distribution(epos, pps, fpar2d, npl=npl, tm=tm,
+			nstars=nstars)
+		except ValueError as message:
 			if Store: raise
-			else: return -np.inf
+			tm.reject(str(message))
+			return None
 		
 		''' Multi-planet systems '''
+		nsys= sysX.size
 		if not epos.Multi:
 			allX= sysX
 			allY= sysY
@@ -323,6 +745,7 @@ def MC(epos, fpara, Store=False, Sample=False, StorePopulation=False, Extra=None
 		elif epos.RandomPairing:			
 			# set ID, nth planet in system
 			isys= np.arange(sysX.size/npl)
+			nsys= isys.size
 			allID= np.repeat(isys,npl)
 			order= np.lexsort((sysX,allID)) # sort by ID, then P
 			assert np.all(allID[order]==allID)
@@ -335,7 +758,7 @@ def MC(epos, fpara, Store=False, Sample=False, StorePopulation=False, Extra=None
 			dInc= epos.fitpars.getmc('inc', fpara)
 			if dInc is not None:
 				f_iso= epos.fitpars.getmc('f_iso', fpara)
-				allI= np.random.rayleigh(dInc, allID.size)
+				allI= _rayleigh(epos, dInc, allID.size)
 			
 			f_cor= epos.fitpars.getmc('f_cor', fpara)
 			f_dP, f_inc= 1.0, 1.0 # no need to fudge these
@@ -353,16 +776,23 @@ def MC(epos, fpara, Store=False, Sample=False, StorePopulation=False, Extra=None
 			
 			''' Parameter bounds '''
 			if npl < 1:
-				logging.debug('npl = {:.3g} < 1'.format(npl))
 				if Store: raise ValueError('at least one planet per system')
-				return -np.inf
+				tm.reject('npl < 1')
+				return None
 			if (dInc <=0) or (dR <=0) or not (0 <= f_iso <= 1):
 				if Store: raise ValueError('parameters out of bounds')
-				return -np.inf
+				tm.reject('out of bounds')
+				return None
 			
 			''' Draw multiplanet distributions '''
-			allX, allY, allI, allN, allID= \
-				draw_multi(epos, sysX, sysY, npl, dInc, dR, fpara, Store)
+			try:
+				allX, allY, allI, allN, allID= \
+					draw_multi(epos, sysX, sysY, npl, dInc, dR, fpara)
+			except ValueError as message:
+				if Store: raise
+				tm.reject(str(message))
+				return None
+			tm.stage('multi')
 					
 		''' convert to observable parameters '''
 		allP= allX
@@ -378,9 +808,8 @@ def MC(epos, fpara, Store=False, Sample=False, StorePopulation=False, Extra=None
 			epos.fitpars.checkbounds(fpara)
 		except ValueError as message:
 			if Store: raise
-			else:
-				logging.debug(message)
-				return -np.inf
+			tm.reject('out of bounds')
+			return None
 				
 		''' Fit parameters'''
 		pps= epos.fitpars.getpps_fromlist(fpara)
@@ -394,17 +823,19 @@ def MC(epos, fpara, Store=False, Sample=False, StorePopulation=False, Extra=None
 		if not (0<=f_iso<=1) or not (0 < pps) or not (0 <= f_cor <= 1):
 			#\or not (0<=f_dP<=10) or not (0 <= f_inc < 10):
 			if Store: raise ValueError('parameters out of bounds')
-			return -np.inf
+			tm.reject('out of bounds')
+			return None
 		
 		''' 
 		Draw from all
 		'''
 		if not 'draw prob' in pfm:
-			ndraw= int(round(1.*epos.nstars*pps/pfm['ns']))
+			ndraw= int(round(1.*nstars*pps/pfm['ns']))
 			if Verbose: 
 				print '  {} planets in {} simulations'.format(pfm['np'],pfm['ns'])
-				print '  {} stars in survey, {} draws, eta={:.2g}'.format(epos.nstars, ndraw, pps)
+				print '  {} stars in survey, {} draws, eta={:.2g}'.format(nstars, ndraw, pps)
 		
+			nsys= ndraw*pfm['ns']
 			allP= np.tile(pfm['P'], ndraw)
 			allM= np.tile(pfm['M'], ndraw)
 			if 'R' in pfm:
@@ -420,21 +851,21 @@ def MC(epos, fpara, Store=False, Sample=False, StorePopulation=False, Extra=None
 		else:
 			'''
 			Draw from some distributions according to 'tag' parameter
-			TODO: functions to calculate draw probability from tag
+			draw probability from a function of the tag, see :mod:`EPOS.tags`
 			'''
 			#draw planetary systems from simulations
-			ndraw= int(round(1.*epos.nstars*pps))
+			ndraw= int(round(1.*nstars*pps))
+			nsys= ndraw
 			if Verbose: print '\nDraw {} systems'.format(ndraw) 
 			system_index= np.random.choice(pfm['system index'], size=ndraw, 
 							p=pfm['draw prob'])
 			
-			#create a list of planets
-			indexlist= [pfm['planet index'][pfm['ID']==i] for i in system_index]
-			starIDlist= [np.full((pfm['ID']==i).sum(),ID) 
-							for ID,i in enumerate(system_index)]
-			
-			planets= np.concatenate(indexlist)
-			allID= np.concatenate(starIDlist)
+			#create a list of planets, planets in a system are adjacent in pfm
+			npl= np.bincount(pfm['ID'], minlength=pfm['ns'])[system_index]
+			first= np.searchsorted(pfm['ID'], system_index)
+			allID= np.repeat(np.arange(ndraw), npl)
+			planets= pfm['planet index'][first[allID] + np.arange(allID.size) 
+				- (np.cumsum(npl)-npl)[allID]]
 			allP= pfm['P'][planets]
 			allM= pfm['M'][planets]
 			allR= pfm['R'][planets]
@@ -447,20 +878,72 @@ def MC(epos, fpara, Store=False, Sample=False, StorePopulation=False, Extra=None
 		allY= allM
 			
 		dInc=False # Isotropic inclinations not implemented
-			
+		tm.stage('draw')
+	
+	tm.size('ndraw', allP.size)
+
+	return {'P':allP, 'Y':allY, 'M':allM, 'R':allR, 'I':allI, 'N':allN, 'ID':allID,
+		'nsys':nsys, 'dInc':dInc, 'f_iso':f_iso, 'f_cor':f_cor, 'f_inc':f_inc,
+		'f_dP':f_dP}
+
+def observe(epos, pop, tm=None, Store=False, Sample=False, Extra=None, Verbose=True,
+		Detections=False):
+	'''
+	Simulate the survey of a planet population, the second part of :func:`MC`
+
+	Description:
+		Selects the transiting planets, converts them to observables, selects
+		the detectable planets, and compares them with the observations.
+		The population does not have to be drawn with the same epos instance,
+		see :mod:`EPOS.joint`
+
+	Args:
+		pop(dict): planet population from :func:`population`. The number of
+			detections is divided by pop['fidelity'], the fraction of stars
+			simulated, if present
+		tm(timing.call): timing record, a new one if None
+		Detections(bool): return the detected planets (P, Y, ID, and their
+			index in pop) instead of comparing them with the observations
+
+	Returns:
+		float: log-likelihood, or the synthetic survey if Store and Sample
+	'''
+	if tm is None: tm= timing.call()
+	allP, allY, allM, allR= pop['P'], pop['Y'], pop['M'], pop['R']
+	allI, allN, allID= pop['I'], pop['N'], pop['ID']
+	dInc, f_iso, f_cor, f_inc, f_dP= \
+		[pop[key] for key in ['dInc', 'f_iso', 'f_cor', 'f_inc', 'f_dP']]
+	fidelity= pop.get('fidelity', 1.)
+
+	''' 
+	Assign planets to host stars (star-by-star mode)
+	'''
+	if epos.StarByStar:
+		host= stars.assign(epos.stars['R'].size, allP.size, allID if epos.Multi else None)
+		R_a= stars.transitprob(epos.stars, host, allP)
+	else:
+		R_a= None
+
 	''' 
 	Identify transiting planets (itrans is a T/F array)
 	'''
+	w_trans= itrans_w= None
 	if epos.RV:
 		# RV keep all
 		itrans= np.full(allP.size, True, np.bool)
 	elif (not epos.Multi) or (epos.Multi and dInc==None):
 		# geometric transit probability
-		p_trans= epos.fgeo_prefac *allP**epos.Pindex
-		itrans= p_trans >= np.random.uniform(0,1,allP.size)
+		p_trans= epos.fgeo_prefac *allP**epos.Pindex if R_a is None else R_a
+		itrans= p_trans >= _uniform(epos, 0,1,allP.size)
+		if epos.Weighted:
+			# keep all planets, the transits only for the stored sample
+			w_trans, itrans_w= p_trans, itrans
+			itrans= np.full(allP.size, True, np.bool)
 	else:
 		#multi-transit probability
-		itrans= istransit(epos, allID, allI, allP, f_iso, f_inc, Verbose=Verbose)
+		itrans= istransit(epos, allID, allI, allP, f_iso, f_inc, Verbose=Verbose,
+			R_a=R_a)
+	tm.stage('transit')
 		
 	# Print multi statistics	
 	if Verbose and epos.Multi and not epos.RV: 
@@ -471,6 +954,7 @@ def MC(epos, fpara, Store=False, Sample=False, StorePopulation=False, Extra=None
 	remove planets according to transit probability
 	'''	
 	MC_P= allP[itrans]
+	if epos.StarByStar: MC_host= host[itrans]
 	if epos.MassRadius or epos.RV:	MC_M= allM[itrans]
 	else:							MC_R= allR[itrans]	
 	if epos.Multi:
@@ -480,6 +964,8 @@ def MC(epos, fpara, Store=False, Sample=False, StorePopulation=False, Extra=None
 		else:
 			#MC_P*= (1.+0.1*np.random.normal(size=MC_ID.size) )
 			pass
+	if epos.Weighted and w_trans is None:
+		w_trans, itrans_w= np.ones(MC_P.size), np.full(MC_P.size, True, np.bool)
 
 	'''
 	Set the observable MC_Y (R or Msin i) 
@@ -488,15 +974,17 @@ def MC(epos, fpara, Store=False, Sample=False, StorePopulation=False, Extra=None
 		''' M sin i.'''
 		# Note different conventions for i in Msini (i=0 is pole-on)
 		# sin(arccos(chi)) == cos(arcsin(chi)) == sqrt(1-chi^2)
-		MC_Y= MC_Msini= MC_M* np.sqrt(1.-np.random.uniform(0,1,MC_P.size)**2.)
+		MC_Y= MC_Msini= MC_M* np.sqrt(1.-_uniform(epos, 0,1,MC_P.size)**2.)
 	else:
 		''' Convert Mass to Radius '''
 		if epos.MassRadius:
 			mean, dispersion= epos.MR(MC_M)
-			MC_R= mean+ dispersion*np.random.normal(size=MC_M.size)
+			MC_R= mean+ dispersion*_normal(epos, MC_M.size)
 		
 		''' uncertainty in stellar radius? '''
-		MC_Y=MC_R * (1.+epos.radiusError*np.random.normal(size=MC_R.size) )
+		MC_Y=MC_R * (1.+epos.radiusError*_normal(epos, MC_R.size) )
+	tm.size('ntransit', MC_P.size)
+	tm.stage('observable')
 
 	
 	'''
@@ -504,27 +992,36 @@ def MC(epos, fpara, Store=False, Sample=False, StorePopulation=False, Extra=None
 	'''
 	if Store:
 		tr= epos.transit={}
-		tr['P']= MC_P
-		tr['Y']= MC_Y
+		tr['P']= MC_P if itrans_w is None else MC_P[itrans_w]
+		tr['Y']= MC_Y if itrans_w is None else MC_Y[itrans_w]
 	
 	'''
 	Identify detectable planets based on SNR (idet is a T/F array)
 	'''
-	f_snr= interpolate.RectBivariateSpline(epos.MC_xvar, epos.MC_yvar, epos.MC_eff)
-	p_snr= f_snr(MC_P, MC_Y, grid=False)
+	if epos.StarByStar:
+		p_snr= stars.detectionprob(epos, MC_host, MC_P, MC_R,
+			b=_uniform(epos, 0,1,MC_P.size))
+	else:
+		f_snr= interpolate.RectBivariateSpline(epos.MC_xvar, epos.MC_yvar, epos.MC_eff)
+		p_snr= f_snr(MC_P, MC_Y, grid=False)
 	assert p_snr.ndim == 1
 
-	idet= p_snr >= np.random.uniform(0,1,MC_P.size)
+	idet= p_snr >= _uniform(epos, 0,1,MC_P.size)
 	
 	# draw same random number for S/N calc, 1=correlated noise
 	if epos.Multi and f_cor >0:
 		IDsys, toplanet= np.unique(MC_ID, return_inverse=True) 
-		idet_cor= p_snr >= np.random.uniform(0,1,IDsys.size)[toplanet]
+		idet_cor= p_snr >= _uniform(epos, 0,1,IDsys.size)[toplanet]
 
-		cor_sys= (np.random.uniform(0,1,IDsys.size) < f_cor)
+		cor_sys= (_uniform(epos, 0,1,IDsys.size) < f_cor)
 		cor_pl= cor_sys[toplanet]
 		idet = np.where(cor_pl, idet_cor, idet)
 
+	if epos.Weighted:
+		# expected detections, and one realization 
+		w_det= w_trans* p_snr
+		idet&= itrans_w
+
 	''' 
 	Remove undetectable planets
 	'''
@@ -534,6 +1031,8 @@ def MC(epos, fpara, Store=False, Sample=False, StorePopulation=False, Extra=None
 		if not epos.RV and epos.Parametric: det_N= MC_N[idet]
 	det_P= MC_P[idet]
 	det_Y= MC_Y[idet]
+	tm.size('ndetect', det_P.size)
+	tm.stage('detection')
 
 	#if len(alldP)>0: 
 	# 	if not epos.Parametric and 'all_Pratio' in sg: 
@@ -543,6 +1042,10 @@ def MC(epos, fpara, Store=False, Sample=False, StorePopulation=False, Extra=None
 		print '  {} transiting planets, {} detectable'.format(idet.size, idet.sum())
 		multi.frequency(det_ID, Verbose=True)
 
+	if Detections:
+		return {'P':det_P, 'Y':det_Y, 'ID':det_ID if epos.Multi else None,
+			'index':np.flatnonzero(itrans)[idet]}
+
 	'''
 	Probability that simulated data matches observables
 	TODO:
@@ -560,62 +1063,82 @@ def MC(epos, fpara, Store=False, Sample=False, StorePopulation=False, Extra=None
 	# make sure that x=P, y=R (where?)
 	ix= (epos.xzoom[0]<=det_P) & (det_P<=epos.xzoom[1])
 	iy= (epos.yzoom[0]<=det_Y) & (det_Y<=epos.yzoom[1])
-	if (ix&iy).sum()<1:
+	if epos.Weighted:
+		inbox= (epos.xzoom[0]<=MC_P) & (MC_P<=epos.xzoom[1]) & \
+			(epos.yzoom[0]<=MC_Y) & (MC_Y<=epos.yzoom[1])
+		ndet= np.sum(w_det[inbox])
+	else:
+		ndet= (ix&iy).sum()
+	if not ndet > 0:
 		if Store: raise ValueError('no planets detectable')
-		return -np.inf			
+		return tm.reject('no planets detectable')
 	
-	if epos.goftype=='KS':
-		prob_2samp= _prob_ks
-	elif epos.goftype=='AD': 
-		prob_2samp= _prob_ad
+	if not epos.goftype in ['KS', 'AD', 'Poisson']:
+		raise ValueError('{} not a goodness-of-fit type (KS, AD, Poisson)'.format(epos.goftype))
+
+	if epos.Weighted:
+		''' Weighted planets, period ratios from the realization '''
+		if epos.Multi:
+			_, Nk= multi.expected_frequency(MC_ID[inbox], p_snr[inbox], w_trans[inbox], 
+				f_cor)
+			sim_dP, sim_Pinner= multi.periodratio(det_ID[ix&iy], det_P[ix&iy])
+			prob, lnp= _prob_weighted(epos, MC_P[inbox], MC_Y[inbox], w_det[inbox],
+				Nk=Nk, dP=f_dP*np.asarray(sim_dP), Pin=np.asarray(sim_Pinner), 
+				fidelity=fidelity)
+		else:
+			prob, lnp= _prob_weighted(epos, MC_P[inbox], MC_Y[inbox], w_det[inbox],
+				fidelity=fidelity)
+	elif epos.goftype=='Poisson':
+		''' Binned likelihood, the bins are set in prep_obs '''
+		prob, lnp= _prob_poisson(epos, det_P[ix&iy], det_Y[ix&iy],
+			det_ID[ix&iy] if epos.Multi else None, f_dP, fidelity=fidelity)
 	else:
-		raise ValueError('{} not a goodness-of-fit type (KS, AD)'.format(epos.goftype))
+		prob_2samp= _prob_ks if epos.goftype=='KS' else _prob_ad
 
-	if 'xvar' in epos.summarystatistic:
-		prob['xvar'], lnp['xvar']=  prob_2samp(epos.obs_zoom['x'], det_P[ix&iy])
-	if 'yvar' in epos.summarystatistic:
-		prob['yvar'], lnp['yvar']=  prob_2samp(epos.obs_zoom['y'], det_Y[ix&iy])
+		if 'xvar' in epos.summarystatistic:
+			prob['xvar'], lnp['xvar']=  prob_2samp(epos.obs_zoom['x'], det_P[ix&iy])
+		if 'yvar' in epos.summarystatistic:
+			prob['yvar'], lnp['yvar']=  prob_2samp(epos.obs_zoom['y'], det_Y[ix&iy])
 
-	if 'N' in epos.summarystatistic:
-		# chi^2: (np-nobs)/nobs**0.5 -> p: e^-0.5 x^2
-		chi2= (epos.obs_zoom['x'].size-np.sum(ix&iy))**2. / epos.obs_zoom['x'].size
-		lnp['N']= -0.5* chi2
-		prob['N']= np.exp(-0.5* chi2)
-	
-	if epos.Multi:
-		''' Multi-planet frequency, pearson chi_squared '''
-		k, Nk= multi.frequency(det_ID[ix&iy])
-		Nk_obs= epos.obs_zoom['multi']['count']
-		ncont= max(len(Nk),len(Nk_obs))
-		
-		# pad with zeros
-		obs= np.zeros((2,ncont), dtype=int)
-		obs[0,:len(Nk)]= Nk
-		obs[1,:len(Nk_obs)]= Nk_obs
-		# remove double zero frequencies
-		obs=obs[:, ~((obs[0,:] == 0) & (obs[1,:]==0))]
+		if 'N' in epos.summarystatistic:
+			# chi^2: (np-nobs)/nobs**0.5 -> p: e^-0.5 x^2
+			chi2= (epos.obs_zoom['x'].size-np.sum(ix&iy)/fidelity)**2. / epos.obs_zoom['x'].size
+			lnp['N']= -0.5* chi2
+			prob['N']= np.exp(-0.5* chi2)
 		
-		try:	
-			_, prob['Nk'], _, _ = chi2_contingency(obs)
-		except ValueError:
-			#print Nk
-			#print Nk_obs
-			#print obs
-			raise
+		if epos.Multi:
+			''' Multi-planet frequency, pearson chi_squared '''
+			k, Nk= multi.frequency(det_ID[ix&iy])
+			Nk_obs= epos.obs_zoom['multi']['count']
+			ncont= max(len(Nk),len(Nk_obs))
 			
-		with np.errstate(divide='ignore'): lnp['Nk']= np.log(prob['Nk'])			
-		
-		''' Period ratio, innermost planet '''
-		sim_dP, sim_Pinner= multi.periodratio(det_ID[ix&iy], det_P[ix&iy])
+			# pad with zeros
+			obs= np.zeros((2,ncont), dtype=int)
+			obs[0,:len(Nk)]= Nk
+			obs[1,:len(Nk_obs)]= Nk_obs
+			# remove double zero frequencies
+			obs=obs[:, ~((obs[0,:] == 0) & (obs[1,:]==0))]
+			
+			try:	
+				_, prob['Nk'], _, _ = chi2_contingency(obs)
+			except ValueError:
+				#print Nk
+				#print Nk_obs
+				#print obs
+				raise
+				
+			with np.errstate(divide='ignore'): lnp['Nk']= np.log(prob['Nk'])			
+			
+			''' Period ratio, innermost planet '''
+			sim_dP, sim_Pinner= multi.periodratio(det_ID[ix&iy], det_P[ix&iy])
 
-		if (len(sim_dP)>0) & (len(sim_Pinner)>0): 
-			prob['dP'],lnp['dP']= prob_2samp(epos.obs_zoom['multi']['Pratio'],f_dP*sim_dP)					
-			prob['Pin'],lnp['Pin']= prob_2samp(epos.obs_zoom['multi']['Pinner'],
-											sim_Pinner)
-		else:
-			logging.debug('no multi-planet statistics, {}'.format(len(sim_dP)))
-			prob['dP'], prob['Pin']= 0, 0 
-			lnp['dP'], lnp['Pin']= -np.inf, -np.inf
+			if (len(sim_dP)>0) & (len(sim_Pinner)>0): 
+				prob['dP'],lnp['dP']= prob_2samp(epos.obs_zoom['multi']['Pratio'],f_dP*sim_dP)					
+				prob['Pin'],lnp['Pin']= prob_2samp(epos.obs_zoom['multi']['Pinner'],
+												sim_Pinner)
+			else:
+				prob['dP'], prob['Pin']= 0, 0 
+				lnp['dP'], lnp['Pin']= -np.inf, -np.inf
 
 	# combine with Fischer's rule:
 	lnprob= np.sum([lnp[key] for key in epos.summarystatistic])
@@ -626,7 +1149,7 @@ def MC(epos, fpara, Store=False, Sample=False, StorePopulation=False, Extra=None
 	if Verbose:
 		print '\nGoodness-of-fit'
 		print '  logp= {:.1f}'.format(lnprob)
-		print '  - p(n={})={:.2g}'.format(np.sum(ix&iy), prob['N'])
+		print '  - p(n={:.0f})={:.2g}'.format(ndet, prob['N'])
 		if 'xvar' in prob:	print '  - p(x)={:.2g}'.format(prob['xvar'])
 		if 'yvar' in prob:	print '  - p(y)={:.2g}'.format(prob['yvar'])
 		if 'Nk' in prob:	print '  - p(N_k)={:.2g}'.format(prob['Nk'])
@@ -635,6 +1158,7 @@ def MC(epos, fpara, Store=False, Sample=False, StorePopulation=False, Extra=None
 		
 	tgof= time.time()
 	if Verbose: print '  observation comparison in {:.3f} sec'.format(tgof-tstart)
+	tm.stage('gof')
 
 	''' Store _systems_ with at least one detected planet '''
 	# StorePopulation
@@ -694,32 +1218,45 @@ def MC(epos, fpara, Store=False, Sample=False, StorePopulation=False, Extra=None
 			#print 'saving extra {}'.format(Extra)
 		else:
 			epos.synthetic_survey= ss 
+		tm.stage('store')
 	else:
 		# return probability
 		if np.isnan(lnprob):
-			return -np.inf
+			return tm.reject('nan')
+		if not np.isfinite(lnprob):
+			tm.reject('no multi-planet statistics')
 		return lnprob
 
+# grid of the multi-planet systems without Monte Carlo, see _noMC_multi
+noMC_dlnP= 0.1 # cells in log period
+noMC_ninc= 8 # viewing angles
+noMC_nY= 4 # sizes of the innermost planet
+noMC_nU= 2 # noise levels of correlated detections
+
 def noMC(epos, fpara, Store=False, Sample=False, StorePopulation=False, Extra=None, 
 		Verbose=True):
 	''' 
 	Do the Simulations without Monte Carlo
+	
+	Note:
+		Multi-planet systems are calculated on a grid, see :func:`_noMC_multi`
 	'''	
 	if Verbose: tstart=time.time()
 	#if not Store: logging.debug(' '.join(['{:.3g}'.format(fpar) for fpar in fpara]))
+	tm= timing.call()
 
-	if epos.Multi: raise ValueError('Multi-planets need Monte Carlo (?)')
 	if not epos.Parametric: 
 		raise ValueError('Planet Formation models need Monte Carlo (?)')
+	if epos.Multi:
+		return _noMC_multi(epos, fpara, Store=Store, Sample=Sample, Extra=Extra, 
+			Verbose=Verbose, tm=tm)
 		
 	''' parameters within bounds? '''
 	try:
 		epos.pdfpars.checkbounds(fpara)
 	except ValueError as message:
 		if Store: raise
-		else:
-			logging.debug(message)
-			return -np.inf
+		else: return tm.reject('out of bounds')
 
 	''' Generate observable period-radius distribution, in counts'''
 	if epos.RV:
@@ -728,6 +1265,7 @@ def noMC(epos, fpara, Store=False, Sample=False, StorePopulation=False, Extra=No
 		raise ValueError('Generate pdf on radius grid here')
 	else:
 		pps, pdf, pdf_X, pdf_Y= periodradius(epos, fpara=fpara, fdet=epos.f_det*epos.nstars)
+	tm.stage('pdf')
 
 	'''
 	Probability that simulated data matches observables
@@ -777,6 +1315,7 @@ def noMC(epos, fpara, Store=False, Sample=False, StorePopulation=False, Extra=No
 		
 	tgof= time.time()
 	if Verbose: print '  observation comparison in {:.3f} sec'.format(tgof-tstart)
+	tm.stage('gof')
 
 	''' Store detectable planet population '''	
 	if Store:
@@ -801,6 +1340,7 @@ def noMC(epos, fpara, Store=False, Sample=False, StorePopulation=False, Extra=No
 		
 		epos.prob=prob
 		epos.lnprob=lnprob
+		tm.stage('store')
 
 		if Sample:
 			return ss
@@ -815,33 +1355,249 @@ def noMC(epos, fpara, Store=False, Sample=False, StorePopulation=False, Extra=No
 	else:
 		''' return probability '''
 		if np.isnan(lnprob):
-			return -np.inf
+			return tm.reject('nan')
 		return lnprob
 	
-def draw_from_2D_distribution(epos, pps, fpara, npl=1):
+def _noMC_multi(epos, fpara, Store=False, Sample=False, Extra=None, Verbose=True,
+		tm=None):
+	'''
+	Expected multi-planet statistics without Monte Carlo
+	
+	Description:
+		The multi-planet systems of :meth:`EPOS.classes.epos.set_multi` with a 
+		spacing model are calculated on a grid in log period, with 
+		:func:`EPOS.multi.expected_chain`. The period of the innermost planet
+		follows the period distribution, each next planet the period ratio
+		distribution. The detection probability of each planet is the 
+		transit probability times the detection efficiency, for a set of 
+		nodes: 
+		
+		- system viewing angles, with a gaussian offset of each planet from 
+		  the mutual inclination (a Rayleigh distribution times the cosine 
+		  of the node angle), and one node for isotropic systems (f_iso)
+		- the size of the innermost planet, planets further out differ by 
+		  dR, that is averaged over for each planet independently
+		- for a fraction f_cor of systems, the noise level in intervals of
+		  the same random number for all planets (correlated detections)
+		
+		The resolution is set by noMC_dlnP, noMC_ninc, noMC_nY and noMC_nU.
+		The expected multiplicity is compared with a chi-squared test, the
+		distributions of the period, period ratio and innermost period with
+		a KS test, or binned if goftype is 'Poisson'
+	
+	Args:
+		tm(timing.call): timing record, a new one if None
+	'''
+	if tm is None: tm= timing.call()
+	if epos.RandomPairing or epos.RV or epos.MassRadius:
+		raise ValueError('Multi-planets without Monte Carlo need a spacing and radii')
+	if 'yvar' in epos.summarystatistic:
+		raise ValueError('Multi-planet radii need Monte Carlo')
+	if Verbose: tstart=time.time()
+	
+	''' parameters within bounds? '''
+	try:
+		epos.pdfpars.checkbounds(fpara)
+		pps= epos.fitpars.getpps_fromlist(fpara)
+		fpar2d= epos.fitpars.get2d_fromlist(fpara)
+		npl, dR, dInc, f_iso, f_cor= [epos.fitpars.getmc(key, fpara) 
+			for key in ['npl', 'dR', 'inc', 'f_iso', 'f_cor']]
+		if npl < 1: raise ValueError('at least one planet per system')
+		if (dInc <=0) or (dR <=0) or not (0 <= f_iso <= 1) or not (0 <= f_cor <= 1):
+			raise ValueError('parameters out of bounds')
+		Pgrid= np.logspace(0,1)
+		cdf= _spacing(epos, fpara, Pgrid)
+	except ValueError as message:
+		if Store: raise
+		else: return tm.reject('out of bounds')
+	nmax= int(np.ceil(npl))
+	
+	''' Grid in log period, innermost planet and period ratio '''
+	lnx= np.log([epos.MC_xvar[0], epos.MC_xvar[-1]])
+	nx= int(np.ceil((lnx[1]-lnx[0])/noMC_dlnP))
+	dlnP= (lnx[1]-lnx[0])/nx
+	edges= np.exp(lnx[0]+ dlnP*np.arange(nx+1))
+	P= np.sqrt(edges[1:]*edges[:-1])
+	
+	pdf= epos.func(epos.X_in, epos.Y_in, *fpar2d)
+	cum_X, cum_Y= np.cumsum(np.sum(pdf, axis=1)), np.cumsum(np.sum(pdf, axis=0))
+	pin= np.diff(np.interp(edges, epos.MC_xvar, cum_X))/(cum_X[-1]-cum_X[0])
+	
+	# period ratio at quantiles, shared between two cells
+	u= (np.arange(1000)+0.5)/1000.
+	m= np.log(np.interp(cdf[0]+u*(cdf[-1]-cdf[0]), cdf, Pgrid))/dlnP
+	m0= np.floor(m).astype(int)
+	kernel= np.bincount(m0, weights=1.-(m-m0), minlength=m0.max()+2) + \
+		np.bincount(m0+1, weights=m-m0, minlength=m0.max()+2)
+	kernel/= u.size
+	
+	''' Detection efficiency for each size of the innermost planet '''
+	uY= (np.arange(noMC_nY)+0.5)/noMC_nY
+	Y1= np.interp(cum_Y[0]+uY*(cum_Y[-1]-cum_Y[0]), cum_Y, epos.in_yvar)
+	z, wz= np.polynomial.hermite_e.hermegauss(5)
+	wz/= np.sum(wz)
+	Y= Y1[:,None,None,None]* 10.**(dR*np.sqrt(np.arange(nmax))[None,:,None,None]
+		*z[None,None,:,None]) * (1.+epos.radiusError*z[None,None,None,:])
+	Ys, toY= np.unique(Y, return_inverse=True)
+	f_snr= interpolate.RectBivariateSpline(epos.MC_xvar, epos.MC_yvar, epos.MC_eff)
+	p_snr= np.clip(f_snr(P, Ys), 0, 1)
+	p_snr[:, (Ys<epos.yzoom[0]) | (Ys>epos.yzoom[1])]= 0.
+	p_snr[(P<epos.xzoom[0]) | (P>epos.xzoom[1]), :]= 0.
+	p_snr= p_snr[:,toY].reshape((nx,)+Y.shape)
+	
+	p_det, w_det= [], []
+	if f_cor < 1:
+		p_det.append(p_snr)
+		w_det.append(1.-f_cor)
+	if f_cor > 0:
+		for i in range(noMC_nU):
+			p_det.append(np.clip(noMC_nU*p_snr-i, 0, 1))
+			w_det.append(f_cor/noMC_nU)
+	p_det= np.tensordot(np.array(p_det), np.outer(wz, wz), axes=([4,5],[0,1]))
+	
+	''' Transit probability for each viewing angle '''
+	R_a= np.minimum(1., epos.fgeo_prefac*P**epos.Pindex)
+	a, sigma= np.arcsin(R_a), dInc*np.pi/180.
+	inc= np.linspace(0, min(np.pi/2., a.max()+4.*sigma), noMC_ninc+1)
+	w_inc= (1.-f_iso)* np.diff(np.sin(inc))
+	inc= 0.5*(inc[1:]+inc[:-1])[:,None]
+	p_trans= norm.cdf((a-inc)/sigma)- norm.cdf((-a-inc)/sigma)
+	p_trans= np.vstack([p_trans, R_a])
+	w_inc= np.r_[w_inc, f_iso]
+	
+	''' nodes (inc, detection, Y) of (planet, cell)'''
+	s= p_trans[:,None,None,None,:]* np.transpose(p_det, (0,2,3,1))[None,...]
+	w= w_inc[:,None,None]* np.array(w_det)[None,:,None]* np.full(noMC_nY, 1./noMC_nY)
+	s, w= s.reshape((-1, nmax, nx)), w.flatten()
+	s, w= s[w>0], w[w>0]
+	tm.stage('nodes')
+	tm.size('nodes', w.size)
+	
+	Pratio= epos.obs_zoom['multi']['Pratio']
+	dmax= int(np.ceil(np.log(np.max(Pratio))/dlnP))+1 if len(Pratio) > 0 else None
+	chain= multi.expected_chain(pin, kernel, s, w, npl, dmax=dmax)
+	tm.stage('chain')
+	
+	'''
+	Probability that simulated data matches observables
+	'''
+	nsys= pps* epos.nstars
+	nobs, ndet= epos.obs_zoom['x'].size, nsys* np.sum(chain['P'])
+	Nk= nsys* chain['Nk'][1:]
+	npair= np.sum(np.arange(Nk.size)*Nk)
+	if not (ndet > 0 and npair > 0):
+		if Store: raise ValueError('no multi-planets detectable')
+		return tm.reject('no multi-planets detectable')
+	
+	cdf_P= np.cumsum(np.r_[0, chain['P']])/np.sum(chain['P'])
+	cdf_Pin= np.cumsum(np.r_[0, chain['Pin']])/np.sum(chain['Pin'])
+	func_cdf_P= partial(np.interp, xp=edges, fp=cdf_P, left=0, right=1)
+	func_cdf_Pin= partial(np.interp, xp=edges, fp=cdf_Pin, left=0, right=1)
+	if dmax is not None:
+		edges_dP= np.maximum(1., np.exp(dlnP*(np.arange(dmax+2)-0.5)))
+		cdf_dP= np.cumsum(np.r_[0, nsys*chain['dP']])/npair
+		func_cdf_dP= partial(np.interp, xp=edges_dP, fp=cdf_dP, left=0, right=1)
+	
+	prob, lnp= {}, {}
+	if epos.goftype == 'Poisson':
+		bins, counts= epos.obs_zoom['bins'], epos.obs_zoom['counts']
+		with np.errstate(divide='ignore'):
+			lnp['N']= nobs*np.log(ndet/nobs) - (ndet-nobs)
+		lnp['xvar']= _lnp_multinomial(counts['xvar'], _binexpected(func_cdf_P, bins['xvar']))
+		lnp['Nk']= _lnp_multinomial(counts['Nk'], _lump(Nk, bins['Nk']))
+		if dmax is not None:
+			lnp['dP']= _lnp_multinomial(counts['dP'], _binexpected(func_cdf_dP, bins['dP']))
+			lnp['Pin']= _lnp_multinomial(counts['Pin'], _binexpected(func_cdf_Pin, bins['Pin']))
+		else:
+			lnp['dP'], lnp['Pin']= 0., 0.
+		prob= {key:np.exp(lnp[key]) for key in lnp}
+	else:
+		chi2= (nobs-ndet)**2. / nobs
+		lnp['N']= -0.5* chi2
+		prob['N']= np.exp(-0.5* chi2)
+		prob['xvar'], lnp['xvar']= _prob_ks_func(epos.obs_zoom['x'], func_cdf_P)
+		
+		''' Multi-planet frequency, pearson chi-squared '''
+		Nk_obs= epos.obs_zoom['multi']['count']
+		Nk_sim= _lump(Nk, Nk_obs.size)
+		with np.errstate(divide='ignore', invalid='ignore'):
+			_, prob['Nk']= chisquare(Nk_obs, Nk_sim*np.sum(Nk_obs)/np.sum(Nk_sim))
+			lnp['Nk']= np.log(prob['Nk'])
+		
+		if dmax is not None:
+			prob['dP'], lnp['dP']= _prob_ks_func(Pratio, func_cdf_dP)
+			prob['Pin'], lnp['Pin']= _prob_ks_func(epos.obs_zoom['multi']['Pinner'],
+				func_cdf_Pin)
+		else:
+			prob['dP'], prob['Pin']= 0, 0
+			lnp['dP'], lnp['Pin']= -np.inf, -np.inf
+	
+	lnprob= np.sum([lnp[key] for key in epos.summarystatistic])
+	
+	if Verbose:
+		print '\nGoodness-of-fit'
+		print '  logp= {:.1f}'.format(lnprob)
+		print '  - p(n={:.0f})={:.2g}'.format(ndet, prob['N'])
+		print '  - p(x)={:.2g}'.format(prob['xvar'])
+		print '  - p(N_k)={:.2g}'.format(prob['Nk'])
+		print '  - p(P ratio)={:.2g}'.format(prob['dP'])
+		print '  - p(P inner)={:.2g}'.format(prob['Pin'])
+		print '  grid calculation in {:.3f} sec'.format(time.time()-tstart)
+	tm.stage('gof')
+	
+	''' Store expected detectable planets '''	
+	if Store:
+		ss={}
+		ss['nobs']= ndet
+		ss['P zoom']= P
+		ss['P zoom pdf']= nsys* chain['P']/ np.diff(np.log(edges))
+		ss['P zoom cdf']= cdf_P[1:]
+		ss['multi']={'bin':np.arange(1, Nk.size+1), 'count':Nk}
+		ss['multi']['Pinner']= edges
+		ss['multi']['Pinner cdf']= cdf_Pin
+		if dmax is not None:
+			ss['multi']['Pratio']= edges_dP
+			ss['multi']['Pratio cdf']= cdf_dP
+		
+		epos.prob=prob
+		epos.lnprob=lnprob
+		tm.stage('store')
+
+		if Sample:
+			return ss
+		elif Extra is not None:
+			ss['name']=Extra
+			if not hasattr(epos,'ss_extra'):
+				epos.ss_extra=[]
+			epos.ss_extra.append(ss)
+		else:
+			epos.synthetic_survey= ss
+	else:
+		if np.isnan(lnprob):
+			return tm.reject('nan')
+		return lnprob
+
+def draw_from_2D_distribution(epos, pps, fpara, npl=1, tm=None, nstars=None):
 	
 	''' create PDF, CDF'''
 	# assumes a separable function of mass and radius
 	pdf= epos.func(epos.X_in, epos.Y_in, *fpara)
+	if tm is not None: tm.stage('pdf')
 
 	pdf_X, pdf_Y= np.sum(pdf, axis=1), np.sum(pdf, axis=0)
 	cum_X, cum_Y= np.cumsum(pdf_X), np.cumsum(pdf_Y)
 	#pps_x, pps_y=  cum_X[-1], cum_Y[-1]
 	#planets_per_star= 0.5*(pps_x+pps_y) # should be equal
 	
+	if nstars is None: nstars= epos.nstars
 	try:
-		ndraw= npl*int(round(pps*epos.nstars))
+		ndraw= npl*int(round(pps*nstars))
 	except OverflowError:
-		logging.debug('infinity encountered, pps= {},{}'.format(pps_x, pps_y))
-		for pname, fpar in zip(epos.pname, fpara):
-			logging.debug('  {}= {:.3g}'.format(pname,fpar))
 		raise ValueError('Infinity encountered')
 	
 	if ndraw < 1: 
-		logging.debug('no draws ({}, {}*{})'.format(ndraw, epos.nstars, planets_per_star))
 		raise ValueError('no planets')
 	elif ndraw > 1e8:
-		logging.debug('>1e8 planets ({})'.format(ndraw))
 		raise ValueError('too many planets')
 	# 	elif planets_per_star > 100:
 	# 		logging.debug('>100 planets per star ({})'.format(planets_per_star))
@@ -856,10 +1612,11 @@ def draw_from_2D_distribution(epos, pps, fpara, npl=1):
 		print cum_X
 		print cum_Y
 		raise
+	if tm is not None: tm.stage('draw')
 	
 	return allX, allY
 
-def draw_multi(epos, sysX, sysY, npl, dInc, dR, fpara, Store):
+def draw_multi(epos, sysX, sysY, npl, dInc, dR, fpara):
 	''' assign ID to each system '''
 	sysID= np.arange(sysX.size)
 	#allID= np.repeat(sysID, npl) # array with star ID for each planet
@@ -867,26 +1624,20 @@ def draw_multi(epos, sysX, sysY, npl, dInc, dR, fpara, Store):
 	allID= np.repeat(sysID, npl_arr.astype(int))
 	#print allID.size, sysID.size
 	if allID.size > 1e7:
-		logging.debug('Too many planets: {} > 1e7'.format(allID.size))
-		for pname, fpar in zip(epos.pname, fpara):
-			logging.debug('  {}= {:.3g}'.format(pname,fpar))
-		if Store: raise ValueError('Too many planets: {}'.format(allID.size))
-		return -np.inf				
+		raise ValueError('too many planets')
 
 	''' initialize planet parameters'''
 	_, toplanet, sysnpl= np.unique(allID, return_inverse=True,return_counts=True)
 	allX= sysX[toplanet]
 	allY= sysY[toplanet]
-	allI= np.random.rayleigh(dInc, allID.size)
+	allI= _rayleigh(epos, dInc, allID.size)
 	#allN= np.ones_like(allID) # index to planet in system
 	allN= np.where(allX>=epos.xzoom[0],1,0) # also yzoom?
 	#print allX[:3]
 
 	# get index of first planet in each system
 	if len(sysnpl) < 1:
-		logger.debug('no planets')
-		if Store: raise ValueError('no planets')
-		return -np.inf
+		raise ValueError('no planets')
 	di= np.roll(sysnpl,1)
 	di[0]=0
 	i1= np.cumsum(di) # index to first planet
@@ -894,27 +1645,7 @@ def draw_multi(epos, sysX, sysY, npl, dInc, dR, fpara, Store):
 	
 	''' Draw period of 2nd, 3rd planet etc.'''
 	Pgrid= np.logspace(0,1)
-	# use population.periodratio here
-	if epos.spacing == 'powerlaw':
-		dPbreak= epos.fitpars.getmc('dP break', fpara)
-		dP1= epos.fitpars.getmc('dP 1', fpara)
-		dP2= epos.fitpars.getmc('dP 2', fpara)
-		if (dPbreak<=0):
-			if Store: raise ValueError('parameters out of bounds')
-			return -np.inf
-		cdf= np.cumsum(brokenpowerlaw1D(Pgrid, dPbreak, dP1, dP2))
-	elif epos.spacing=='dimensionless':
-		logD=  epos.fitpars.getmc('log D', fpara)
-		sigma= epos.fitpars.getmc('sigma', fpara)
-		if (sigma<=0):
-			if Store: raise ValueError('parameters out of bounds')
-			return -np.inf			
-
-		with np.errstate(divide='ignore'): 
-			Dgrid= np.log10(2.*(Pgrid**(2./3.)-1.)/(Pgrid**(2./3.)+1.))
-		Dgrid[0]= -2
-		#print Dgrid
-		cdf= norm(logD,sigma).cdf(Dgrid)
+	cdf= _spacing(epos, fpara, Pgrid)
 	
 	# loop over planet 2,3... n
 	for i in range(2,len(np.bincount(sysnpl)) ):
@@ -949,17 +1680,42 @@ def draw_multi(epos, sysX, sysY, npl, dInc, dR, fpara, Store):
 	
 	return allX, allY, allI, allN, allID
 	
-def istransit(epos, allID, allI, allP, f_iso, f_inc, Verbose=False):
+def _spacing(epos, fpara, Pgrid):
+	''' cumulative distribution of the period ratio of adjacent planets '''
+	# use population.periodratio here
+	if epos.spacing == 'powerlaw':
+		dPbreak= epos.fitpars.getmc('dP break', fpara)
+		dP1= epos.fitpars.getmc('dP 1', fpara)
+		dP2= epos.fitpars.getmc('dP 2', fpara)
+		if (dPbreak<=0):
+			raise ValueError('out of bounds')
+		return np.cumsum(brokenpowerlaw1D(Pgrid, dPbreak, dP1, dP2))
+	elif epos.spacing=='dimensionless':
+		logD=  epos.fitpars.getmc('log D', fpara)
+		sigma= epos.fitpars.getmc('sigma', fpara)
+		if (sigma<=0):
+			raise ValueError('out of bounds')
+
+		with np.errstate(divide='ignore'): 
+			Dgrid= np.log10(2.*(Pgrid**(2./3.)-1.)/(Pgrid**(2./3.)+1.))
+		Dgrid[0]= -2
+		#print Dgrid
+		return norm(logD,sigma).cdf(Dgrid)
+	else:
+		raise ValueError('no spacing defined')
+
+def istransit(epos, allID, allI, allP, f_iso, f_inc, Verbose=False, R_a=None):
 	# draw same numbers for multi-planet systems
 	IDsys, toplanet= np.unique(allID, return_inverse=True) # return_counts=True
 	if Verbose: print '  {}/{} systems'.format(IDsys.size, allID.size)
 	
 	# draw system viewing angle proportionate to sin theta (i=0: edge-on)
-	inc_sys= np.arcsin(np.random.uniform(0,1,IDsys.size))
+	inc_sys= np.arcsin(_uniform(epos, 0,1,IDsys.size))
 	inc_pl= inc_sys[toplanet]
 	assert inc_pl.size == allP.size
 	
-	R_a= epos.fgeo_prefac *allP**epos.Pindex # == p_trans
+	if R_a is None:
+		R_a= epos.fgeo_prefac *allP**epos.Pindex # == p_trans
 	mutual_inc= allI * f_inc
 	#mutual_inc= 0.0 # planar distribution
 	#mutual_inc= 1.0 # fit 
@@ -967,20 +1723,37 @@ def istransit(epos, allID, allI, allP, f_iso, f_inc, Verbose=False):
 		print '  Average mutual inc={:.1f} degrees'.format(np.median(allI))
 		if f_inc != 1.0:
 			print 'f_inc= {:.2g}, inc= {:.1f} deg'.format(f_inc, np.median(mutual_inc))
-	delta_inc= mutual_inc *np.cos(np.random.uniform(0,np.pi,allP.size)) * np.pi/180.
+	delta_inc= mutual_inc *np.cos(_uniform(epos, 0,np.pi,allP.size)) * np.pi/180.
 	itrans= np.abs(inc_pl+delta_inc) < np.arcsin(R_a)
 
 	# allow for a fraction of isotropic systems
 	if f_iso > 0:
-		p_trans= epos.fgeo_prefac *allP**epos.Pindex
-		itrans_iso= p_trans >= np.random.uniform(0,1,allP.size)
+		p_trans= R_a
+		itrans_iso= p_trans >= _uniform(epos, 0,1,allP.size)
 		
-		iso_sys= (np.random.uniform(0,1,IDsys.size) < f_iso)
+		iso_sys= (_uniform(epos, 0,1,IDsys.size) < f_iso)
 		iso_pl= iso_sys[toplanet]
 		itrans = np.where(iso_pl, itrans_iso, itrans)
 		
 	return itrans
 
+def _uniform(epos, low, high, size):
+	''' uniform random numbers, stratified if epos.Stratified: one number in 
+	each of size equal intervals, in random order '''
+	if not epos.Stratified: return np.random.uniform(low, high, size)
+	u= (np.arange(size)+ np.random.uniform(0,1,size))/size
+	return low+ (high-low)* np.random.permutation(u)
+
+def _normal(epos, size):
+	''' standard normal random numbers, see _uniform '''
+	if not epos.Stratified: return np.random.normal(size=size)
+	return norm.ppf(_uniform(epos, 0,1,size))
+
+def _rayleigh(epos, scale, size):
+	''' Rayleigh distributed random numbers, see _uniform '''
+	if not epos.Stratified: return np.random.rayleigh(scale, size)
+	return scale* np.sqrt(-2.*np.log1p(-_uniform(epos, 0,1,size)))
+
 def storepopulation(allID, allP, det_ID, idetected):
 	# add f_iso?
 
@@ -1041,6 +1814,252 @@ def _prob_ad(a,b):
 		print prob, lnprob
 	return prob, lnprob
 
+def _prob_poisson(epos, P, Y, ID=None, f_dP=1., fidelity=1.):
+	'''
+	Binned likelihood of the detected planets, for goftype='Poisson'
+
+	Description:
+		The number of planets is Poisson distributed with the simulated number
+		as the expectation. The histograms of the observables, on the fixed
+		bins of :func:`prep_obs`, are multinomial with the simulated histogram
+		as the probability of each bin. Each log-likelihood is relative to
+		that of a perfect match, so it is zero at best.
+
+	Args:
+		P(np.array): period of the detected planets
+		Y(np.array): radius or mass of the detected planets
+		ID(np.array): system of the detected planets, sorted, if Multi
+		f_dP(float): scaling of the period ratio
+		fidelity(float): fraction of the stars simulated
+
+	Returns:
+		prob(dict): probability of each summary statistic
+		lnp(dict): log probability of each summary statistic
+	'''
+	bins, counts= epos.obs_zoom['bins'], epos.obs_zoom['counts']
+	lnp= {}
+
+	# Poisson deviance
+	n, lam= float(counts['N']), P.size/fidelity
+	with np.errstate(divide='ignore'):
+		lnp['N']= n*np.log(lam/n) - (lam-n)
+
+	if 'xvar' in epos.summarystatistic:
+		lnp['xvar']= _lnp_multinomial(counts['xvar'], _bincount(P, bins['xvar']))
+	if 'yvar' in epos.summarystatistic:
+		lnp['yvar']= _lnp_multinomial(counts['yvar'], _bincount(Y, bins['yvar']))
+
+	if ID is not None:
+		lnp['Nk']= _lnp_multinomial(counts['Nk'], _multiplicity(ID, bins['Nk']))
+		if 'dP' in bins:
+			sim_dP, sim_Pinner= multi.periodratio(ID, P)
+			lnp['dP']= _lnp_multinomial(counts['dP'],
+				_bincount(f_dP*np.asarray(sim_dP), bins['dP']))
+			lnp['Pin']= _lnp_multinomial(counts['Pin'],
+				_bincount(np.asarray(sim_Pinner), bins['Pin']))
+		else:
+			lnp['dP'], lnp['Pin']= 0., 0.
+
+	prob= {key:np.exp(lnp[key]) for key in lnp}
+	return prob, lnp
+
+def _prob_weighted(epos, P, Y, w, Nk=None, dP=None, Pin=None, w_dP=None, w_Pin=None,
+		fidelity=1.):
+	'''
+	Goodness-of-fit of weighted planets, for epos.Weighted and :mod:`EPOS.tags`
+
+	Description:
+		Each simulated planet counts with its probability to be detected. The
+		number of planets and the histograms are expectation values, the 
+		two-sample tests use the weighted cdf with the expected number of 
+		detections (the sum of the weights) as the sample size, like a 
+		realization of the detected planets.
+		The multiplicity is compared as the expected number of systems with k
+		detected planets. Period ratios and inner periods are weighted if 
+		w_dP and w_Pin are given, f.e. a realization of the detected planets 
+		if not.
+
+	Args:
+		P(np.array): period of the simulated planets
+		Y(np.array): radius or mass of the simulated planets
+		w(np.array): detection probability (including transit) of each planet
+		Nk(np.array): expected number of systems with 1, 2, ... detected 
+			planets, if Multi
+		dP(np.array): period ratios of adjacent detected planets, if Multi
+		Pin(np.array): period of the innermost planet in multis, if Multi
+		w_dP(np.array): weight of each period ratio
+		w_Pin(np.array): weight of each inner period
+		fidelity(float): fraction of the stars simulated
+
+	Returns:
+		prob(dict): probability of each summary statistic
+		lnp(dict): log probability of each summary statistic
+	'''
+	prob, lnp= {}, {}
+	nobs, ndet= float(epos.obs_zoom['x'].size), np.sum(w)/fidelity
+	Poisson= (epos.goftype=='Poisson')
+	if Poisson:
+		bins, counts= epos.obs_zoom['bins'], epos.obs_zoom['counts']
+	else:
+		prob_2samp= _prob_ks if epos.goftype=='KS' else _prob_ad
+		prob_2samp_w= _prob_ks_weighted if epos.goftype=='KS' else _prob_ad_weighted
+
+	if Poisson:
+		lnp['N']= nobs*np.log(ndet/nobs) - (ndet-nobs)
+	else:
+		lnp['N']= -0.5* (nobs-ndet)**2. / nobs
+
+	for key, x, obs in zip(['xvar', 'yvar'], [P, Y], ['x', 'y']):
+		if not key in epos.summarystatistic: continue
+		if Poisson:
+			lnp[key]= _lnp_multinomial(counts[key], _bincount(x, bins[key], w))
+		else:
+			prob[key], lnp[key]= prob_2samp_w(epos.obs_zoom[obs], x, w)
+
+	if Nk is not None:
+		if Poisson:
+			nk= bins['Nk']
+			Nk_bin= np.zeros(nk)
+			Nk_bin[:min(nk, Nk.size)]= Nk[:nk]
+			Nk_bin[-1]+= np.sum(Nk[nk:])
+			lnp['Nk']= _lnp_multinomial(counts['Nk'], Nk_bin)
+		else:
+			Nk_obs= epos.obs_zoom['multi']['count']
+			obs= np.zeros((2,max(Nk.size, Nk_obs.size)))
+			obs[0,:Nk.size]= Nk
+			obs[1,:Nk_obs.size]= Nk_obs
+			# remove frequencies that would be zero in a realization
+			obs= obs[:, (obs[0,:] >= 0.5) | (obs[1,:] > 0)]
+			_, prob['Nk'], _, _ = chi2_contingency(obs)
+			with np.errstate(divide='ignore'): lnp['Nk']= np.log(prob['Nk'])
+
+		if Poisson:
+			if 'dP' in bins:
+				lnp['dP']= _lnp_multinomial(counts['dP'], _bincount(dP, bins['dP'], w_dP))
+				lnp['Pin']= _lnp_multinomial(counts['Pin'], 
+					_bincount(Pin, bins['Pin'], w_Pin))
+			else:
+				lnp['dP'], lnp['Pin']= 0., 0.
+		elif (dP.size>0) & (Pin.size>0):
+			for key, x, wx, obs in zip(['dP', 'Pin'], [dP, Pin], [w_dP, w_Pin], 
+					['Pratio', 'Pinner']):
+				if wx is None:
+					prob[key], lnp[key]= prob_2samp(epos.obs_zoom['multi'][obs], x)
+				else:
+					prob[key], lnp[key]= prob_2samp_w(epos.obs_zoom['multi'][obs], x, wx)
+		else:
+			prob['dP'], prob['Pin']= 0, 0 
+			lnp['dP'], lnp['Pin']= -np.inf, -np.inf
+
+	for key in lnp:
+		if not key in prob: prob[key]= np.exp(lnp[key])
+	return prob, lnp
+
+def _lnp_multinomial(n, m):
+	''' log-likelihood of histogram n for bin probabilities from histogram m '''
+	N, M= n.sum(), m.sum()
+	if N == 0: return 0.
+	if M == 0: return -np.inf
+	p= (m+0.5)/(M+0.5*m.size) # no empty bins
+	k= n > 0
+	return np.sum(n[k]* np.log(p[k]*N/n[k]))
+
+def _logbins(xlim, nb):
+	''' nb equal bins in log between xlim[0] and xlim[1] '''
+	return np.log10(xlim[0]), np.log10(xlim[1]), nb
+
+def _lump(Nk, nk):
+	''' expected systems with 1 to nk planets, the last bin includes higher
+	multiplicities, see _multiplicity '''
+	Nk= np.r_[Nk, np.zeros(max(0, nk-Nk.size))]
+	return np.r_[Nk[:nk-1], np.sum(Nk[nk-1:])]
+
+def _binexpected(func_cdf, bins):
+	''' fraction in each bin from _logbins, for a cdf function of x '''
+	lo, hi, nb= bins
+	cdf= func_cdf(np.logspace(lo, hi, nb+1))
+	cdf[0], cdf[-1]= 0., 1.
+	return np.diff(cdf)
+
+def _bincount(x, bins, w=None):
+	''' histogram on bins from _logbins, values outside are in the first/last bin '''
+	lo, hi, nb= bins
+	with np.errstate(divide='ignore', invalid='ignore'):
+		i= np.floor((np.log10(x)-lo)*(nb/(hi-lo)))
+	return np.bincount(np.clip(i, 0, nb-1).astype(int), weights=w, minlength=nb)
+
+def _multiplicity(ID, nk):
+	''' number of systems with 1 to nk planets, the last bin includes higher
+	multiplicities. Planets in the same system are adjacent in ID '''
+	if ID.size == 0: return np.zeros(nk, dtype=int)
+	first= np.flatnonzero(np.r_[True, ID[1:]!=ID[:-1], True])
+	return np.bincount(np.minimum(np.diff(first), nk)-1, minlength=nk)
+
+def _prob_ks_weighted(a, b, w):
+	''' two-sample KS test with weights w of sample b, see scipy.stats.ks_2samp.
+	The size of sample b is the sum of the weights, the expected detections '''
+	a= np.sort(a)
+	order= np.argsort(b)
+	b, cdf_b= b[order], np.cumsum(w[order])
+	n, m= a.size, cdf_b[-1] if cdf_b.size > 0 else 0.
+	if not (n > 0 and m > 0): return 0., -np.inf
+	cdf_b/= cdf_b[-1]
+	data_all= np.concatenate([a, b])
+	cdf1= np.searchsorted(a, data_all, side='right') / float(n)
+	i= np.searchsorted(b, data_all, side='right')
+	cdf2= np.where(i>0, cdf_b[np.maximum(i-1,0)], 0.)
+	d= np.max(np.absolute(cdf1 - cdf2))
+	en= np.sqrt(n * m / (n + m))
+	prob= kstwobign.sf((en + 0.12 + 0.11 / en) * d)
+	with np.errstate(divide='ignore'):
+		lnprob= np.log(prob)
+	return prob, lnprob
+
+def _prob_ad_weighted(a, b, w):
+	''' two-sample Anderson-Darling test with weights w of sample b, 
+	see scipy.stats.anderson_ksamp (midrank=False). The size of sample b is
+	the sum of the weights, the expected detections '''
+	a= np.sort(a)
+	order= np.argsort(b)
+	b, cdf_b= b[order], np.cumsum(w[order])
+	n, m= float(a.size), cdf_b[-1] if cdf_b.size > 0 else 0.
+	# the variance of the statistic needs at least 4 (expected) planets
+	if not (n > 0 and m > 0 and n+m >= 4): return 0., -np.inf
+	cdf_b/= cdf_b[-1]
+	Zstar= np.unique(np.concatenate([a, b]))
+	Fa= np.searchsorted(a, Zstar, side='right') / n
+	i= np.searchsorted(b, Zstar, side='right')
+	Fb= np.where(i>0, cdf_b[np.maximum(i-1,0)], 0.)
+
+	N= n+m
+	B= n*Fa + m*Fb
+	l= np.diff(np.r_[0., B])
+	B, l, Fa, Fb= B[:-1], l[:-1], Fa[:-1], Fb[:-1]
+	with np.errstate(divide='ignore', invalid='ignore'):
+		inner= l/(B*(N-B)) * (n*(N*Fa-B)**2. + m*(N*Fb-B)**2.)
+	A2kN= np.sum(inner[B < N])/ N
+
+	# standardize, with sample sizes n and m
+	k, H, Nint= 2, 1./n + 1./m, int(round(N))
+	hs_cs= (1. / np.arange(Nint - 1, 1, -1)).cumsum()
+	h= hs_cs[-1] + 1
+	g= (hs_cs / np.arange(2, Nint)).sum()
+	c0= (4*g - 6) * (k - 1) + (10 - 6*g)*H
+	c1= (2*g - 4)*k**2 + 8*h*k + (2*g - 14*h - 4)*H - 8*h + 4*g - 6
+	c2= (6*h + 2*g - 2)*k**2 + (4*h - 4*g + 6)*k + (2*h - 6)*H + 4*h
+	c3= (2*h + 6)*k**2 - 4*h*k
+	sigmasq= (c0*N**3 + c1*N**2 + c2*N + c3) / ((N - 1.) * (N - 2.) * (N - 3.))
+	A2= (A2kN - (k-1)) / np.sqrt(sigmasq)
+
+	# interpolation of Scholz and Stephens 1987, Table 2
+	critical= np.array([0.325, 1.226, 1.961, 2.718, 3.752, 4.592, 6.546])
+	sig= np.array([0.25, 0.1, 0.05, 0.025, 0.01, 0.005, 0.001])
+	pf= np.polyfit(critical, np.log(sig), 2)
+	prob= np.exp(np.polyval(pf, np.clip(A2, critical[0], critical[-1])))
+	with np.errstate(divide='ignore'):
+		lnprob= np.log(prob)
+	return prob, lnprob
+
 ''' Old code '''
 # def draw_from_function(f, grid, ndraw, *args):
 # 	cdf= np.cumsum(f(grid, *args))
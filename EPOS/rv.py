@@ -1,6 +1,8 @@
 import numpy as np
-import os.path
+import os.path, time
+import multiprocessing
 import EPOS
+import cgs
 
 fpath= os.path.dirname(EPOS.__file__)
 
@@ -51,4 +53,90 @@ def _Howard2010():
 	survey= {'xvar':P_1D, 'yvar':Msini_1D, 'eff_2D':Z.T} # 'Mstar':None, 'Rstar':None}
 	obs['nstars']= 125 # 
 	
-	return obs, survey
\ No newline at end of file
+	return obs, survey
+
+def completeness(stars, xvar=None, yvar=None, ninject=100, fap=0.01, threads=1,
+		seed=None, Verbose=True):
+	'''
+	Detection efficiency of an RV survey from injection and recovery
+
+	Description:
+		For each star, circular orbits are injected on a period-M sin i grid
+		with random phases. A planet is recovered if the chi-square
+		improvement of a sinusoid fit at the injected period over a constant
+		exceeds the threshold for the false alarm probability, corrected for
+		the number of independent frequencies between the shortest period
+		and the baseline of the star.
+		The chi-square improvement is the squared projection of the weighted
+		data on the (orthonormalized) sine and cosine at that period, and the
+		noise in these projections is drawn directly as standard normals.
+		Stars are processed in parallel if threads > 1.
+
+	Args:
+		stars(list): a dict for each star with the epochs t [days], the
+			uncertainties err [m/s], and optionally the stellar mass M [Msun]
+			and jitter [m/s]
+		xvar(np.array): period grid [days], default 1-15000 days
+		yvar(np.array): M sin i grid [Earth masses], default 1-6000
+		ninject(int): number of injected planets per star and grid point
+		fap(float): false alarm probability
+		threads(int): number of processes
+		seed(int): random seed
+
+	Returns:
+		survey(dict): input for :meth:`EPOS.classes.epos.set_survey` with RV=True
+		nstars(int): the number of stars
+	'''
+	if xvar is None: xvar= np.geomspace(1., 1.5e4, 30)
+	if yvar is None: yvar= np.geomspace(1., 6e3, 30)
+	xvar, yvar= np.asarray(xvar, dtype=float), np.asarray(yvar, dtype=float)
+	tstart= time.time()
+
+	seeds= [None if seed is None else [seed, i] for i in range(len(stars))]
+	args= [(star, xvar, yvar, ninject, fap, s) for star, s in zip(stars, seeds)]
+	if threads > 1:
+		pool= multiprocessing.Pool(threads)
+		eff= pool.map(_recover, args, chunksize=max(1, len(args)//(4*threads)))
+		pool.close()
+	else:
+		eff= map(_recover, args)
+
+	survey= {'xvar':xvar, 'yvar':yvar, 'eff_2D':np.mean(eff, axis=0),
+		'Mstar':np.mean([star.get('M', 1.) for star in stars])}
+	if Verbose:
+		print '\nRV detection efficiency of {} stars on a {}x{} grid in {:.1f} sec'.format(
+			len(stars), xvar.size, yvar.size, time.time()-tstart)
+	return survey, len(stars)
+
+def _recover(args):
+	''' Fraction of injected planets recovered around one star '''
+	star, xvar, yvar, ninject, fap, seed= args
+	rs= np.random.RandomState(seed)
+	t= np.asarray(star['t'], dtype=float)
+	sigma= np.sqrt(np.asarray(star['err'], dtype=float)**2.+ star.get('jitter', 0.)**2.)
+	if t.size < 4: return np.zeros((xvar.size, yvar.size))
+
+	''' threshold from the number of independent frequencies '''
+	nfreq= max(1., (t.max()-t.min())/ xvar[0])
+	threshold= -2.* np.log(1.- (1.-fap)**(1./nfreq))
+
+	''' orthonormal basis of [1, cos, sin] in the weighted data space '''
+	phase= 2.*np.pi* t[None,:]/ xvar[:,None]
+	A= np.stack([np.ones_like(phase), np.cos(phase), np.sin(phase)], axis=-1)/ \
+		sigma[None,:,None]
+	Q= np.array([np.linalg.qr(a)[0][:,1:] for a in A]) # (nx, nt, 2)
+
+	''' projection of the injected signals, K sin(phase+phi) '''
+	phi= rs.uniform(0, 2.*np.pi, (xvar.size, ninject))
+	signal= np.sin(phase[:,None,:]+ phi[:,:,None])/ sigma[None,None,:]
+	proj= np.einsum('xit,xtk->xik', signal, Q) # (nx, ninject, 2)
+
+	K= _semiamplitude(xvar[:,None], yvar[None,:], star.get('M', 1.))
+	noise= rs.normal(size=(xvar.size, yvar.size, ninject, 2))
+	dchi2= np.sum((K[:,:,None,None]* proj[:,None,:,:]+ noise)**2., axis=-1)
+	return np.mean(dchi2 > threshold, axis=-1)
+
+def _semiamplitude(P, Msini, Mstar=1.):
+	''' RV semi-amplitude [m/s] of a circular orbit, P in days, Msini in Earth masses '''
+	return (2.*np.pi*cgs.G/(P*cgs.day))**(1./3.)* Msini*cgs.Mearth/ \
+		(Mstar*cgs.Msun)**(2./3.)/ 100.
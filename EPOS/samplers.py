@@ -0,0 +1,679 @@
+'''
+This module contains alternative samplers for the fit parameters,
+that can be used instead of the emcee MCMC in :func:`EPOS.run.mcmc`
+'''
+import numpy as np
+import os, sys, time
+import multiprocessing
+from functools import partial
+
+import run
+
+def abcsmc(epos, npart=200, ngen=10, alpha=0.5, box=10., minacc=0.02,
+		threads=1, npos=30, Saved=True):
+	'''
+	Approximate Bayesian Computation with Sequential Monte Carlo
+
+	Description:
+		Uses the summary statistics in epos.summarystatistic as a distance,
+		rho = -lnprob from :func:`EPOS.run.MC`. Each generation lowers the
+		tolerance to the alpha-quantile of the previous distances, and
+		perturbs particles with a gaussian kernel with twice the weighted
+		covariance of the previous generation (Beaumont et al. 2009).
+		Proposals are simulated in parallel batches.
+		Weighted posterior samples are stored in epos.samples and epos.weights
+
+	Args:
+		npart(int): number of particles per generation
+		ngen(int): maximum number of generations
+		alpha(float): quantile of the distances used as the next tolerance
+		box(float): prior range, in units of dx, for parameters without bounds
+		minacc(float): stop if the acceptance rate drops below this value
+		threads(int): number of parallel simulations
+		npos(int): number of posterior samples to simulate for plotting
+		Saved(bool): load a previous run from chain/
+	'''
+	assert epos.Prep
+	runonce= run._engine(epos)
+
+	fpara= np.array(epos.fitpars.getfit(Init=True))
+	if not len(fpara)>0: raise ValueError('no fit paramaters defined')
+	ndim= fpara.size
+	pmin, pmax= _prior(epos, box)
+
+	dir= 'chain/{}'.format(epos.name)
+	fname= '{}/abcsmc.{}x{}x{}.npz'.format(dir, npart, ngen, ndim)
+	if not os.path.exists(dir): os.makedirs(dir)
+
+	if os.path.isfile(fname) and Saved:
+		print '\nLoading saved status from {}'.format(fname)
+		npz= np.load(fname)
+		_checkkeys(epos, npz)
+		particles, weights= npz['particles'], npz['weights']
+		epos.abc= {'eps':npz['eps'], 'nsim':npz['nsim']}
+	else:
+		print '\nABC-SMC with {} particles, {} generations'.format(npart, ngen)
+		tstart=time.time()
+
+		lnmc= partial(runonce, epos, Verbose=False)
+		pool= multiprocessing.Pool(threads) if threads > 1 else None
+		M= map if pool is None else pool.map
+		rs= np.random.RandomState(epos.seed)
+		nbatch= max(threads, npart/10)
+
+		''' Generation 0: sample from the prior'''
+		particles= pmin + (pmax-pmin)*rs.uniform(size=(npart, ndim))
+		rho= -np.array(M(lnmc, particles))
+		weights= np.full(npart, 1./npart)
+		eps, nsim= [np.inf], [npart]
+		print '  generation 0: {} simulations'.format(npart)
+
+		for gen in range(1, ngen):
+			tol= np.percentile(rho[np.isfinite(rho)], 100.*alpha)
+			cov= 2.*np.cov(particles, rowvar=False, aweights=weights)
+			cov= np.atleast_2d(cov)
+			covinv= np.linalg.inv(cov)
+
+			new, newrho= [], []
+			ntry, nrun= 0, 0 # proposals (also outside the prior), simulations
+			while len(new) < npart and ntry <= npart/minacc:
+				''' perturb a batch of particles, reject outside prior'''
+				i= rs.choice(npart, size=nbatch, p=weights)
+				trial= rs.multivariate_normal(np.zeros(ndim), cov, size=nbatch) \
+						+ particles[i]
+				ntry+= nbatch
+				trial= trial[np.all((pmin<=trial) & (trial<=pmax), axis=1)]
+				if len(trial) == 0: continue
+
+				_rho= -np.array(M(lnmc, trial))
+				nrun+= len(trial)
+				keep= _rho <= tol
+				new.extend(trial[keep])
+				newrho.extend(_rho[keep])
+
+			acc= 1.*len(new)/ntry
+			print '  generation {}: eps={:.3g}, {} simulations, acceptance {:.1%}'.format(
+				gen, tol, nrun, acc)
+			if len(new) < npart:
+				print '  acceptance rate below {:.1%}, stopping'.format(minacc)
+				break
+
+			''' importance weights, uniform prior'''
+			new= np.array(new[:npart])
+			d= new[:,np.newaxis,:]-particles[np.newaxis,:,:]
+			kernel= np.exp(-0.5*np.einsum('ijk,kl,ijl->ij', d, covinv, d))
+			newweights= 1./np.dot(kernel, weights)
+
+			particles= new
+			weights= newweights/np.sum(newweights)
+			rho= np.array(newrho[:npart])
+			eps.append(tol)
+			nsim.append(nrun)
+
+			if acc < minacc: break
+
+		if pool is not None: pool.close()
+
+		runtime= time.time()-tstart
+		print '\nDone running, {} simulations in {:.1f} minutes'.format(sum(nsim),
+			runtime/60.)
+
+		epos.abc= {'eps':np.array(eps), 'nsim':np.array(nsim)}
+		print 'Saving status in {}'.format(fname)
+		np.savez_compressed(fname, particles=particles, weights=weights,
+			eps=epos.abc['eps'], nsim=epos.abc['nsim'], seed=epos.seed,
+			keys=epos.fitpars.keysfit)
+
+	print '  effective sample size {:.0f}'.format(1./np.sum(weights**2.))
+
+	''' weighted posterior samples '''
+	epos.samples= particles
+	epos.weights= weights
+	if hasattr(epos, 'chain'): del epos.chain
+
+	run.posterior(epos, npos=npos)
+
+def _prior(epos, box):
+	''' Uniform prior range, parameters without bounds use initial value +- box*dx'''
+	fpara= np.array(epos.fitpars.getfit(Init=True))
+	dx= np.array(epos.fitpars.getfit(attr='dx'))
+	pmin= np.maximum(np.array(epos.fitpars.getfit(attr='min')), fpara-box*dx)
+	pmax= np.minimum(np.array(epos.fitpars.getfit(attr='max')), fpara+box*dx)
+	return pmin, pmax
+
+def _checkkeys(epos, npz):
+	for loadkey,key in zip(npz['keys'],epos.fitpars.keysfit):
+		if loadkey != key:
+			raise ValueError('Stored key {} doesnt match {}'.format(loadkey,key))
+
+def ptmcmc(epos, nMC=500, nwalkers=50, ntemps=8, Tmax=100., nburn=50, threads=1, 
+		npos=30, Saved=True, Adapt=True):
+	'''
+	Parallel-tempered ensemble MCMC with an adaptive temperature ladder
+	
+	Description:
+		Runs an affine-invariant ensemble at each temperature, with swaps 
+		between adjacent temperatures after each step. The walkers at all 
+		temperatures are simulated together, in parallel with threads>1.
+		During burn-in, the temperatures are adjusted to equalize the swap 
+		acceptance rates (Vousden et al. 2016). 
+		The temperature-one chain is stored in epos.chain, its log-likelihood 
+		in epos.lnprobability (see :func:`reweight`), the ladder in epos.pt
+	
+	Args:
+		nMC(int): number of steps
+		nwalkers(int): number of walkers per temperature
+		ntemps(int): number of temperatures
+		Tmax(float): highest temperature, fixed
+		nburn(int): burn-in steps, the ladder adapts during burn-in
+		threads(int): number of parallel simulations
+		npos(int): number of posterior samples to simulate for plotting
+		Saved(bool): load a previous run from chain/
+		Adapt(bool): adapt the temperature ladder during burn-in
+	'''
+	assert epos.Prep
+	runonce= run._engine(epos)
+
+	fpara= np.array(epos.fitpars.getfit(Init=True))
+	if not len(fpara)>0: raise ValueError('no fit paramaters defined')
+	ndim= fpara.size
+	if nwalkers%2 == 1: raise ValueError('Use an even number of walkers')
+	
+	dir= 'chain/{}'.format(epos.name)
+	fname= '{}/pt{}.{}x{}x{}.npz'.format(dir, ntemps, nwalkers, nMC, ndim)
+	if not os.path.exists(dir): os.makedirs(dir)
+	
+	if os.path.isfile(fname) and Saved:
+		print '\nLoading saved status from {}'.format(fname)
+		npz= np.load(fname)
+		_checkkeys(epos, npz)
+		epos.chain= npz['chain']
+		epos.lnprobability= npz['lnprob'] if 'lnprob' in npz else None
+		epos.pt= {key:npz[key] for key in ['betas','betas history','tswap']}
+	else:
+		print '\nParallel tempering with {} temperatures x {} walkers'.format(ntemps, 
+			nwalkers)
+		tstart=time.time()
+		
+		lnmc= partial(runonce, epos, Verbose=False)
+		pool= multiprocessing.Pool(threads) if threads > 1 else None
+		M= map if pool is None else pool.map
+		rs= np.random.RandomState(epos.seed)
+		
+		pmin= np.array(epos.fitpars.getfit(attr='min'))
+		pmax= np.array(epos.fitpars.getfit(attr='max'))
+		def lnlike(pos):
+			''' likelihood of positions inside the prior, all in one batch '''
+			flat= pos.reshape((-1, ndim))
+			inside= np.all((pmin<=flat) & (flat<=pmax), axis=1)
+			logl= np.full(inside.size, -np.inf)
+			if np.any(inside): logl[inside]= M(lnmc, flat[inside])
+			return logl.reshape(pos.shape[:-1])
+		
+		''' initial ladder and walker positions '''
+		betas= Tmax**(-np.arange(ntemps)/(ntemps-1.))
+		dx= np.array(epos.fitpars.getfit(attr='dx'))
+		p= fpara + dx*rs.uniform(-1, 1, (ntemps, nwalkers, ndim))
+		logl= lnlike(p)
+		
+		chain= np.zeros((nwalkers, nMC, ndim))
+		lnprob= np.zeros((nwalkers, nMC))
+		history= np.zeros((nMC, ntemps))
+		nswap= np.zeros(ntemps-1)
+		naccept= 0
+		
+		a= 2.0 # stretch move scale
+		half= nwalkers/2
+		for i in range(nMC):
+			''' stretch moves, each half of the ensemble at all temperatures'''
+			for j in [0,1]:
+				update= slice(j, None, 2)
+				other= p[:, (j+1)%2::2, :]
+				z= ((a-1.)*rs.uniform(size=(ntemps, half))+1.)**2./a
+				partner= other[np.arange(ntemps)[:,None], rs.randint(half, size=(ntemps, half))]
+				q= partner + z[:,:,None]*(p[:, update, :]-partner)
+				logl_q= lnlike(q)
+				
+				with np.errstate(invalid='ignore'):
+					lnpdiff= (ndim-1.)*np.log(z) + betas[:,None]*(logl_q-logl[:, update])
+				accept= np.log(rs.uniform(size=lnpdiff.shape)) < lnpdiff
+				p[:, update, :][accept]= q[accept]
+				logl[:, update][accept]= logl_q[accept]
+				naccept+= np.sum(accept[0])
+			
+			''' swap adjacent temperatures, hottest first '''
+			swapfrac= np.zeros(ntemps-1)
+			for k in range(ntemps-1, 0, -1):
+				iperm, jperm= rs.permutation(nwalkers), rs.permutation(nwalkers)
+				with np.errstate(invalid='ignore'):
+					lnacc= (betas[k-1]-betas[k])*(logl[k,iperm]-logl[k-1,jperm])
+				swap= np.log(rs.uniform(size=nwalkers)) < lnacc
+				swapfrac[k-1]= np.mean(swap)
+				
+				pk, lk= p[k, iperm[swap]].copy(), logl[k, iperm[swap]].copy()
+				p[k, iperm[swap]], logl[k, iperm[swap]]= p[k-1, jperm[swap]], logl[k-1, jperm[swap]]
+				p[k-1, jperm[swap]], logl[k-1, jperm[swap]]= pk, lk
+			nswap+= swapfrac
+			
+			''' adapt the ladder during burn-in, hottest temperature fixed '''
+			if Adapt and i < nburn and ntemps > 2:
+				kappa= 1./100. * 1000./(i+1000.)
+				dS= kappa*(swapfrac[:-1]-swapfrac[1:])
+				dT= np.diff(1./betas[:-1])*np.exp(dS)
+				betas[1:-1]= 1./(np.cumsum(dT)+1./betas[0])
+			
+			chain[:, i, :]= p[0]
+			lnprob[:, i]= logl[0]
+			history[i]= betas
+			
+			amtDone= float(i)/nMC
+			print '\r  [{:50s}] {:5.1f}%'.format('#' * int(amtDone * 50), amtDone * 100),
+			os.sys.stdout.flush() 
+		
+		if pool is not None: pool.close()
+		
+		print '\nDone running\n'
+		print 'Mean acceptance fraction: {0:.3f}'.format(1.*naccept/(nMC*nwalkers))
+		print 'Swap acceptance fraction: {}'.format(
+			' '.join(['{:.2f}'.format(f) for f in nswap/nMC]) )
+		print 'Temperatures: {}'.format(' '.join(['{:.3g}'.format(T) for T in 1./betas]))
+		print '  Runtime was {:.1f} minutes'.format((time.time()-tstart)/60.)
+		
+		epos.chain= chain
+		epos.lnprobability= lnprob
+		epos.pt= {'betas':betas, 'betas history':history, 'tswap':nswap/nMC}
+		print 'Saving status in {}'.format(fname)
+		np.savez_compressed(fname, chain=epos.chain, lnprob=epos.lnprobability, 
+			seed=epos.seed, keys=epos.fitpars.keysfit, **epos.pt)
+	
+	''' the posterior samples after burn-in '''
+	epos.samples= epos.chain[:, nburn:, :].reshape((-1, ndim))
+	epos.burnin= nburn
+	if hasattr(epos, 'weights'): del epos.weights
+	
+	run.posterior(epos, npos=npos)
+
+def ensembles(epos, nensembles=4, nwalkers=50, nstep=50, maxsteps=2000, 
+		rhat=1.01, minESS=1000, nburn=None, pool=None, npos=30, Saved=True):
+	'''
+	Independent emcee ensembles, run until they converge
+	
+	Description:
+		Launches independent ensembles with different random seeds, that are 
+		advanced nstep steps at a time on a pool of processes. After each round 
+		the Gelman-Rubin R-hat between ensembles and the combined effective 
+		sample size are calculated for all parameters, and the run stops when 
+		both are converged. The ensembles are merged into epos.chain.
+		
+		To span multiple nodes, pass an MPI pool, for example 
+		emcee.utils.MPIPool(), and start the script with mpirun. 
+		The default is a local multiprocessing pool with one process per ensemble.
+	
+	Args:
+		nensembles(int): number of independent ensembles
+		nwalkers(int): number of walkers per ensemble
+		nstep(int): number of steps per round
+		maxsteps(int): stop after this many steps
+		rhat(float): R-hat convergence threshold
+		minESS(float): minimum effective sample size
+		nburn(int): burn-in steps, default is half of the chain
+		pool: object with a map method, or serialpool() to run in this process
+		npos(int): number of posterior samples to simulate for plotting
+		Saved(bool): load a previous run from chain/
+	'''
+	try:
+		import emcee
+	except ImportError:
+		raise ImportError('You need to install emcee')
+	assert epos.Prep
+
+	fpara= np.array(epos.fitpars.getfit(Init=True))
+	if not len(fpara)>0: raise ValueError('no fit paramaters defined')
+	ndim= fpara.size
+	
+	dir= 'chain/{}'.format(epos.name)
+	fname= '{}/ensembles.{}x{}x{}.npz'.format(dir, nensembles, nwalkers, ndim)
+	if not os.path.exists(dir): os.makedirs(dir)
+	
+	if os.path.isfile(fname) and Saved:
+		print '\nLoading saved status from {}'.format(fname)
+		npz= np.load(fname)
+		_checkkeys(epos, npz)
+		epos.chain= npz['chain']
+		epos.rhat, epos.ess= npz['rhat'], npz['ess']
+		nsteps= epos.chain.shape[1]
+	else:
+		print '\n{} independent ensembles of {} walkers'.format(nensembles, nwalkers)
+		tstart=time.time()
+		
+		''' independent random seeds for each ensemble '''
+		if hasattr(np.random, 'SeedSequence'):
+			children= np.random.SeedSequence(epos.seed).spawn(nensembles)
+			seeds= [int(child.generate_state(1)[0]) for child in children]
+		else:
+			seeds= np.random.RandomState(epos.seed).randint(0, 4294967295, 
+				size=nensembles).tolist()
+		
+		if pool is None:
+			pool= multiprocessing.Pool(nensembles)
+			Close= True
+		else:
+			Close= False
+		
+		dx= np.array(epos.fitpars.getfit(attr='dx'))
+		states= []
+		for seed in seeds:
+			rs= np.random.RandomState(seed)
+			p0= fpara + dx*rs.uniform(-1, 1, (nwalkers, ndim))
+			states.append((p0, None, rs.get_state()))
+		
+		chains= [np.zeros((nwalkers, 0, ndim)) for seed in seeds]
+		nsteps= 0
+		while nsteps < maxsteps:
+			tasks= [(epos, seed, state, nstep) for seed, state in zip(seeds, states)]
+			results= pool.map(_advance, tasks)
+			
+			states= [result[1:] for result in results]
+			chains= [np.concatenate([chain, result[0]], axis=1) 
+				for chain, result in zip(chains, results)]
+			nsteps+= nstep
+			
+			''' convergence '''
+			burn= nsteps/2 if nburn is None else nburn
+			if nsteps-burn < 2: continue
+			post= np.array([chain[:, burn:, :] for chain in chains])
+			epos.rhat= gelmanrubin(post)
+			epos.ess= np.sum([ess(chain) for chain in post], axis=0)
+			
+			print '  {} steps: max R-hat= {:.3f}, min ESS= {:.0f}'.format(nsteps,
+				np.max(epos.rhat), np.min(epos.ess))
+			if np.all(epos.rhat < rhat) and np.all(epos.ess > minESS):
+				print '  converged'
+				break
+		else:
+			print '  not converged after {} steps'.format(nsteps)
+		
+		if Close: pool.close()
+
+		runtime= time.time()-tstart
+		print '\nDone running in {:.1f} minutes'.format(runtime/60.)
+		for pname, R, n in zip(epos.fitpars.keysfit, epos.rhat, epos.ess):
+			print '  {}: R-hat= {:.3f}, ESS= {:.0f}'.format(pname, R, n)
+		
+		''' merge the ensembles '''
+		epos.chain= np.concatenate(chains, axis=0)
+		print 'Saving status in {}'.format(fname)
+		np.savez_compressed(fname, chain=epos.chain, seed=epos.seed, seeds=seeds,
+			rhat=epos.rhat, ess=epos.ess, keys=epos.fitpars.keysfit)
+	
+	''' the posterior samples after burn-in '''
+	nburn= nsteps/2 if nburn is None else nburn
+	epos.samples= epos.chain[:, nburn:, :].reshape((-1, ndim))
+	epos.burnin= nburn
+	if hasattr(epos, 'weights'): del epos.weights
+	
+	run.posterior(epos, npos=npos)
+
+def gibbs(epos, nMC=2000, blocks=None, nburn=None, target=0.3, npos=30, Saved=True):
+	'''
+	Metropolis-within-Gibbs sampler that updates one block of parameters at a time
+	
+	Description:
+		Each step cycles through the blocks, and proposes a gaussian move of 
+		the parameters in one block that is accepted with the Metropolis rule.
+		The default blocks are the parameters of the planet population and 
+		those of the observation, see :func:`EPOS.run.observationkeys`. With a 
+		random seed, moves of the observation block reuse the population 
+		cached by :func:`EPOS.run.MC` and only simulate the survey (the 
+		cache is switched on while sampling).
+		The proposal scale of each block starts at dx and is adapted during 
+		burn-in towards the target acceptance rate.
+	
+	Args:
+		nMC(int): number of steps
+		blocks(list): lists of fit parameter keys that are updated together
+		nburn(int): burn-in steps, default is half of the chain
+		target(float): acceptance rate of each block during burn-in
+		npos(int): number of posterior samples to simulate for plotting
+		Saved(bool): load a previous run from chain/
+	'''
+	assert epos.Prep
+	runonce= run._engine(epos)
+	
+	fpara= np.array(epos.fitpars.getfit(Init=True))
+	if not len(fpara)>0: raise ValueError('no fit paramaters defined')
+	ndim= fpara.size
+	if nburn is None: nburn= nMC/2
+	
+	keys= epos.fitpars.keysfit
+	if blocks is None:
+		obs= run.observationkeys(epos)
+		blocks= [[key for key in keys if not key in obs], obs]
+	blocks= [block for block in blocks if len(block) > 0]
+	index= [np.array([keys.index(key) for key in block]) for block in blocks]
+	if sorted(np.concatenate(index)) != range(ndim):
+		raise ValueError('Each fit parameter should be in one block')
+	
+	dir= 'chain/{}'.format(epos.name)
+	fname= '{}/gibbs.{}x{}.npz'.format(dir, nMC, ndim)
+	if not os.path.exists(dir): os.makedirs(dir)
+	
+	if os.path.isfile(fname) and Saved:
+		print '\nLoading saved status from {}'.format(fname)
+		npz= np.load(fname)
+		_checkkeys(epos, npz)
+		epos.chain= npz['chain']
+		epos.lnprobability= npz['lnprob'] if 'lnprob' in npz else None
+		acc= npz['acceptance']
+	else:
+		print '\nMetropolis-within-Gibbs with {} blocks'.format(len(blocks))
+		for block in blocks: print '  {}'.format(', '.join(block))
+		tstart=time.time()
+		
+		lnmc= partial(runonce, epos, Verbose=False)
+		rs= np.random.RandomState(epos.seed)
+		dx= np.array(epos.fitpars.getfit(attr='dx'))
+		logscale= np.zeros(len(blocks))
+		
+		chain= np.zeros((nMC, ndim))
+		lnprob= np.zeros(nMC)
+		naccept= np.zeros(len(blocks))
+		
+		''' the population of the current position is reused by observation moves '''
+		cachesize= run.cachesize
+		run.cachesize= max(cachesize, 2)
+		try:
+			p, lnp= fpara.copy(), lnmc(fpara)
+			if not np.isfinite(lnp): raise ValueError('initial guess has zero probability')
+			
+			for i in range(nMC):
+				for b, ib in enumerate(index):
+					trial= p.copy()
+					trial[ib]+= np.exp(logscale[b])* dx[ib]* rs.normal(size=ib.size)
+					lnp_trial= lnmc(trial)
+					accept= np.log(rs.uniform()) < lnp_trial-lnp
+					if accept: 
+						p, lnp= trial, lnp_trial
+						if i >= nburn: naccept[b]+= 1
+					if i < nburn:
+						logscale[b]+= (accept-target)/np.sqrt(i+1.)
+				chain[i]= p
+				lnprob[i]= lnp
+				
+				amtDone= float(i)/nMC
+				print '\r  [{:50s}] {:5.1f}%'.format('#' * int(amtDone * 50), amtDone * 100),
+				sys.stdout.flush()
+		finally:
+			run.cachesize= cachesize
+			run.clearcache()
+		
+		acc= naccept/max(1, nMC-nburn)
+		runtime= time.time()-tstart
+		print '\nDone running, {} simulations in {:.1f} minutes'.format(
+			nMC*len(blocks)+1, runtime/60.)
+		
+		epos.chain= chain[np.newaxis,:,:]
+		epos.lnprobability= lnprob[np.newaxis,:]
+		print 'Saving status in {}'.format(fname)
+		np.savez_compressed(fname, chain=epos.chain, lnprob=epos.lnprobability, 
+			acceptance=acc, seed=epos.seed, keys=epos.fitpars.keysfit)
+	
+	for block, a in zip(blocks, acc):
+		print '  acceptance {:.1%}: {}'.format(a, ', '.join(block))
+	
+	''' the posterior samples after burn-in '''
+	epos.samples= epos.chain[:, nburn:, :].reshape((-1, ndim))
+	epos.burnin= nburn
+	if hasattr(epos, 'weights'): del epos.weights
+	
+	run.posterior(epos, npos=npos)
+
+def reweight(epos, lnprior=None, Likelihood=True, thin=1, threads=1, npos=30):
+	'''
+	Importance reweighting of the posterior samples of a chain
+	
+	Description:
+		Reweights the samples after burn-in of :func:`EPOS.run.mcmc` or 
+		:func:`gibbs` to a new prior, or to a likelihood with different 
+		settings (f.e. the zoom range, the summary statistics, the goftype, 
+		or the survey completeness), instead of running a new chain. 
+		Samples outside the current bounds of the fit parameters have zero 
+		weight. If Likelihood, the log-likelihood of each distinct sample 
+		(rejected steps repeat a sample) with non-zero weight is simulated 
+		again, in parallel, and divided by the one stored with the chain.
+		With the same random seed and settings, the simulations are 
+		identical and the weights equal.
+		The effective sample size tells if the reweighted samples are 
+		sufficient, or if a new chain is needed.
+		Weighted posterior samples are stored in epos.samples and epos.weights
+	
+	Args:
+		lnprior(function): log of the new prior over the old one, lnprior(fpara)
+		Likelihood(bool): simulate the samples with the current settings
+		thin(int): use every thin-th step of the chain
+		threads(int): number of parallel simulations
+		npos(int): number of posterior samples to simulate for plotting
+	'''
+	assert epos.Prep
+	if not hasattr(epos, 'chain'): raise ValueError('No chain, run EPOS.run.mcmc')
+	ndim= epos.chain.shape[-1]
+	if ndim != len(epos.fitpars.keysfit): 
+		raise ValueError('Chain has {} fit parameters'.format(ndim))
+	samples= epos.chain[:, epos.burnin::thin, :].reshape((-1, ndim))
+	
+	''' new prior, zero outside the bounds '''
+	pmin= np.array(epos.fitpars.getfit(attr='min'))
+	pmax= np.array(epos.fitpars.getfit(attr='max'))
+	lnw= np.where(np.all((pmin<=samples) & (samples<=pmax), axis=1), 0., -np.inf)
+	if lnprior is not None:
+		for i in np.flatnonzero(np.isfinite(lnw)):
+			lnw[i]+= lnprior(samples[i])
+	
+	''' new likelihood of each distinct sample '''
+	nsim= 0
+	if Likelihood:
+		lnprob0= getattr(epos, 'lnprobability', None)
+		if lnprob0 is None or lnprob0.shape != epos.chain.shape[:2]:
+			raise ValueError('No log-likelihood stored with the chain')
+		lnprob0= lnprob0[:, epos.burnin::thin].reshape(-1)
+		
+		unique, inverse= np.unique(samples, axis=0, return_inverse=True)
+		todo= np.unique(inverse[np.isfinite(lnw)])
+		nsim= todo.size
+		print '\nReweighting {} samples, {} simulations'.format(len(samples), nsim)
+		tstart=time.time()
+		
+		lnmc= partial(run._engine(epos), epos, Verbose=False)
+		pool= multiprocessing.Pool(threads) if threads > 1 else None
+		M= map if pool is None else pool.map
+		lnprob= np.full(len(unique), -np.inf)
+		lnprob[todo]= M(lnmc, unique[todo])
+		if pool is not None: pool.close()
+		print '  done in {:.1f} minutes'.format((time.time()-tstart)/60.)
+		
+		valid= np.isfinite(lnw) & np.isfinite(lnprob[inverse])
+		lnw[valid]+= lnprob[inverse][valid]- lnprob0[valid]
+		lnw[~valid]= -np.inf
+	
+	if not np.any(np.isfinite(lnw)): raise ValueError('All samples have zero weight')
+	weights= np.exp(lnw- np.max(lnw))
+	weights/= np.sum(weights)
+	ess= 1./np.sum(weights**2.)
+	print '  effective sample size {:.0f} of {} samples'.format(ess, len(samples))
+	if ess < 0.1*len(samples):
+		print '  NOTE: less than 10% effective samples, run a new chain'
+	
+	epos.reweighting= {'ess':ess, 'nsim':nsim}
+	epos.samples= samples
+	epos.weights= weights
+	
+	run.posterior(epos, npos=npos)
+
+def _advance(args):
+	''' Advance one ensemble by nstep steps, runs on the pool '''
+	import emcee
+	epos, seed, (p0, lnprob0, rstate0), nstep= args
+	runonce= run._engine(epos)
+	
+	seed0= epos.seed
+	epos.seed= seed
+	try:
+		lnmc= partial(runonce, epos, Verbose=False)
+		sampler= emcee.EnsembleSampler(len(p0), len(p0[0]), lnmc)
+		for result in sampler.sample(p0, lnprob0=lnprob0, rstate0=rstate0, 
+				iterations=nstep):
+			pass
+	finally:
+		epos.seed= seed0
+	p, lnprob, rstate= result[:3]
+	return sampler.chain, p, lnprob, rstate
+
+class serialpool:
+	''' Local stand-in for a multiprocessing or MPI pool '''
+	def map(self, func, tasks):
+		return map(func, tasks)
+	def close(self):
+		pass
+
+def gelmanrubin(chains):
+	'''
+	Gelman-Rubin potential scale reduction factor
+	
+	Args:
+		chains(np.array): samples with shape (nchains, nwalkers, nsteps, ndim)
+	
+	Returns:
+		np.array: R-hat for each parameter
+	'''
+	nchains= chains.shape[0]
+	flat= chains.reshape((nchains, -1, chains.shape[-1]))
+	n= flat.shape[1]
+	W= np.mean(np.var(flat, axis=1, ddof=1), axis=0)
+	B_n= np.var(np.mean(flat, axis=1), axis=0, ddof=1)
+	return np.sqrt(((n-1.)/n*W + B_n)/W)
+
+def ess(chain, c=5.):
+	'''
+	Effective sample size of an ensemble, from the integrated autocorrelation time
+	
+	Args:
+		chain(np.array): samples with shape (nwalkers, nsteps, ndim)
+		c(float): window size in units of the autocorrelation time (Sokal 1989)
+	
+	Returns:
+		np.array: effective sample size for each parameter
+	'''
+	nwalkers, nsteps, ndim= chain.shape
+	n= 2**int(np.ceil(np.log2(2*nsteps)))
+	x= chain-np.mean(chain, axis=1, keepdims=True)
+	f= np.fft.fft(x, n=n, axis=1)
+	acf= np.fft.ifft(f*np.conjugate(f), axis=1)[:, :nsteps].real
+	acf= np.mean(acf, axis=0)
+	with np.errstate(invalid='ignore', divide='ignore'):
+		acf/= acf[0]
+	
+	tau= 2.*np.cumsum(acf, axis=0)-1.
+	window= np.arange(nsteps)[:, None] >= c*tau
+	M= np.where(np.any(window, axis=0), np.argmax(window, axis=0), nsteps-1)
+	tau= np.maximum(tau[M, np.arange(ndim)], 1.)
+	return nwalkers*nsteps/tau
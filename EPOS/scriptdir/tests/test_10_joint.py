@@ -0,0 +1,65 @@
+#! /usr/bin/env python
+'''
+Test the joint fit of EPOS.joint on synthetic surveys (does not need the Kepler
+catalogues)
+
+Run with pytest
+'''
+import numpy as np
+
+import EPOS
+
+def _survey(mode='single', nstars=2e4):
+	epos= EPOS.benchmark.setup(mode, nstars=nstars, seed=1)
+	with EPOS.benchmark._quiet(): EPOS.run.once(epos)
+	return epos
+
+def _joint(surveys, **kwargs):
+	with EPOS.benchmark._quiet():
+		fit= EPOS.joint.joint(surveys, **kwargs)
+	return fit
+
+def test_single_survey():
+	''' a joint fit of one survey is the same simulation as EPOS.run.MC '''
+	for mode in ['single', 'multi']:
+		epos= _survey(mode)
+		fit= _joint([epos])
+		fpara= epos.fitpars.getfit(Init=True)
+		lnp= EPOS.run.MC(epos, fpara, Verbose=False)
+		assert np.isfinite(lnp)
+		assert EPOS.joint.MC(fit, fpara, Verbose=False) == lnp, mode
+
+def test_split():
+	''' systems are divided in proportion to the stars, in a random order '''
+	surveys= [_survey(nstars=3e4), _survey(nstars=1e4)]
+	fit= _joint(surveys)
+	nsys= 1000
+	pop= {'P':np.arange(nsys)+1., 'ID':None}
+	for key in ['Y', 'M', 'R', 'I', 'N']: pop[key]= None
+	fit.surveys[0].MC_xvar= fit.surveys[1].MC_xvar= np.array([0.5, 2e3])
+	pops= EPOS.joint._split(fit, pop)
+	assert [sub['P'].size for sub in pops] == [750, 250]
+	assert np.array_equal(np.sort(np.concatenate([sub['P'] for sub in pops])), pop['P'])
+	# not the first and last systems, but reproducible
+	assert pops[1]['P'].min() < 750
+	assert np.array_equal(EPOS.joint._split(fit, pop)[1]['P'], pops[1]['P'])
+
+def test_two_surveys():
+	surveys= [_survey(nstars=2e4), _survey(nstars=1e4)]
+	fit= _joint(surveys, threads=2)
+	fpara= fit.fitpars.getfit(Init=True)
+	lnp= EPOS.joint.MC(fit, fpara, Verbose=False)
+	fit.close()
+	assert np.isfinite(lnp)
+	fit.threads= 1
+	assert EPOS.joint.MC(fit, fpara, Verbose=False) == lnp
+
+def test_nested_threads(tmpdir):
+	''' parallel surveys inside a parallel sampler run one by one, not hang '''
+	tmpdir.chdir()
+	fit= _joint([_survey(nstars=2e4), _survey(nstars=1e4)], threads=2)
+	with EPOS.benchmark._quiet():
+		EPOS.run.mcmc(fit, nMC=3, nwalkers=8, nburn=1, threads=2, npos=2,
+			Saved=False)
+	assert fit.chain.shape == (8, 3, 3)
+	assert np.isfinite(fit.lnprob)
@@ -0,0 +1,82 @@
+#! /usr/bin/env python
+'''
+Test the persistent cache of EPOS.cache, in a temporary cache directory
+
+Run with pytest
+'''
+import numpy as np
+import os
+
+import EPOS
+
+def _cachedir(tmpdir, monkeypatch):
+	fdir= tmpdir.join('cache')
+	monkeypatch.setenv('EPOS_CACHE', str(fdir))
+	return fdir
+
+def test_roundtrip(tmpdir, monkeypatch):
+	fdir= _cachedir(tmpdir, monkeypatch)
+	entry= {'obs':{'P':np.arange(5.), 'ID':np.arange(5), 'nstars':1234},
+		'survey':{'eff_2D':np.ones((3, 2)), 'name':'test'}}
+	key= EPOS.cache.key('test', {'score':0.9})
+	assert EPOS.cache.load(key) is None
+	assert EPOS.cache.save(key, entry) == str(fdir.join(key))
+
+	loaded= EPOS.cache.load(key)
+	assert sorted(loaded) == sorted(entry)
+	for group in entry:
+		assert sorted(loaded[group]) == sorted(entry[group])
+		for name, value in entry[group].items():
+			assert np.array_equal(loaded[group][name], value)
+	assert loaded['obs']['ID'].dtype == entry['obs']['ID'].dtype
+	assert loaded['obs']['nstars'] == 1234 and loaded['survey']['name'] == 'test'
+
+	''' arrays are read-only memory maps '''
+	assert isinstance(loaded['obs']['P'], np.memmap)
+	assert not loaded['obs']['P'].flags.writeable
+
+	''' an existing entry is not overwritten '''
+	EPOS.cache.save(key, {'obs':{'P':np.zeros(2)}})
+	assert np.array_equal(EPOS.cache.load(key)['obs']['P'], np.arange(5.))
+	assert [f for f in os.listdir(str(fdir)) if f.startswith('.')] == []
+
+	EPOS.cache.clear('other')
+	assert EPOS.cache.load(key) is not None
+	EPOS.cache.clear('test')
+	assert EPOS.cache.load(key) is None
+
+def test_key(tmpdir):
+	fname= tmpdir.join('table.txt')
+	missing= EPOS.cache.key('test', {}, [str(fname)])
+	fname.write('1 2 3\n')
+	key= EPOS.cache.key('test', {'a':1, 'b':2}, [str(fname)])
+	assert key != missing
+	assert key.startswith('test-')
+	assert key == EPOS.cache.key('test', {'b':2, 'a':1}, [str(fname)])
+	assert key != EPOS.cache.key('test', {'a':1, 'b':3}, [str(fname)])
+
+	''' a modified source file invalidates the entry '''
+	fname.write('1 2 3 4\n')
+	assert key != EPOS.cache.key('test', {'a':1, 'b':2}, [str(fname)])
+
+def test_stars(tmpdir, monkeypatch):
+	''' a stellar table read from the cache is the same as from the file '''
+	_cachedir(tmpdir, monkeypatch)
+	fname= str(tmpdir.join('stars.tbl'))
+	with open(fname, 'w') as f:
+		f.write('\\fixlen = T\n')
+		f.write('|radius |mass   |cdpp   |\n')
+		f.write('|double |double |double |\n')
+		f.write(' 1.0     1.0     100.0  \n')
+		f.write(' 0.5     null    50.0   \n')
+		f.write(' 2.0     1.5     200.0  \n')
+	names= {'R':'radius', 'M':'mass', 'cdpp':'cdpp', 'dutycycle':0.9}
+
+	stars= EPOS.stars.read(fname, names, Cache=False, Verbose=False)
+	assert np.array_equal(stars['R'], [1., 2.])
+	cached= EPOS.stars.read(fname, names, Verbose=False)
+	again= EPOS.stars.read(fname, names, Verbose=False)
+	for key in EPOS.stars.columns:
+		assert np.array_equal(cached[key], stars[key])
+		assert np.array_equal(again[key], stars[key])
+	assert isinstance(again['R'], np.memmap)
@@ -0,0 +1,69 @@
+#! /usr/bin/env python
+'''
+Test the catalogue readers of EPOS.catalog against astropy and numpy, on
+small tables written to a temporary directory
+
+Run with pytest
+'''
+import numpy as np
+import pytest
+
+import EPOS
+
+ipac= '''\\fixlen = T
+\\RowsRetrieved = 4
+|kepid    |kepoi_name|koi_period   |koi_prad |koi_count|
+|int      |char      |double       |double   |int      |
+|         |          |days         |R_Earth  |         |
+|null     |null      |null         |null     |null     |
+ 10797460  K00752.01  9.488035570   2.26      2        
+ 10797460  K00752.02  54.418382700  null      2        
+ 10811496  K00753.01  19.899139910  14.60     1        
+ 10848459  null       1.736952453   33.46     1        
+'''
+
+def _write(tmpdir, name, text):
+	fname= tmpdir.join(name)
+	fname.write(text)
+	return str(fname)
+
+def test_ipac(tmpdir):
+	fname= _write(tmpdir, 'koi.tbl', ipac)
+	data= EPOS.catalog.ipac(fname)
+	assert sorted(data) == ['kepid', 'kepoi_name', 'koi_count', 'koi_period', 'koi_prad']
+	assert data['kepid'].dtype == np.int64
+	assert np.array_equal(data['kepid'], [10797460, 10797460, 10811496, 10848459])
+	assert list(data['kepoi_name']) == ['K00752.01', 'K00752.02', 'K00753.01', 'null']
+	assert np.allclose(data['koi_period'], [9.488035570, 54.418382700, 19.899139910,
+		1.736952453], rtol=1e-15)
+	assert np.isnan(data['koi_prad'][1])
+
+	''' only the requested columns '''
+	assert sorted(EPOS.catalog.ipac(fname, ['koi_prad', 'kepid'])) == ['kepid', 'koi_prad']
+	with pytest.raises(ValueError):
+		EPOS.catalog.ipac(fname, ['koi_srad'])
+
+def test_ipac_astropy(tmpdir):
+	ascii= pytest.importorskip('astropy.io.ascii')
+	fname= _write(tmpdir, 'koi.tbl', ipac)
+	data= EPOS.catalog.ipac(fname)
+	table= ascii.read(fname, format='ipac')
+	for name in ['kepid', 'koi_count', 'koi_period', 'koi_prad']:
+		column= np.ma.filled(table[name].astype(float), np.nan)
+		assert np.allclose(data[name], column, equal_nan=True), name
+	assert list(data['kepoi_name'][:3]) == list(table['kepoi_name'][:3])
+
+def test_delimited(tmpdir):
+	text= '# kepid, teff, radius\nid,teff,radius\n1,5700,1.0\n2,,0.8 # comment\n\n3,6100,1.3\n'
+	fname= _write(tmpdir, 'stars.csv', text)
+	data= EPOS.catalog.delimited(fname, {'teff':1, 'radius':2}, skiprows=2)
+	expected= np.genfromtxt(fname, delimiter=',', skip_header=2, comments='#')
+	assert np.allclose(data['teff'], expected[:,1], equal_nan=True)
+	assert np.allclose(data['radius'], expected[:,2])
+
+def test_join():
+	right= np.array([30, 10, 20, 50])
+	left= np.array([10, 40, 50, 10, 5, 60])
+	brute= [list(right).index(k) if k in right else -1 for k in left]
+	assert list(EPOS.catalog.join(left, right)) == brute
+	assert list(EPOS.catalog.join(left, [])) == [-1]*left.size
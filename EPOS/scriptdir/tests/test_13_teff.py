@@ -0,0 +1,78 @@
+#! /usr/bin/env python
+'''
+Test the Teff interpolation of the Kepler DR25 detection efficiency in
+EPOS.kepler (uses the completeness files that ship with EPOS)
+
+Run with pytest
+'''
+import numpy as np
+import pytest
+
+import EPOS
+
+def _bin(Teff):
+	return np.load('{}/files/completeness.dr25.T{}.Huber.npz'.format(
+		EPOS.kepler.fpath, Teff))
+
+@pytest.fixture
+def cb(tmpdir, monkeypatch):
+	monkeypatch.setenv('EPOS_CACHE', str(tmpdir))
+	return EPOS.kepler.cube()
+
+def test_cube(cb):
+	assert np.array_equal(cb['Teff'], np.arange(3250, 7000, 500))
+	assert cb['fsnr'].shape == (cb['Teff'].size, cb['P'].size, cb['Rp'].size)
+	for i, Teff in enumerate(cb['Teff']):
+		eff= _bin(int(Teff))
+		assert np.array_equal(cb['fsnr'][i], eff['fsnr'])
+		assert cb['n'][i] == eff['n']
+
+	''' the cached cube is the same '''
+	cached= EPOS.kepler.cube()
+	for key in cb:
+		assert np.array_equal(cached[key], cb[key]), key
+
+def test_bin_center(cb):
+	survey, nstars= EPOS.kepler.completeness(Teff=5750.)
+	assert nstars == 1.
+	assert np.allclose(survey['eff_2D'], _bin(5750)['fsnr'])
+	assert np.array_equal(survey['xvar'], cb['P'])
+	assert np.isclose(survey['Mstar'], _bin(5750)['Mst'])
+
+	''' Teff range inside a single bin '''
+	survey, nstars= EPOS.kepler.completeness(Trange=[5500, 6000])
+	assert nstars == cb['n'][cb['Teff'] == 5750]
+	assert np.allclose(survey['eff_2D'], _bin(5750)['fsnr'])
+
+def test_interpolation(cb):
+	''' linear between the bin centers, constant outside '''
+	survey, _= EPOS.kepler.completeness(Teff=6000.)
+	mean= 0.5*(_bin(5750)['fsnr']+_bin(6250)['fsnr'])
+	assert np.allclose(survey['eff_2D'], mean)
+
+	survey, _= EPOS.kepler.completeness(Teff=5850.)
+	assert np.allclose(survey['eff_2D'], 0.8*_bin(5750)['fsnr']+0.2*_bin(6250)['fsnr'])
+
+	survey, _= EPOS.kepler.completeness(Teff=2000.)
+	assert np.allclose(survey['eff_2D'], _bin(3250)['fsnr'])
+	survey, _= EPOS.kepler.completeness(Teff=9000.)
+	assert np.allclose(survey['eff_2D'], _bin(6750)['fsnr'])
+
+def test_mixture(cb):
+	''' a list of stars is the weighted average of the interpolation '''
+	Teff, weights= np.array([4250., 5850., 6000.]), np.array([1., 2., 1.])
+	survey, nstars= EPOS.kepler.completeness(Teff=Teff, weights=weights)
+	single= [EPOS.kepler.completeness(Teff=T)[0]['eff_2D'] for T in Teff]
+	assert nstars == 4.
+	assert np.allclose(survey['eff_2D'], np.average(single, axis=0, weights=weights))
+
+	''' a Teff range weighs the bins by the number of stars inside it '''
+	survey, nstars= EPOS.kepler.completeness(Trange=[5000, 6250])
+	n= cb['n'][[4, 5, 6]]* np.array([1., 1., 0.5]) # 5250, 5750, half of 6250
+	assert np.isclose(nstars, n.sum())
+	assert np.allclose(survey['eff_2D'], np.tensordot(n/n.sum(), cb['fsnr'][[4, 5, 6]], axes=1))
+
+	with pytest.raises(ValueError):
+		EPOS.kepler.completeness()
+	with pytest.raises(ValueError):
+		EPOS.kepler.completeness(Trange=[8000, 9000])
@@ -0,0 +1,93 @@
+#! /usr/bin/env python
+'''
+Test the star-by-star simulation mode of EPOS.stars on a synthetic survey
+(does not need the Kepler catalogues)
+
+Run with pytest
+'''
+import numpy as np
+import pytest
+
+import EPOS
+
+def _sunlike(nstars, **kwargs):
+	return EPOS.stars.table(R=np.ones(nstars), M=np.ones(nstars), **kwargs)
+
+def test_table(tmpdir):
+	stars= EPOS.stars.table(R=[1., 0.5], M=[1., 0.6], cdpp=100., dutycycle=0.9)
+	assert sorted(stars) == sorted(EPOS.stars.columns)
+	assert np.array_equal(stars['cdpp'], [100., 100.])
+	assert stars['tobs'].dtype == float and stars['tobs'].size == 2
+	with pytest.raises(ValueError):
+		EPOS.stars.table(R=np.ones((2, 2)), M=1., cdpp=1.)
+
+	EPOS.stars.save(str(tmpdir), stars)
+	loaded= EPOS.stars.load(str(tmpdir))
+	for key in EPOS.stars.columns:
+		assert np.array_equal(loaded[key], stars[key])
+		assert not loaded[key].flags.writeable
+
+def test_assign():
+	''' planets in the same system share a host star '''
+	np.random.seed(1)
+	ID= np.repeat(np.arange(1000), 3)
+	host= EPOS.stars.assign(50, ID.size, ID)
+	assert np.all(host.reshape(-1, 3) == host[::3, None])
+	assert host.min() >= 0 and host.max() < 50
+	assert np.unique(EPOS.stars.assign(50, ID.size)).size == 50
+
+def test_transitprob():
+	''' sun-like stars have the transit probability of the average star '''
+	epos= EPOS.benchmark.setup('single', nstars=1e4, seed=1)
+	stars= _sunlike(10, cdpp=100.)
+	P= np.logspace(-1, 3, 100)
+	p_trans= EPOS.stars.transitprob(stars, np.zeros(P.size, dtype=int), P)
+	assert np.allclose(p_trans, np.minimum(1., epos.fgeo_prefac*P**epos.Pindex))
+	assert p_trans[0] == 1.
+
+	''' larger stars, larger probability '''
+	stars['R'][1]= 2.
+	P= np.array([10., 100., 300.])
+	assert np.allclose(EPOS.stars.transitprob(stars, np.ones(P.size, dtype=int), P),
+		2.*epos.fgeo_prefac*P**epos.Pindex)
+
+def _mes(stars, P, R, b=0., tcdpp=6., mintransit=3):
+	return EPOS.stars._mes(stars, np.zeros(np.size(P), dtype=int), np.asarray(P, dtype=float),
+		R, b, tcdpp, mintransit)
+
+def test_mes():
+	''' an Earth analogue with 30 ppm noise in 4 years has a MES of about 8 '''
+	stars= _sunlike(1, cdpp=30., tobs=4*365.25)
+	mes= _mes(stars, [365.25], 1.)[0]
+	assert 7.5 < mes < 9.
+
+	''' scaling with radius, noise, baseline, and impact parameter '''
+	assert np.isclose(_mes(stars, [365.25], 2.)[0], 4.*mes)
+	noisy= _sunlike(1, cdpp=60., tobs=4*365.25)
+	assert np.isclose(_mes(noisy, [365.25], 1.)[0], 0.5*mes)
+	longer= _sunlike(1, cdpp=30., tobs=16*365.25)
+	assert np.isclose(_mes(longer, [365.25], 1.)[0], 2.*mes)
+	assert _mes(stars, [365.25], 1., b=1.)[0] == 0.
+	assert 0 < _mes(stars, [365.25], 1., b=0.9)[0] < mes
+
+	''' too few transits '''
+	assert _mes(stars, [500.], 1.)[0] == 0.
+	assert _mes(stars, [500.], 1., mintransit=2)[0] > 0.
+
+	''' recovery fraction '''
+	assert EPOS.stars.recovery(0., 30.87, 0.271, 0.94) == 0.
+	assert np.isclose(EPOS.stars.recovery(1e3, 30.87, 0.271, 0.94), 0.94)
+
+@pytest.mark.parametrize('mode', ['single', 'multi'])
+def test_observe(mode):
+	''' no detections with too few transits in the stellar baseline '''
+	epos= EPOS.benchmark.setup(mode, nstars=1e4, seed=1)
+	with EPOS.benchmark._quiet():
+		epos.set_stars(_sunlike(int(1e4), cdpp=30., tobs=90.))
+		EPOS.run.once(epos)
+		fpara= epos.fitpars.getfit(Init=True)
+		EPOS.run.MC(epos, fpara, Store=True, Verbose=False)
+	assert epos.StarByStar and epos.nstars == 1e4
+	P= epos.synthetic_survey['P']
+	assert P.size > 0 and P.max() <= 30.
+	assert np.isfinite(EPOS.run.MC(epos, fpara, Verbose=False))
@@ -0,0 +1,53 @@
+#! /usr/bin/env python
+'''
+Test the detection efficiency of a stellar table from EPOS.completeness
+against an injection-recovery simulation with EPOS.stars
+
+Run with pytest
+'''
+import numpy as np
+
+import EPOS
+
+def _stars(nstars=200, seed=1):
+	rs= np.random.RandomState(seed)
+	return EPOS.stars.table(R=rs.uniform(0.7, 1.5, nstars), M=rs.uniform(0.7, 1.3, nstars),
+		cdpp=rs.uniform(30., 200., nstars), dutycycle=0.9, tobs=1400.)
+
+def _injection(stars, P, R, ninject=2000, seed=2):
+	''' fraction of planets around random stars that transit and are detected '''
+	rs= np.random.RandomState(seed)
+	host= np.repeat(np.arange(stars['R'].size), ninject)
+	b= rs.uniform(0, 1, host.size)
+	p_trans= EPOS.stars.transitprob(stars, host, np.full(host.size, P))
+	mes= EPOS.stars._mes(stars, host, P, R, b, 6., 3)
+	return np.mean(p_trans* EPOS.stars.recovery(mes, 30.87, 0.271, 0.940))
+
+def test_injection_recovery():
+	stars= _stars()
+	xvar, yvar= np.array([3., 30., 300.]), np.array([0.8, 1.5, 3., 10.])
+	survey, nstars= EPOS.completeness.survey(stars, xvar, yvar, Verbose=False)
+	assert nstars == 200
+	assert survey['eff_2D'].shape == (xvar.size, yvar.size)
+	assert np.all((survey['eff_2D'] >= 0) & (survey['eff_2D'] <= 0.94))
+
+	''' the geometric factor of the survey is the mean transit probability '''
+	f_geo= survey['Rstar']* EPOS.cgs.Rsun/ EPOS.stars._sma(survey['Mstar'], xvar)
+	host= np.arange(nstars)
+	for P, f in zip(xvar, f_geo):
+		assert np.isclose(f, np.mean(EPOS.stars.transitprob(stars, host, np.full(nstars, P))))
+
+	''' detection efficiency times transit probability, per grid point '''
+	for i, P in enumerate(xvar):
+		for j, R in enumerate(yvar):
+			expected= _injection(stars, P, R)
+			assert abs(survey['eff_2D'][i,j]* f_geo[i]- expected) < \
+				0.01*expected+ 1e-5, (P, R)
+
+def test_threads():
+	stars= _stars(nstars=50)
+	kwargs= dict(xvar=np.geomspace(1., 500., 6), yvar=np.geomspace(0.5, 10., 5),
+		Verbose=False)
+	serial, _= EPOS.completeness.survey(stars, **kwargs)
+	parallel, _= EPOS.completeness.survey(stars, threads=2, **kwargs)
+	assert np.allclose(serial['eff_2D'], parallel['eff_2D'], rtol=1e-12)
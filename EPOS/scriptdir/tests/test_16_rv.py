@@ -0,0 +1,70 @@
+#! /usr/bin/env python
+'''
+Test the RV injection-recovery completeness of EPOS.rv against least-squares
+fits of simulated time series
+
+Run with pytest
+'''
+import numpy as np
+
+import EPOS
+
+def _star(seed=1, nobs=30):
+	rs= np.random.RandomState(seed)
+	return {'t':np.sort(rs.uniform(0, 3000., nobs)), 'err':rs.uniform(1., 3., nobs),
+		'jitter':2., 'M':0.9}
+
+def _bruteforce(star, P, Msini, threshold, ninject=2000, seed=3):
+	''' fraction of noisy time series where a sinusoid improves chi-square '''
+	rs= np.random.RandomState(seed)
+	t= star['t']
+	sigma= np.sqrt(star['err']**2.+ star['jitter']**2.)
+	K= EPOS.rv._semiamplitude(P, Msini, star['M'])
+	A= np.stack([np.ones_like(t), np.cos(2.*np.pi*t/P), np.sin(2.*np.pi*t/P)], axis=-1)
+	ndet= 0
+	for _ in range(ninject):
+		rv= K* np.sin(2.*np.pi*t/P+ rs.uniform(0, 2.*np.pi))+ sigma* rs.normal(size=t.size)
+		w= 1./sigma
+		chi2_const= np.sum(((rv- np.average(rv, weights=w**2.))*w)**2.)
+		coef= np.linalg.lstsq(A*w[:,None], rv*w, rcond=None)[0]
+		chi2_sin= np.sum(((rv- np.dot(A, coef))*w)**2.)
+		ndet+= chi2_const- chi2_sin > threshold
+	return 1.*ndet/ninject
+
+def test_injection_recovery():
+	star= _star()
+	xvar, yvar= np.array([10., 300.]), np.array([3., 10., 30.])
+	survey, nstars= EPOS.rv.completeness([star], xvar, yvar, ninject=2000, seed=1,
+		Verbose=False)
+	assert nstars == 1 and survey['Mstar'] == 0.9
+
+	fap= 0.01
+	nfreq= (star['t'].max()- star['t'].min())/ xvar[0]
+	threshold= -2.* np.log(1.- (1.-fap)**(1./nfreq))
+	for i, P in enumerate(xvar):
+		for j, Msini in enumerate(yvar):
+			expected= _bruteforce(star, P, Msini, threshold)
+			eff= survey['eff_2D'][i,j]
+			sigma= np.sqrt(max(expected*(1.-expected), 1e-3)/2000.)
+			assert abs(eff- expected) < 5.*sigma, (P, Msini, eff, expected)
+	assert survey['eff_2D'][0,-1] > 0.9 and survey['eff_2D'][-1,0] < 0.1
+
+def test_survey():
+	stars= [_star(seed) for seed in range(4)]+ [_star(seed=9, nobs=3)]
+	kwargs= dict(xvar=np.geomspace(5., 3000., 5), yvar=np.geomspace(1., 300., 6),
+		ninject=50, seed=1, Verbose=False)
+	survey, nstars= EPOS.rv.completeness(stars, **kwargs)
+	assert nstars == 5
+	assert survey['eff_2D'].shape == (5, 6)
+	# more massive planets are easier to detect
+	assert np.all(np.diff(survey['eff_2D'], axis=1) >= -0.1)
+
+	''' a star with too few epochs detects nothing '''
+	single, _= EPOS.rv.completeness(stars[-1:], **kwargs)
+	assert np.all(single['eff_2D'] == 0)
+
+	''' reproducible, also in parallel '''
+	again, _= EPOS.rv.completeness(stars, **kwargs)
+	parallel, _= EPOS.rv.completeness(stars, threads=2, **kwargs)
+	assert np.array_equal(again['eff_2D'], survey['eff_2D'])
+	assert np.array_equal(parallel['eff_2D'], survey['eff_2D'])
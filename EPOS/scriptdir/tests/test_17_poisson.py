@@ -0,0 +1,60 @@
+#! /usr/bin/env python
+'''
+Test the binned Poisson goodness-of-fit (goftype='Poisson') of EPOS.run on a
+synthetic survey (does not need the Kepler catalogues)
+
+Run with pytest
+'''
+import numpy as np
+import pytest
+
+import EPOS
+
+def test_histograms():
+	bins= EPOS.run._logbins([1., 100.], 4)
+	counts= EPOS.run._bincount(np.array([0.5, 1., 2., 5., 50., 99., 1e3]), bins)
+	assert list(counts) == [3, 1, 0, 3] # outside in the first and last bin
+
+	ID= np.array([0, 1, 1, 2, 2, 2, 3, 3, 3, 3, 3])
+	assert list(EPOS.run._multiplicity(ID, 3)) == [1, 1, 2]
+	assert list(EPOS.run._multiplicity(ID[:0], 3)) == [0, 0, 0]
+
+def test_multinomial():
+	''' zero at best, lower for a different shape, not the normalization '''
+	n= np.array([10, 40, 30, 20])
+	best= EPOS.run._lnp_multinomial(n, 100*n)
+	assert -0.1 < best <= 0.
+	assert np.isclose(best, EPOS.run._lnp_multinomial(n, 1000*n), atol=0.02)
+	assert EPOS.run._lnp_multinomial(n, 100*n[::-1]) < best- 5.
+	assert EPOS.run._lnp_multinomial(n, 0*n) == -np.inf
+	assert EPOS.run._lnp_multinomial(0*n, n) == 0.
+
+@pytest.mark.parametrize('mode', ['single', 'multi'])
+def test_poisson(mode):
+	epos= EPOS.benchmark.setup(mode, nstars=4e4, seed=1)
+	with EPOS.benchmark._quiet(): EPOS.run.once(epos, goftype='Poisson')
+	assert epos.goftype == 'Poisson'
+	bins, counts= epos.obs_zoom['bins'], epos.obs_zoom['counts']
+	assert counts['xvar'].sum() == counts['N'] == epos.obs_zoom['x'].size
+	if mode == 'multi':
+		assert counts['Nk'].size == bins['Nk']
+		assert np.sum(counts['Nk']*np.arange(1, bins['Nk']+1)) <= counts['N']
+
+	fpara= epos.fitpars.getfit(Init=True)
+	with EPOS.benchmark._quiet(): EPOS.run.MC(epos, fpara, Store=True, Verbose=False)
+	lnp= {key:np.log(epos.prob[key]) for key in epos.summarystatistic}
+	assert all(lnp[key] <= 0 for key in lnp)
+	assert np.isclose(epos.lnprob, np.sum(lnp.values()))
+
+	''' the planet count: fewer planets, lower likelihood '''
+	i= epos.fitpars.keysfit.index('pps')
+	low= np.array(fpara)
+	low[i]*= 0.3
+	with EPOS.benchmark._quiet(): EPOS.run.MC(epos, low, Store=True, Verbose=False)
+	with np.errstate(divide='ignore'):
+		assert np.log(epos.prob['N']) < lnp['N']- 10.
+
+def test_goftype():
+	epos= EPOS.benchmark.setup('single', nstars=1e4, seed=1)
+	with pytest.raises(ValueError):
+		with EPOS.benchmark._quiet(): EPOS.run.once(epos, goftype='chi2')
@@ -0,0 +1,79 @@
+#! /usr/bin/env python
+'''
+Test the tag weights of EPOS.tags on a synthetic planet formation model
+(does not need the Kepler catalogues)
+
+Run with pytest
+'''
+import numpy as np
+import pytest
+
+import EPOS
+
+def _epos(nrep=10):
+	obs, survey= EPOS.benchmark.synthetic(nstars=2e4, seed=1)
+	pfm= EPOS.benchmark.population(nsys=500, seed=1)
+	pfm['tag']= np.repeat(np.random.RandomState(2).uniform(-0.5, 0.5, 500), 5)
+	with EPOS.benchmark._quiet():
+		epos= EPOS.epos(name='tags', seed=1)
+		epos.set_observation(**obs)
+		epos.set_survey(**survey)
+		epos.set_population(pfm.pop('name'), **pfm)
+		epos.fitpars.add('eta', 0.5, min=0, isnorm=True)
+		epos.fitpars.add('a_FeH', 1., min=-3, max=5)
+		epos.fitpars.add('f_iso', 0.4, fixed=True)
+		epos.fitpars.add('f_inc', 1.0, fixed=True)
+		epos.set_ranges(xtrim=[1,730], ytrim=[0.5,12.], xzoom=[2,400], yzoom=[0.7,6])
+		EPOS.run.once(epos)
+		EPOS.tags.prepare(epos, EPOS.tags.powerlaw, ['a_FeH'], nrep=nrep)
+	return epos
+
+def test_weights():
+	epos= _epos()
+	fpara= epos.fitpars.getfit(Init=True)
+	p= EPOS.tags.weights(epos, fpara)
+	assert np.isclose(p.sum(), 1.)
+	assert np.allclose(p, 10.**epos.tagged['tag']/np.sum(10.**epos.tagged['tag']))
+
+	''' a flat weight for a=0 '''
+	i= epos.fitpars.keysfit.index('a_FeH')
+	flat= np.array(fpara)
+	flat[i]= 0.
+	assert np.allclose(EPOS.tags.weights(epos, flat), 1./p.size)
+	assert epos.engine is EPOS.tags.MC
+	assert np.isfinite(EPOS.tags.MC(epos, fpara, Verbose=False))
+
+	flat[i]= 10. # out of bounds
+	assert EPOS.tags.MC(epos, flat, Verbose=False) == -np.inf
+
+def test_restore_draw_prob(monkeypatch):
+	''' a stored simulation draws with the tag weights, then restores the model '''
+	epos= _epos()
+	fpara= epos.fitpars.getfit(Init=True)
+	tagged= {key:np.copy(value) for key, value in epos.tagged.items()
+		if isinstance(value, np.ndarray)}
+	assert not 'draw prob' in epos.pfm
+
+	with EPOS.benchmark._quiet(): EPOS.run.once(epos)
+	assert not 'draw prob' in epos.pfm
+	assert np.isfinite(epos.lnprob)
+	for key in tagged:
+		assert np.array_equal(epos.tagged[key], tagged[key]), key
+
+	''' the draw probability during the simulation '''
+	drawn= []
+	def MC(epos, fpara, **kwargs):
+		drawn.append(epos.pfm['draw prob'])
+		raise ValueError('failed simulation')
+	monkeypatch.setattr(EPOS.run, 'MC', MC)
+	with pytest.raises(ValueError):
+		EPOS.tags.MC(epos, fpara, Store=True, Verbose=False)
+	assert np.array_equal(drawn[0], EPOS.tags.weights(epos, fpara))
+	assert not 'draw prob' in epos.pfm
+
+	''' a previous draw probability is put back '''
+	previous= np.full(epos.pfm['ns'], 1./epos.pfm['ns'])
+	epos.pfm['draw prob']= previous
+	with pytest.raises(ValueError):
+		EPOS.tags.MC(epos, fpara, Store=True, Verbose=False)
+	assert epos.pfm['draw prob'] is previous
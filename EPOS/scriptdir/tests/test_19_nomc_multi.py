@@ -0,0 +1,51 @@
+#! /usr/bin/env python
+'''
+Test if the multi-planet mode without Monte Carlo (EPOS.run.noMC) agrees with
+the mean of Monte Carlo simulations, on a synthetic survey (does not need
+the Kepler catalogues)
+
+Run with pytest
+'''
+import numpy as np
+
+import EPOS
+
+def test_nomc_multi():
+	epos= EPOS.benchmark.setup('multi', seed=1)
+	with EPOS.benchmark._quiet(): EPOS.run.once(epos)
+	fpara= epos.fitpars.getfit(Init=True)
+	grid= EPOS.run.noMC(epos, fpara, Store=True, Sample=True, Verbose=False)
+	edges= grid['P zoom']* np.exp(0.5*np.log(grid['P zoom'][1]/grid['P zoom'][0]))
+	inzoom= (epos.xzoom[0] < edges) & (edges < epos.xzoom[1])
+
+	''' mean of the Monte Carlo simulations '''
+	nrep, nk= 20, 4
+	n, Nk, cdf= [], [], []
+	for seed in range(1, nrep+1):
+		epos.seed= seed
+		ss= EPOS.run.MC(epos, fpara, Store=True, Sample=True, Verbose=False)
+		n.append(ss['nobs'])
+		count= np.zeros(ss['multi']['bin'].max())
+		count[ss['multi']['bin']-1]= ss['multi']['count']
+		Nk.append(count[:nk])
+		cdf.append(np.searchsorted(np.sort(ss['P zoom']), edges[inzoom], 
+			side='right')/ float(ss['nobs']))
+	sem= lambda x: np.std(x, axis=0)/np.sqrt(nrep)
+
+	''' number of detections, multiplicity, period distribution '''
+	assert abs(grid['nobs']- np.mean(n)) < 0.02*np.mean(n)+ 3.*sem(n)
+	expected= grid['multi']['count'][:nk]
+	mean= np.mean(Nk, axis=0)
+	assert np.all(np.abs(expected- mean) < 0.04*mean+ 3.*sem(Nk)), (expected, mean)
+	assert np.all(np.abs(grid['P zoom cdf'][inzoom]- np.mean(cdf, axis=0)) < 0.02)
+
+	''' the log-likelihood is smooth in the parameters, no Monte Carlo noise '''
+	i= epos.fitpars.keysfit.index('pps')
+	lnp= []
+	for f in [0.98, 0.99, 1., 1.01, 1.02]:
+		trial= np.array(fpara)
+		trial[i]*= f
+		lnp.append(EPOS.run.noMC(epos, trial, Verbose=False))
+	assert np.all(np.isfinite(lnp))
+	assert np.all(np.diff(lnp) < 0) # the initial guess has more planets than observed
+	assert np.all(np.abs(np.diff(lnp, 3)) < 0.1)
@@ -0,0 +1,57 @@
+#! /usr/bin/env python
+'''
+Test the maximum a posteriori search of EPOS.run.optimize and its use as the
+starting point of EPOS.run.mcmc, on a synthetic survey
+
+Run with pytest
+'''
+import numpy as np
+
+import EPOS
+
+def _epos(tmpdir):
+	tmpdir.chdir()
+	epos= EPOS.benchmark.setup('single', nstars=2e4, seed=1)
+	with EPOS.benchmark._quiet(): EPOS.run.once(epos)
+	return epos
+
+def _mcmc(epos, Optimize):
+	with EPOS.benchmark._quiet():
+		EPOS.run.mcmc(epos, nMC=2, nwalkers=8, nburn=1, npos=2, Saved=False,
+			Optimize=Optimize)
+
+def test_optimize(tmpdir):
+	epos= _epos(tmpdir)
+	lnp0= EPOS.run.MC(epos, epos.fitpars.getfit(Init=True), Verbose=False)
+	with EPOS.benchmark._quiet(): EPOS.run.optimize(epos, maxiter=30)
+	assert epos.map['method'] == 'Nelder-Mead' # the default
+	assert epos.map['lnprob'] >= lnp0
+	assert np.isclose(EPOS.run.MC(epos, epos.map['fpara'], Verbose=False),
+		epos.map['lnprob'])
+	dx= np.array(epos.fitpars.getfit(attr='dx'))
+	assert np.all((epos.map['sigma'] > 0) & (epos.map['sigma'] <= dx))
+
+def test_stale_map(tmpdir):
+	epos= _epos(tmpdir)
+	with EPOS.benchmark._quiet(): EPOS.run.optimize(epos, maxiter=10)
+	stored= epos.map
+
+	''' reused with the same fit parameters '''
+	_mcmc(epos, True)
+	assert epos.map is stored
+
+	''' a global search is opt-in, and is reused unless another method is asked '''
+	with EPOS.benchmark._quiet():
+		EPOS.run.optimize(epos, method='differential_evolution', maxiter=2)
+	stored= epos.map
+	_mcmc(epos, True)
+	assert epos.map is stored
+	_mcmc(epos, 'Nelder-Mead')
+	assert epos.map['method'] == 'Nelder-Mead'
+
+	''' a new search after a fit parameter changed '''
+	stored= epos.map
+	epos.fitpars.set('P1', 0.4)
+	_mcmc(epos, True)
+	assert epos.map is not stored
+	assert epos.map['method'] == 'Nelder-Mead'
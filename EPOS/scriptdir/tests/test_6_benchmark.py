@@ -0,0 +1,41 @@
+#! /usr/bin/env python
+'''
+Benchmark EPOS on a synthetic survey, does not need the Kepler catalogues
+
+Run with pytest to check the structure of the results on a small survey.
+Run as a script to time all modes for two survey sizes on 1 and 4 cores,
+results are saved in benchmark.json, compare this file between versions
+'''
+import numpy as np
+
+import EPOS
+
+def test_benchmark(tmpdir):
+	tmpdir.chdir()
+	results= EPOS.benchmark.suite(nstars=[1e4], threads=[1], nrep=2, nsamples=10,
+		npos=2, fname=None)
+
+	assert [bench['mode'] for bench in results['benchmarks']] == EPOS.benchmark.modes
+	for bench in results['benchmarks']:
+		mode, times= bench['mode'], bench['times']
+		runtype= 'noMC' if mode == 'noMC' else 'MC'
+		assert 'once' in times and runtype in times
+		assert len(times[runtype]) == 2
+		assert all(t > 0 for ts in times.values() for t in ts)
+		assert bench['throughput'][1] > 0
+
+		''' stages of the simulations that were timed, no stale or cached records '''
+		stages= set(bench['timings'])
+		assert 'total' in stages and 'gof' in stages
+		assert not 'cache' in stages
+		if mode == 'noMC':
+			assert stages == set(['pdf', 'gof', 'store', 'total'])
+		else:
+			assert set(['draw', 'transit', 'detection']) <= stages
+		if mode in ['single', 'noMC']:
+			assert 'occurrence' in times
+
+if __name__ == '__main__':
+	''' time all modes for two survey sizes on 1 and 4 cores '''
+	EPOS.benchmark.suite(nstars=[1e4, 1.6862e5], threads=[1, 4], nrep=10,
+		fname='benchmark.json')
@@ -0,0 +1,51 @@
+#! /usr/bin/env python
+'''
+Test if the weighted Monte Carlo mode agrees with the unweighted one, on a
+synthetic survey (does not need the Kepler catalogues)
+
+Run with pytest
+'''
+import numpy as np
+
+import EPOS
+
+def _lnp(epos, fpara, seeds):
+	''' log-likelihood of each summary statistic, for each random seed '''
+	lnp= {}
+	for seed in seeds:
+		epos.seed= seed
+		with EPOS.benchmark._quiet():
+			EPOS.run.MC(epos, fpara, Store=True, Verbose=False)
+		for key in ['xvar', 'yvar']:
+			lnp.setdefault(key, []).append(np.log(epos.prob[key]))
+	return {key:np.array(lnp[key]) for key in lnp}
+
+def test_weighted_lnp():
+	''' weighted and unweighted lnp agree within the Monte Carlo noise '''
+	epos= EPOS.benchmark.setup('single', seed=1)
+	with EPOS.benchmark._quiet(): EPOS.run.once(epos)
+	fpara= epos.fitpars.getfit(Init=True)
+	seeds= range(10, 20)
+
+	epos.Weighted= False
+	mc= _lnp(epos, fpara, seeds)
+	epos.Weighted= True
+	weighted= _lnp(epos, fpara, seeds)
+
+	for key in mc:
+		assert np.all(np.isfinite(weighted[key]))
+		sigma= np.sqrt((np.var(mc[key])+np.var(weighted[key]))/len(seeds))
+		assert abs(np.mean(weighted[key])-np.mean(mc[key])) < 4.*sigma+1., key
+		# the weighted statistic is not sharper than a realization
+		assert np.std(weighted[key]) <= np.std(mc[key])+1., key
+
+def test_weighted_small_sample():
+	''' too few (expected) planets give a rejection, not nan '''
+	a, b, w= np.array([1., 2.]), np.array([1.5]), np.array([0.5])
+	for func in [EPOS.run._prob_ks_weighted, EPOS.run._prob_ad_weighted]:
+		prob, lnp= func(a, b, 0.*w)
+		assert prob == 0 and lnp == -np.inf
+	prob, lnp= EPOS.run._prob_ad_weighted(a, b, w)
+	assert prob == 0 and lnp == -np.inf
+	prob, lnp= EPOS.run._prob_ks_weighted(a, b, w)
+	assert np.isfinite(lnp)
@@ -0,0 +1,81 @@
+#! /usr/bin/env python
+'''
+Test if the samplers in EPOS.samplers run on a synthetic survey (does not
+need the Kepler catalogues). The chains are short, this only checks the
+shape of the output and that the best fit has a finite likelihood
+
+Run with pytest
+'''
+import numpy as np
+
+import EPOS
+
+def _epos(tmpdir):
+	''' the single-planet benchmark, chains are saved in tmpdir '''
+	tmpdir.chdir()
+	epos= EPOS.benchmark.setup('single', nstars=2e4, seed=1)
+	with EPOS.benchmark._quiet(): EPOS.run.once(epos)
+	return epos
+
+def _check(epos, nsamples):
+	ndim= len(epos.fitpars.keysfit)
+	assert epos.samples.shape == (nsamples, ndim)
+	assert np.all(np.isfinite(epos.samples))
+	if hasattr(epos, 'weights'):
+		assert epos.weights.shape == (nsamples,)
+		assert np.isclose(np.sum(epos.weights), 1.)
+	assert len(epos.ss_sample) == 2
+	assert np.isfinite(epos.lnprob) # the best-fit run of EPOS.run.posterior
+
+def test_abcsmc(tmpdir):
+	epos= _epos(tmpdir)
+	EPOS.samplers.abcsmc(epos, npart=20, ngen=2, npos=2, Saved=False)
+	assert epos.abc['eps'].size == epos.abc['nsim'].size
+	_check(epos, 20)
+
+def test_ptmcmc(tmpdir):
+	epos= _epos(tmpdir)
+	EPOS.samplers.ptmcmc(epos, nMC=6, nwalkers=8, ntemps=3, nburn=3, npos=2)
+	assert epos.chain.shape == (8, 6, 3)
+	assert epos.pt['betas history'].shape == (6, 3)
+	assert epos.pt['betas'][0] == 1.
+	assert epos.lnprobability.shape == (8, 6)
+	assert np.all(np.isfinite(epos.lnprobability))
+	_check(epos, 8*3)
+
+	''' the cold chain can be reweighted, also when loaded '''
+	EPOS.samplers.reweight(epos, npos=2)
+	assert np.isclose(epos.reweighting['ess'], 8*3)
+	lnprob= epos.lnprobability
+	del epos.lnprobability
+	EPOS.samplers.ptmcmc(epos, nMC=6, nwalkers=8, ntemps=3, nburn=3, npos=2)
+	assert np.array_equal(epos.lnprobability, lnprob)
+
+def test_ensembles(tmpdir):
+	epos= _epos(tmpdir)
+	EPOS.samplers.ensembles(epos, nensembles=2, nwalkers=8, nstep=4, maxsteps=8,
+		pool=EPOS.samplers.serialpool(), npos=2, Saved=False)
+	assert epos.chain.shape == (16, 8, 3)
+	assert epos.rhat.shape == (3,) and epos.ess.shape == (3,)
+	_check(epos, 16*4)
+
+def test_convergence():
+	''' R-hat and ESS of independent gaussian samples '''
+	chains= np.random.RandomState(1).normal(size=(4, 10, 200, 2))
+	assert np.all(np.abs(EPOS.samplers.gelmanrubin(chains)-1.) < 0.01)
+	n= EPOS.samplers.ess(chains[0])
+	assert n.shape == (2,)
+	assert np.all((n > 0.5*10*200) & (n < 2.*10*200))
+
+def test_gibbs_reweight(tmpdir):
+	epos= _epos(tmpdir)
+	EPOS.samplers.gibbs(epos, nMC=10, npos=2, Saved=False)
+	assert epos.chain.shape == (1, 10, 3)
+	assert epos.lnprobability.shape == (1, 10)
+	assert np.all(np.isfinite(epos.lnprobability))
+	_check(epos, 5)
+
+	''' same settings, equal weights '''
+	EPOS.samplers.reweight(epos, npos=2)
+	assert np.isclose(epos.reweighting['ess'], 5.)
+	_check(epos, 5)
@@ -0,0 +1,49 @@
+#! /usr/bin/env python
+'''
+Test if the population cache of EPOS.run.MC gives the same log-likelihood
+as a new simulation, on a synthetic survey
+
+Run with pytest
+'''
+import numpy as np
+
+import EPOS
+
+def _fresh(epos, fpara):
+	EPOS.run.clearcache()
+	return EPOS.run.MC(epos, fpara, Verbose=False)
+
+def test_popcache():
+	epos= EPOS.benchmark.setup('multi', seed=1)
+	with EPOS.benchmark._quiet(): EPOS.run.once(epos)
+	fpara= np.array(epos.fitpars.getfit(Init=True))
+	assert EPOS.run.cachesize == 0 # off by default
+
+	cachesize= EPOS.run.cachesize
+	EPOS.run.cachesize= 2
+	try:
+		lnp= EPOS.run.MC(epos, fpara, Verbose=False)
+		assert lnp == _fresh(epos, fpara)
+
+		''' observation parameters reuse the population '''
+		i= epos.fitpars.keysfit.index('f_iso')
+		trial= fpara.copy()
+		trial[i]= 0.3
+		EPOS.run.MC(epos, fpara, Verbose=False)
+		assert EPOS.run.MC(epos, trial, Verbose=False) == _fresh(epos, trial)
+
+		''' settings that change the population '''
+		EPOS.run.MC(epos, fpara, Verbose=False)
+		epos.Stratified= True
+		assert EPOS.run.MC(epos, fpara, Verbose=False) == _fresh(epos, fpara)
+		epos.fitpars.set('f_cor', 0.3)
+		assert EPOS.run.MC(epos, fpara, Verbose=False) == _fresh(epos, fpara)
+
+		''' instances with the same name do not share populations '''
+		other= EPOS.benchmark.setup('multi', seed=1)
+		with EPOS.benchmark._quiet(): EPOS.run.once(other)
+		EPOS.run.MC(epos, fpara, Verbose=False)
+		assert EPOS.run.MC(other, fpara, Verbose=False) == _fresh(other, fpara)
+	finally:
+		EPOS.run.cachesize= cachesize
+		EPOS.run.clearcache()
@@ -0,0 +1,162 @@
+'''
+This module contains the star-by-star simulation mode. The surveyed stars are
+kept in a stellar table (radius, mass, noise, duty cycle, and observing
+baseline of each star) that is stored column-wise and read as memory maps.
+Planets are assigned to host stars, and the transit probability and
+detection probability are calculated with the properties of the host star,
+in chunks of planets.
+
+Example:
+	>>> stars= EPOS.stars.table(R=R, M=M, cdpp=cdpp, dutycycle=0.9)
+	>>> epos.set_stars(stars)
+
+Note:
+	The detection probability follows the multiple event statistic (MES) of
+	the Kepler pipeline: the transit depth over the noise, scaled to the
+	transit duration and the number of transits, with the recovery fraction
+	a gamma cdf of the MES (Christiansen 2017).
+'''
+import numpy as np
+import os
+from scipy.special import gammainc
+
+import cgs
+import cache
+import catalog
+
+columns= ['R', 'M', 'cdpp', 'dutycycle', 'tobs'] # Rsun, Msun, ppm, -, days
+chunk= 2**20 # planets per chunk
+
+def table(R, M, cdpp, dutycycle=1., tobs=1459.789):
+	'''
+	Stellar table from arrays
+
+	Args:
+		R(np.array): stellar radius [Solar radii]
+		M(np.array): stellar mass [Solar masses]
+		cdpp(np.array): noise on the timescale tcdpp, see :func:`EPOS.epos.set_stars` [ppm]
+		dutycycle(np.array): fraction of the baseline with valid data
+		tobs(np.array): observing baseline [days]
+
+	Returns:
+		dict: a float array for each column, scalars are repeated for each star
+	'''
+	values= np.broadcast_arrays(*[np.asarray(x, dtype=float)
+		for x in [R, M, cdpp, dutycycle, tobs]])
+	if values[0].ndim != 1: raise ValueError('only 1D arrays')
+	return {key:np.ascontiguousarray(x) for key, x in zip(columns, values)}
+
+def save(fdir, stars):
+	''' Store a stellar table as one .npy file per column '''
+	if not os.path.isdir(fdir): os.makedirs(fdir)
+	for key in columns:
+		np.save(os.path.join(fdir, '{}.npy'.format(key)), stars[key])
+
+def load(fdir):
+	''' Load a stellar table, the columns are read-only memory maps '''
+	return {key:np.load(os.path.join(fdir, '{}.npy'.format(key)), mmap_mode='r')
+		for key in columns}
+
+def read(fname, names, Cache=True, Verbose=True):
+	'''
+	Read a stellar table from an IPAC table, f.e. the Kepler stellar
+	properties from the NASA exoplanet archive
+
+	Args:
+		fname(str): file name
+		names(dict): the column in the file, or a constant, for R, M, cdpp,
+			and optionally dutycycle and tobs
+		Cache(bool): store the table in :mod:`EPOS.cache`, and read it as
+			memory maps
+
+	Returns:
+		dict: the stellar table, stars with missing values are removed
+	'''
+	if Cache:
+		ckey= cache.key('stars', names, [fname])
+		entry= cache.load(ckey)
+		if entry is not None:
+			if Verbose: print '\nLoaded stellar table from cache'
+			return entry['stars']
+
+	fcolumns= [name for name in names.values() if isinstance(name, basestring)]
+	data= catalog.ipac(fname, fcolumns)
+	values= {key:data[name] if isinstance(name, basestring) else name
+		for key, name in names.items()}
+	stars= table(**values)
+
+	valid= np.all([np.isfinite(stars[key]) for key in columns], axis=0)
+	valid&= (stars['R'] > 0) & (stars['M'] > 0) & (stars['cdpp'] > 0)
+	stars= {key:stars[key][valid] for key in columns}
+	if Verbose:
+		print '\nStellar table: {} stars, {} with missing values'.format(valid.sum(),
+			valid.size-valid.sum())
+
+	if Cache:
+		cache.save(ckey, {'stars':stars})
+		stars= cache.load(ckey)['stars']
+	return stars
+
+def assign(nstars, nplanets, ID=None):
+	''' Host star of each planet, planets in the same system (ID) share a star '''
+	if ID is None:
+		return np.random.randint(0, nstars, nplanets)
+	IDsys, toplanet= np.unique(ID, return_inverse=True)
+	return np.random.randint(0, nstars, IDsys.size)[toplanet]
+
+def transitprob(stars, host, P):
+	''' Geometric transit probability R/a of each planet [P in days] '''
+	p_trans= np.empty(P.size)
+	for sl in _chunks(P.size):
+		R, M= stars['R'][host[sl]], stars['M'][host[sl]]
+		p_trans[sl]= np.minimum(1., R*cgs.Rsun / _sma(M, P[sl]))
+	return p_trans
+
+def detectionprob(epos, host, P, R, b=None):
+	'''
+	Detection probability of each transiting planet
+
+	Args:
+		host(np.array): index of the host star
+		P(np.array): orbital period [days]
+		R(np.array): planet radius [Earth radii]
+		b(np.array): impact parameter, drawn uniformly if None
+
+	Returns:
+		np.array: detection probability
+	'''
+	if b is None: b= np.random.uniform(0, 1, P.size)
+	return recovery(mes(epos, host, P, R, b), *epos.recovery)
+
+def mes(epos, host, P, R, b=0.):
+	''' Multiple event statistic of each transiting planet '''
+	b= np.broadcast_to(b, P.shape)
+	mes= np.empty(P.size)
+	for sl in _chunks(P.size):
+		mes[sl]= _mes(epos.stars, host[sl], P[sl], R[sl], b[sl], epos.tcdpp,
+			epos.mintransit)
+	return mes
+
+def recovery(mes, a, scale, c=1.):
+	''' Fraction of planets recovered as function of MES, a gamma cdf '''
+	return c* gammainc(a, mes/scale)
+
+def _mes(stars, host, P, R, b, tcdpp, mintransit):
+	''' MES, the arrays are broadcast against each other '''
+	Rs, Ms= stars['R'][host], stars['M'][host]
+	cdpp= stars['cdpp'][host]
+	ntransit= stars['tobs'][host]* stars['dutycycle'][host]/ P
+
+	depth= 1e6* (R*cgs.Rearth/(Rs*cgs.Rsun))**2. # ppm
+	with np.errstate(invalid='ignore'):
+		tdur= P*24./np.pi* np.arcsin(np.minimum(1., Rs*cgs.Rsun/_sma(Ms, P))
+			* np.sqrt(np.clip(1.-b**2., 0, 1))) # hours
+	mes= depth/cdpp* np.sqrt(ntransit* tdur/tcdpp)
+	return np.where(ntransit >= mintransit, mes, 0.)
+
+def _sma(M, P):
+	''' semi-major axis [cm] from stellar mass [Msun] and period [days] '''
+	return (cgs.G*M*cgs.Msun* (P*cgs.day)**2./(4.*np.pi**2.))**(1./3.)
+
+def _chunks(n):
+	return [slice(i, min(i+chunk, n)) for i in range(0, n, chunk)]
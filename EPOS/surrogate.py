@@ -0,0 +1,193 @@
+'''
+This module contains an emulator of the log-likelihood that is used to skip
+expensive Monte Carlo simulations of MCMC proposals far in the tails
+
+Note:
+	Screened proposals are rejected without a simulation, so the chain 
+	samples the posterior only approximately: a proposal the emulator 
+	wrongly places far below the ensemble is never accepted. Use it to 
+	speed up exploratory or burn-in runs
+'''
+import numpy as np
+import os
+import hashlib
+import multiprocessing
+
+import cache
+
+class surrogate:
+	'''
+	Local linear regression of the log-likelihood on previous evaluations
+
+	Args:
+		scale(np.array): length scale of each fit parameter, usually dx
+		nmin(int): minimum number of evaluations before predicting
+		nneighbors(int): number of nearest neighbours in the regression
+		radius(float): only predict within this distance (in units of scale)
+			of a previous evaluation
+	'''
+	def __init__(self, scale, nmin=100, nneighbors=30, radius=1.0):
+		self.scale= np.asarray(scale, dtype=float)
+		self.nmin= nmin
+		self.nneighbors= nneighbors
+		self.radius= radius
+
+		self.x= np.empty((0, self.scale.size))
+		self.lnp= np.empty(0)
+		self._x, self._lnp= [], []
+
+	def add(self, x, lnp):
+		''' Add evaluations of the log-likelihood (-inf is ignored)'''
+		self._x.extend(np.atleast_2d(x))
+		self._lnp.extend(np.atleast_1d(lnp))
+
+	def _update(self):
+		if len(self._x) > 0:
+			x= np.array(self._x)
+			lnp= np.array(self._lnp)
+			finite= np.isfinite(lnp)
+			self.x= np.concatenate([self.x, x[finite]])
+			self.lnp= np.concatenate([self.lnp, lnp[finite]])
+			self._x, self._lnp= [], []
+
+	def predict(self, x):
+		'''
+		Predicted log-likelihood and its uncertainty at position x
+
+		Returns:
+			mean(float): predicted log-likelihood, nan if no prediction
+			sigma(float): uncertainty of the prediction
+		'''
+		self._update()
+		ndim= self.scale.size
+		if self.lnp.size < max(self.nmin, self.nneighbors):
+			return np.nan, np.inf
+
+		dX= (self.x-x)/self.scale
+		dist= np.sqrt(np.sum(dX**2., axis=1))
+		near= np.argpartition(dist, self.nneighbors-1)[:self.nneighbors]
+		if np.min(dist[near]) > self.radius:
+			return np.nan, np.inf
+
+		''' weighted linear least squares '''
+		h= np.max(dist[near])
+		w= np.exp(-0.5*(dist[near]/h)**2.)
+		A= np.hstack([np.ones((near.size,1)), dX[near]])
+		AtW= A.T*w
+		try:
+			cov= np.linalg.inv(np.dot(AtW, A))
+		except np.linalg.LinAlgError:
+			return np.nan, np.inf
+		coef= np.dot(cov, np.dot(AtW, self.lnp[near]))
+
+		residual= self.lnp[near]- np.dot(A, coef)
+		dof= max(np.sum(w)- (ndim+1), 1.)
+		var= np.sum(w*residual**2.)/dof
+
+		return coef[0], np.sqrt(var*(1.+cov[0,0]))
+
+	def save(self, fname):
+		self._update()
+		np.savez_compressed(fname, x=self.x, lnp=self.lnp)
+
+	def load(self, fname):
+		npz= np.load(fname)
+		if npz['x'].shape[1] == self.scale.size:
+			self.add(npz['x'], npz['lnp'])
+			self._update()
+			print '  Loaded {} previous evaluations from {}'.format(self.lnp.size, fname)
+		else:
+			print '  Skipping {}, different number of parameters'.format(fname)
+
+def key(epos):
+	''' 
+	File name of the evaluations of an epos instance, that changes with 
+	the settings of the log-likelihood: random seed, fidelity, 
+	goodness-of-fit, fit parameters, ranges, observations and survey 
+	'''
+	def digest(x):
+		return hashlib.sha1(np.ascontiguousarray(x).tostring()).hexdigest()
+	fp= epos.fitpars.fitpars
+	args= {'seed':epos.seed, 'fidelity':epos.fidelity, 'nstars':epos.nstars,
+		'goftype':getattr(epos, 'goftype', None), 
+		'summarystatistic':list(epos.summarystatistic),
+		'keys':list(epos.fitpars.keysfit),
+		'fixed':[(key, repr(fp[key]['value_init'])) for key in epos.fitpars.keysall 
+			if fp[key]['fixed']],
+		'ranges':[list(getattr(epos, key, [])) for key in 
+			['xtrim', 'ytrim', 'xzoom', 'yzoom']],
+		'observations':digest(np.r_[epos.obs_xvar, epos.obs_yvar]),
+		'survey':digest(epos.eff_2D)}
+	return '{}.npz'.format(cache.key('surrogate', args))
+
+class screeningpool:
+	'''
+	Pool for emcee that skips simulations the surrogate confidently places
+	far below the current ensemble
+
+	Description:
+		Set the attribute threshold to the lowest log-likelihood in the current
+		ensemble. Proposals with a predicted log-likelihood more than margin
+		below the threshold, within nsigma, are returned as -inf without
+		running the simulation. All other proposals are simulated
+		(in parallel with threads>1) and added to the surrogate.
+		If the function returns tuples (log-likelihood, blobs), screened 
+		proposals return (-inf, None, ..) of the same length.
+
+	Args:
+		emulator(surrogate): the surrogate log-likelihood
+		threads(int): number of parallel simulations
+		margin(float): screen proposals this far below the ensemble
+		nsigma(float): confidence of the screening
+	'''
+	def __init__(self, emulator, threads=1, margin=10., nsigma=3.):
+		self.emulator= emulator
+		self.margin= margin
+		self.nsigma= nsigma
+		self.threshold= None
+		self.pool= multiprocessing.Pool(threads) if threads > 1 else None
+		self.nsim= 0
+		self.nskip= 0
+		self.nresult= None # length of the returned tuples, 0 for floats
+
+	def map(self, func, tasks):
+		''' Results are log-likelihoods or tuples (log-likelihood, blob) '''
+		results= [-np.inf]*len(tasks)
+		simulate= np.ones(len(tasks), dtype=bool)
+
+		if self.threshold is not None:
+			for i, x in enumerate(tasks):
+				mean, sigma= self.emulator.predict(x)
+				if mean+self.nsigma*sigma < self.threshold-self.margin:
+					simulate[i]= False
+
+		todo= [x for x, sim in zip(tasks, simulate) if sim]
+		M= map if self.pool is None else self.pool.map
+		if len(todo) > 0:
+			out= M(func, todo)
+			for i, res in zip(np.flatnonzero(simulate), out):
+				results[i]= res
+			lnp= [res[0] if isinstance(res, tuple) else res for res in out]
+			self.emulator.add(todo, lnp)
+
+		''' screened proposals have no blobs '''
+		if len(todo) > 0:
+			self.nresult= len(out[0]) if isinstance(out[0], tuple) else 0
+		if self.nresult is None and len(todo) < len(tasks):
+			raise ValueError('Return type unknown, no proposals were simulated')
+		if self.nresult:
+			results= [res if isinstance(res, tuple) else (res,)+(None,)*(self.nresult-1)
+				for res in results]
+
+		self.nsim+= len(todo)
+		self.nskip+= len(tasks)-len(todo)
+		return results
+
+	def update(self, lnprob):
+		''' Set the screening threshold from the log-likelihood of the ensemble '''
+		finite= np.isfinite(lnprob)
+		if np.any(finite):
+			self.threshold= np.min(lnprob[finite])
+
+	def close(self):
+		if self.pool is not None: self.pool.close()
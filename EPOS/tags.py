@@ -0,0 +1,171 @@
+'''
+This module fits the weights of tagged planet formation models, f.e. the
+metallicity of the disk in each simulation, or the model index of several
+models combined with :func:`EPOS.pfmodel.combine`. The transits and detections
+of each simulated system are simulated once, for many viewing angles, and the
+log-likelihood of a set of weights is calculated from the weighted systems
+without drawing a new population.
+
+Example:
+	>>> epos.set_population('Bern', tag=FeH, **pfm)
+	>>> epos.fitpars.add('pps', 0.5, min=0, isnorm=True)
+	>>> epos.fitpars.add('a_FeH', 1., min=-3, max=5)
+	>>> EPOS.run.once(epos)
+	>>> EPOS.tags.prepare(epos, EPOS.tags.powerlaw, ['a_FeH'])
+	>>> EPOS.run.mcmc(epos, nMC=1000, nwalkers=100, nburn=200)
+'''
+import numpy as np
+import time
+
+import run
+import timing
+
+def powerlaw(tag, a):
+	''' Power law in 10^tag, f.e. planet occurrence as function of [Fe/H] '''
+	return 10.**(a*tag)
+
+def mixture(tag, *weights):
+	''' Weight of each model in a combination, the tag is the index of the 
+	model (0, 1, 2, ..), the first model has weight one '''
+	return np.r_[1., weights][tag.astype(int)]
+
+def prepare(epos, func, keys, nrep=100, Verbose=True):
+	'''
+	Simulate the transits and detections of each system, for fitting weights
+	
+	Description:
+		Each system of the planet formation model is observed nrep times 
+		with :func:`EPOS.run.observe`. A parameter set gives a weight to each 
+		system, func(tag, *pars) normalized, and each detected planet counts 
+		with the weight of its system divided by nrep. The log-likelihood is
+		calculated with the weighted summary statistics of the weighted mode 
+		of :func:`EPOS.run.observe`, also for the period ratios.
+		The inclination and correlated noise parameters (f_iso, f_cor, f_inc)
+		have to be fixed, the fit parameters are the number of systems per 
+		star, the parameters of func, and f_dP.
+		Sets epos.engine, so that :func:`EPOS.run.mcmc` and the samplers use 
+		:func:`MC`. Simulations that are stored (:func:`EPOS.run.once`, 
+		:func:`EPOS.run.posterior`) draw systems with the weights.
+	
+	Args:
+		func(function): weight of each system, func(tag, *pars)
+		keys(list): fit parameters that are the arguments of func
+		nrep(int): number of times each system is observed
+	'''
+	if epos.Parametric: raise ValueError('Tag weights need a planet formation model')
+	if not epos.Prep: raise ValueError('Run EPOS.run.once first')
+	pfm= epos.pfm
+	if not 'tag' in pfm: raise ValueError('No tags, see epos.set_population')
+	if not epos.Multi: raise ValueError('Tag weights need multi-planet systems')
+	for key in epos.fitpars.keysfit:
+		if not key in [epos.fitpars.keypps, 'f_dP']+list(keys):
+			raise ValueError('Fit parameter {} should be fixed'.format(key))
+	tstart= time.time()
+	
+	ns, npl= pfm['ns'], pfm['np']
+	tag= pfm['tag'][np.searchsorted(pfm['ID'], pfm['system index'])]
+	
+	''' observe all systems nrep times '''
+	fpara= epos.fitpars.getfit(Init=True)
+	pop= {'P':np.tile(pfm['P'], nrep), 'M':np.tile(pfm['M'], nrep), 
+		'R':np.tile(pfm['R'], nrep) if 'R' in pfm else None, 
+		'I':np.tile(pfm['inc'], nrep), 'N':np.tile(pfm['kth'], nrep),
+		'ID':np.tile(pfm['ID'], nrep) + np.repeat(np.arange(nrep)*ns, npl),
+		'nsys':nrep*ns, 'dInc':False, 'f_dP':1.}
+	pop['Y']= pop['M']
+	for key in ['f_iso', 'f_cor', 'f_inc']:
+		pop[key]= epos.fitpars.getmc(key, fpara)
+	
+	if epos.seed is not None: np.random.seed(epos.seed)
+	Weighted= epos.Weighted
+	epos.Weighted= False
+	try:
+		det= run.observe(epos, pop, Verbose=False, Detections=True)
+	finally:
+		epos.Weighted= Weighted
+	
+	''' detected planets in the zoomed range '''
+	P, Y, index= det['P'], det['Y'], det['index']
+	inbox= (epos.xzoom[0]<=P) & (P<=epos.xzoom[1]) & \
+		(epos.yzoom[0]<=Y) & (Y<=epos.yzoom[1])
+	P, Y, index= P[inbox], Y[inbox], index[inbox]
+	isys= pfm['ID'][index % npl]
+	
+	''' detected planets of each system in each realization, in order of period '''
+	group= (index // npl)* ns + isys
+	first= np.r_[True, group[1:]!=group[:-1]]
+	start= np.flatnonzero(first)
+	k= np.diff(np.r_[start, group.size])
+	Nk= np.zeros((ns, k.max() if k.size > 0 else 1))
+	np.add.at(Nk, (isys[start], k-1), 1)
+	pair= ~first[1:]
+	
+	epos.tagged= {'func':func, 'keys':list(keys), 'nrep':nrep, 'tag':tag, 
+		'sys':isys, 'P':P, 'Y':Y, 'Nk':Nk, 
+		'dP':P[1:][pair]/P[:-1][pair], 'dP sys':isys[1:][pair],
+		'Pin':P[start[k>1]], 'Pin sys':isys[start[k>1]]}
+	epos.engine= MC
+	if Verbose:
+		print '\nObserved {} systems {} times in {:.1f} sec'.format(ns, nrep, 
+			time.time()-tstart)
+		print '  {} detected planets, {} tags'.format(P.size, np.unique(tag).size)
+
+def weights(epos, fpara):
+	''' Probability to draw each system, None if the weights are not valid '''
+	t= epos.tagged
+	pars= [epos.fitpars.getmc(key, fpara) for key in t['keys']]
+	with np.errstate(all='ignore'):
+		w= np.asarray(t['func'](t['tag'], *pars), dtype=float)
+		if not np.all(np.isfinite(w)) or np.any(w < 0) or not np.sum(w) > 0:
+			return None
+		return w/np.sum(w)
+
+def MC(epos, fpara, Store=False, Sample=False, StorePopulation=False, Extra=None,
+		Verbose=True):
+	'''
+	Log-likelihood of the weighted systems, like :func:`EPOS.run.MC`
+	
+	Description:
+		Each detected planet counts with the expected number of such systems
+		in the survey, divided by nrep. The weights add up to the expected 
+		number of detections, which is the sample size of the two-sample 
+		tests, independent of nrep.
+		With Store, a population is drawn with the tag weights, 
+		epos.pfm['draw prob'] is restored afterwards.
+	
+	Returns:
+		float: log-likelihood, or the output of :func:`EPOS.run.MC` if Store
+	'''
+	tm= timing.call()
+	try:
+		epos.fitpars.checkbounds(fpara)
+	except ValueError:
+		if Store: raise
+		return tm.reject('out of bounds')
+	p= weights(epos, fpara)
+	if p is None:
+		if Store: raise ValueError('invalid tag weights')
+		return tm.reject('tag weights')
+	
+	if Store:
+		''' draw a population with these weights '''
+		previous= epos.pfm.get('draw prob')
+		epos.pfm['draw prob']= p
+		try:
+			return run.MC(epos, fpara, Store=Store, Sample=Sample, Extra=Extra, 
+				Verbose=Verbose)
+		finally:
+			if previous is None: del epos.pfm['draw prob']
+			else: epos.pfm['draw prob']= previous
+	
+	t= epos.tagged
+	W= epos.nstars* epos.fitpars.getpps_fromlist(fpara)* p/ t['nrep']
+	f_dP= epos.fitpars.getmc('f_dP', fpara)
+	prob, lnp= run._prob_weighted(epos, t['P'], t['Y'], W[t['sys']], 
+		Nk=np.dot(W, t['Nk']), dP=f_dP*t['dP'], Pin=t['Pin'], 
+		w_dP=W[t['dP sys']], w_Pin=W[t['Pin sys']])
+	tm.stage('gof')
+	
+	lnprob= np.sum([lnp[key] for key in epos.summarystatistic])
+	if np.isnan(lnprob): return tm.reject('nan')
+	return lnprob
@@ -0,0 +1,157 @@
+'''
+This module contains the timing instrumentation of the Monte Carlo simulation.
+Each call to :func:`EPOS.run.MC` records the wall time per stage, the array
+sizes, and the reason a parameter set was rejected. The records are collected
+in epos.timings
+'''
+import numpy as np
+import time, json
+
+from EPOS.save import serialize_numpy_array
+
+try:
+	import resource
+except ImportError:
+	resource= None
+
+def _peakrss():
+	''' peak resident set size of this process so far (kB), or None '''
+	if resource is None: return None
+	return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+last= None # record of the most recent call in this process
+
+class call:
+	''' Record of a single Monte Carlo simulation'''
+	def __init__(self):
+		global last
+		last= self
+		self.stages={}
+		self.sizes={}
+		self.rejected= None
+		self.rss0= _peakrss()
+		self.tstart= self.tlast= time.time()
+
+	def stage(self, name):
+		''' Time since the previous stage '''
+		t= time.time()
+		self.stages[name]= self.stages.get(name, 0.) + t-self.tlast
+		self.tlast= t
+
+	def size(self, name, n):
+		self.sizes[name]= n
+
+	def reject(self, reason):
+		self.rejected= reason
+		return -np.inf
+
+	def record(self):
+		'''
+		Dictionary that can be passed between processes
+		
+		The memory is the peak of the process (peakrss), which includes all 
+		previous calls, and by how much this call raised that peak (drss)
+		'''
+		rec= {'stages':self.stages, 'sizes':self.sizes, 'rejected':self.rejected,
+			'total':self.tlast-self.tstart}
+		if self.rss0 is not None:
+			rec['peakrss']= _peakrss()
+			rec['drss']= rec['peakrss']-self.rss0
+		return rec
+
+def record():
+	''' The record of the most recent call in this process, or None '''
+	return None if last is None else last.record()
+
+class timed:
+	'''
+	Wraps a log-likelihood function to also return the timing record
+	(as an emcee blob)
+	'''
+	def __init__(self, func):
+		self.func= func
+
+	def __call__(self, fpara):
+		global last
+		last= None
+		lnp= self.func(fpara)
+		return lnp, record()
+
+class timings:
+	'''
+	Aggregated timings of the Monte Carlo simulations, stored in epos.timings
+
+	Attributes:
+		ncalls(int): number of simulations
+		stages(dict): total wall time and histogram for each stage
+		sizes(dict): total and histogram of array sizes
+		rejected(dict): number of rejected parameter sets for each reason
+		peakrss(int): peak memory of the (worker) processes, not of a single 
+			simulation (resident set size, kB)
+		drss(int): largest increase of the peak memory during a simulation (kB)
+	'''
+	tbins= np.logspace(-6, 3, 46) # seconds
+	nbins= np.logspace(0, 9, 46) # array size
+
+	def __init__(self):
+		self.ncalls= 0
+		self.stages= {}
+		self.sizes= {}
+		self.rejected= {}
+		self.peakrss= 0
+		self.drss= 0
+
+	def add(self, rec):
+		''' Add the record of one call '''
+		if rec is None: return
+		self.ncalls+= 1
+
+		for key, t in rec['stages'].items()+[('total',rec['total'])]:
+			if not key in self.stages:
+				self.stages[key]= {'total':0., 'count':0,
+					'hist':np.zeros(self.tbins.size-1, dtype=int)}
+			st= self.stages[key]
+			st['total']+= t
+			st['count']+= 1
+			st['hist'][np.clip(np.searchsorted(self.tbins, t)-1, 0, st['hist'].size-1)]+= 1
+
+		for key, n in rec['sizes'].items():
+			if not key in self.sizes:
+				self.sizes[key]= {'total':0, 'count':0,
+					'hist':np.zeros(self.nbins.size-1, dtype=int)}
+			sz= self.sizes[key]
+			sz['total']+= n
+			sz['count']+= 1
+			sz['hist'][np.clip(np.searchsorted(self.nbins, n)-1, 0, sz['hist'].size-1)]+= 1
+
+		if rec['rejected'] is not None:
+			self.rejected[rec['rejected']]= self.rejected.get(rec['rejected'], 0) + 1
+
+		if 'peakrss' in rec:
+			self.peakrss= max(self.peakrss, rec['peakrss'])
+			self.drss= max(self.drss, rec['drss'])
+
+	def summary(self):
+		print '\nTimings of {} simulations'.format(self.ncalls)
+		if 'total' in self.stages:
+			total= self.stages['total']['total']
+			for key, st in sorted(self.stages.items(), key=lambda x: -x[1]['total']):
+				if key == 'total': continue
+				print '  {:10s} {:8.3f} ms per call ({:.1%})'.format(key,
+					1e3*st['total']/st['count'], st['total']/total)
+			print '  {:10s} {:8.3f} ms per call'.format('total',
+				1e3*total/self.stages['total']['count'])
+		for key, sz in sorted(self.sizes.items()):
+			print '  {:10s} {:8.0f} on average'.format(key, 1.*sz['total']/sz['count'])
+		for key, n in sorted(self.rejected.items()):
+			print '  rejected: {} ({})'.format(n, key)
+		if self.peakrss > 0:
+			print '  peak memory {:.0f} MB (process), +{:.1f} MB in a simulation'.format(
+				self.peakrss/1024., self.drss/1024.)
+
+	def save(self, fname):
+		tosave= {'ncalls':self.ncalls, 'stages':self.stages, 'sizes':self.sizes,
+			'rejected':self.rejected, 'peakrss':self.peakrss, 'drss':self.drss,
+			'time bins':self.tbins, 'size bins':self.nbins}
+		with open(fname, 'w') as f:
+			json.dump(tosave, f, default=serialize_numpy_array)